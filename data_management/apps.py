@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class DataManagementConfig(AppConfig):
     name = "data_management"
+
+    def ready(self):
+        # connect the receivers that maintain the lineage closure table and the
+        # provenance fingerprints
+        from . import fingerprint, lineage  # noqa: F401
@@ -0,0 +1,276 @@
+"""
+Maintenance of the provenance fingerprints of `DataProduct`s.
+
+The provenance fingerprint of a `DataProduct` is a Merkle-style hash of what it was
+derived from: the hash held by the `StorageLocation` of its `Object`, and for each
+`CodeRun` that generated it, the hashes of the code repo, model config and submission
+script of the run along with the fingerprints of the `DataProduct`s it used as inputs.
+Two `DataProduct`s with the same fingerprint hold the same file and were generated by
+the same code from identical inputs, so an identical recomputation is found with a
+single indexed lookup on `DataProduct.provenance_fingerprint` instead of by walking the
+graph. Names, versions, issues and authors are not covered, except that a
+`DataProduct` whose `Object` has no `StorageLocation` is identified by its namespace,
+name and version in place of the hash of its file.
+
+The fingerprints are updated incrementally. Whenever the lineage closure table is
+refreshed, as the inputs or outputs of a `CodeRun` change or a `DataProduct` is created,
+the fingerprints of the same `DataProduct`s are recalculated, see `lineage.refresh`. The
+signal receivers below also recalculate them when an existing `CodeRun`, `Object` or
+`StorageLocation` is changed. The descendants of a changed `DataProduct` are found from
+the closure table and recalculated in order of their number of ancestors, so the
+fingerprints of the inputs are always calculated before they are used. As with the
+closure table, changes that do not send signals are not tracked, the fingerprints are
+recreated along with the table by the `rebuild_lineage` management command.
+"""
+
+from collections import defaultdict
+import hashlib
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import models
+
+BATCH_SIZE = 1000
+
+
+def _read_data_products(data_product_ids):
+    """
+    Read what identifies the content of `DataProduct`s, and the `CodeRun`s that
+    generated them.
+
+    @param data_product_ids: an iterable of `DataProduct` ids
+
+    @return a tuple of a dict of the content lines, a dict of the current fingerprints
+        and a dict of sets of `CodeRun` ids, all keyed by `DataProduct` id
+
+    """
+    lines = {}
+    current = {}
+    code_runs = defaultdict(set)
+    for (
+        data_product_id,
+        storage_hash,
+        namespace,
+        name,
+        version,
+        fingerprint,
+        code_run_id,
+    ) in models.DataProduct.objects.filter(id__in=data_product_ids).values_list(
+        "id",
+        "object__storage_location__hash",
+        "namespace__name",
+        "name",
+        "version",
+        "provenance_fingerprint",
+        "object__components__outputs_of",
+    ):
+        if storage_hash:
+            lines[data_product_id] = f"storage:{storage_hash}"
+        else:
+            lines[data_product_id] = f"data_product:{namespace}:{name}@{version}"
+        current[data_product_id] = fingerprint
+        if code_run_id is not None:
+            code_runs[data_product_id].add(code_run_id)
+    return lines, current, code_runs
+
+
+def _code_run_lines(code_run_ids):
+    """
+    Read the hashes of the code used by `CodeRun`s, and their input `DataProduct`s.
+
+    @param code_run_ids: an iterable of `CodeRun` ids
+
+    @return a tuple of a dict of the code lines, and a dict of sets of input
+        `DataProduct` ids, both keyed by `CodeRun` id
+
+    """
+    lines = {}
+    inputs = defaultdict(set)
+    if not code_run_ids:
+        return lines, inputs
+
+    for code_run_id, repo, config, script in models.CodeRun.objects.filter(
+        id__in=code_run_ids
+    ).values_list(
+        "id",
+        "code_repo__storage_location__hash",
+        "model_config__storage_location__hash",
+        "submission_script__storage_location__hash",
+    ):
+        lines[code_run_id] = f"code_run:{repo}:{config}:{script}"
+
+    for code_run_id, data_product_id in models.CodeRun.objects.filter(
+        id__in=code_run_ids, inputs__object__data_products__isnull=False
+    ).values_list("id", "inputs__object__data_products"):
+        inputs[code_run_id].add(data_product_id)
+    return lines, inputs
+
+
+def _calculate(data_product_ids):
+    """
+    Calculate the fingerprints of `DataProduct`s. The fingerprints of any inputs that
+    are not being calculated are read from the database.
+
+    @param data_product_ids: a set of `DataProduct` ids
+
+    @return a tuple of a dict of the new fingerprints, and a dict of the current
+        fingerprints, both keyed by `DataProduct` id
+
+    """
+    content_lines, current, code_runs = _read_data_products(data_product_ids)
+    data_product_ids = set(content_lines)
+    code_run_lines, inputs = _code_run_lines(set().union(*code_runs.values()))
+
+    fingerprints = {}
+    boundary = set().union(*inputs.values()) - data_product_ids
+    if boundary:
+        fingerprints.update(
+            models.DataProduct.objects.filter(id__in=boundary).values_list(
+                "id", "provenance_fingerprint"
+            )
+        )
+
+    # the ancestors of a data product always have fewer ancestors than it does
+    ancestor_counts = {}
+    if len(data_product_ids) > 1:
+        ancestor_counts = dict(
+            models.DataProductLineage.objects.filter(descendant_id__in=data_product_ids)
+            .values("descendant_id")
+            .annotate(count=Count("id"))
+            .values_list("descendant_id", "count")
+        )
+
+    new = {}
+    for data_product_id in sorted(
+        data_product_ids, key=lambda dp_id: (ancestor_counts.get(dp_id, 0), dp_id)
+    ):
+        lines = [content_lines[data_product_id]]
+        for code_run_id in code_runs[data_product_id]:
+            input_fingerprints = sorted(
+                str(fingerprints.get(input_id))
+                for input_id in inputs[code_run_id]
+                if input_id != data_product_id
+            )
+            lines.append(
+                f"{code_run_lines[code_run_id]}:{','.join(input_fingerprints)}"
+            )
+        # the lines of the code runs are sorted so the order they are found in does
+        # not matter
+        lines[1:] = sorted(lines[1:])
+        fingerprint = hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+        fingerprints[data_product_id] = fingerprint
+        new[data_product_id] = fingerprint
+    return new, current
+
+
+def _save(fingerprints, current):
+    """
+    Save the fingerprints that have changed, without changing `last_updated` or sending
+    signals.
+
+    @return the number of fingerprints saved
+
+    """
+    changed = [
+        models.DataProduct(id=data_product_id, provenance_fingerprint=fingerprint)
+        for data_product_id, fingerprint in fingerprints.items()
+        if current.get(data_product_id) != fingerprint
+    ]
+    if len(changed) == 1:
+        models.DataProduct.objects.filter(id=changed[0].id).update(
+            provenance_fingerprint=changed[0].provenance_fingerprint
+        )
+    else:
+        models.DataProduct.objects.bulk_update(
+            changed, ["provenance_fingerprint"], batch_size=BATCH_SIZE
+        )
+    return len(changed)
+
+
+def refresh(data_product_ids, descendants=True):
+    """
+    Recalculate the fingerprints of `DataProduct`s, and of everything descended from
+    them.
+
+    @param data_product_ids: an iterable of `DataProduct` ids
+    @param descendants: False if the ids already include all of the descendants
+
+    """
+    data_product_ids = set(data_product_ids)
+    if not data_product_ids:
+        return
+    with transaction.atomic():
+        if descendants:
+            data_product_ids.update(
+                models.DataProductLineage.objects.filter(
+                    ancestor_id__in=data_product_ids
+                ).values_list("descendant_id", flat=True)
+            )
+        _save(*_calculate(data_product_ids))
+
+
+def rebuild():
+    """
+    Recalculate the fingerprints of all of the `DataProduct`s.
+
+    @return the number of fingerprints that changed
+
+    """
+    with transaction.atomic():
+        return _save(
+            *_calculate(set(models.DataProduct.objects.values_list("id", flat=True)))
+        )
+
+
+def refresh_for_objects(object_ids):
+    """
+    Recalculate the fingerprints affected by a change to the files of `Object`s, those
+    of the `DataProduct`s of the objects and of the outputs of the `CodeRun`s that used
+    them as code.
+
+    @param object_ids: an iterable of `Object` ids
+
+    """
+    object_ids = set(object_ids)
+    if not object_ids:
+        return
+    refresh(
+        set(
+            models.DataProduct.objects.filter(object_id__in=object_ids).values_list(
+                "id", flat=True
+            )
+        )
+        | set(
+            models.DataProduct.objects.filter(
+                Q(object__components__outputs_of__code_repo_id__in=object_ids)
+                | Q(object__components__outputs_of__model_config_id__in=object_ids)
+                | Q(object__components__outputs_of__submission_script_id__in=object_ids)
+            ).values_list("id", flat=True)
+        )
+    )
+
+
+@receiver(post_save, sender=models.CodeRun)
+def _code_run_saved(sender, instance, created, raw=False, **kwargs):
+    # a new code run does not have any outputs yet
+    if not (created or raw):
+        refresh(
+            models.DataProduct.objects.filter(
+                object__components__outputs_of=instance
+            ).values_list("id", flat=True)
+        )
+
+
+@receiver(post_save, sender=models.Object)
+def _object_saved(sender, instance, created, raw=False, **kwargs):
+    if not (created or raw):
+        refresh_for_objects([instance.pk])
+
+
+@receiver(post_save, sender=models.StorageLocation)
+def _storage_location_saved(sender, instance, created, raw=False, **kwargs):
+    if not (created or raw):
+        refresh_for_objects(instance.location_for_object.values_list("id", flat=True))
@@ -0,0 +1,563 @@
+"""
+Batched loading of the provenance graph.
+
+The provenance report and the RO Crate are both built by walking the graph from a
+`DataProduct` back through the `CodeRun`s that generated it, one level of inputs at a
+time. Walking the graph through the model relations issues several queries for every
+node visited, so instead each level is fetched with a small, fixed number of bulk
+queries and held in an in-memory index keyed by id. The builders then read from the
+index, so the number of queries depends on the depth of the report and not on the
+number of nodes in the graph.
+"""
+
+from collections import defaultdict
+import hashlib
+
+from . import models
+
+
+class LineageGraph:
+    """
+    An in-memory index of the part of the provenance graph that has been loaded.
+
+    Use `load_level` to fetch a level of `DataProduct`s along with the `CodeRun`s that
+    generated them and the inputs of those `CodeRun`s. All of the records are then
+    available from the accessor methods without any further database queries.
+
+    The provenance report and the RO Crates load their graph a level at a time, so the
+    number of queries they make depends on the depth of the report or crate rather than
+    on the number of data products in it.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.data_products = {}
+        self.code_runs = {}
+        self._object_data_products = defaultdict(list)
+        self._object_components = defaultdict(list)
+        self._object_authors = defaultdict(list)
+        self._object_licences = defaultdict(list)
+        self._component_issues = defaultdict(list)
+        self._component_code_run = {}
+        self._code_run_inputs = defaultdict(list)
+        self._code_run_outputs = defaultdict(list)
+        self._user_authors = {}
+
+    def load_objects(self, object_ids):
+        """
+        Fetch the given `Object`s, along with their storage locations, file types, code
+        repo releases, data products, components, issues, authors and licences.
+
+        Objects that have already been loaded are not fetched again.
+
+        @param object_ids: an iterable of `Object` ids
+
+        """
+        new_ids = set(object_ids) - set(self.objects) - {None}
+        if not new_ids:
+            return
+
+        for obj in models.Object.objects.filter(id__in=new_ids).select_related(
+            "storage_location__storage_root", "file_type", "code_repo_release"
+        ):
+            self.objects[obj.id] = obj
+
+        for data_product in (
+            models.DataProduct.objects.filter(object_id__in=new_ids)
+            .select_related(
+                "namespace", "external_object__original_store__storage_root"
+            )
+            .order_by("id")
+        ):
+            data_product.object = self.objects[data_product.object_id]
+            self.data_products[data_product.id] = data_product
+            self._object_data_products[data_product.object_id].append(data_product)
+
+        component_ids = []
+        for component in models.ObjectComponent.objects.filter(
+            object_id__in=new_ids
+        ).order_by("id"):
+            component.object = self.objects[component.object_id]
+            self._object_components[component.object_id].append(component)
+            component_ids.append(component.id)
+
+        for link in (
+            models.ObjectComponent.issues.through.objects.filter(
+                objectcomponent_id__in=component_ids
+            )
+            .select_related("issue")
+            .order_by("-issue__last_updated", "id")
+        ):
+            self._component_issues[link.objectcomponent_id].append(link.issue)
+
+        for link in (
+            models.Object.authors.through.objects.filter(object_id__in=new_ids)
+            .select_related("author")
+            .order_by("id")
+        ):
+            self._object_authors[link.object_id].append(link.author)
+
+        for licence in models.Licence.objects.filter(object_id__in=new_ids):
+            self._object_licences[licence.object_id].append(licence)
+
+    def load_level(self, data_products):
+        """
+        Fetch everything needed to add the given `DataProduct`s to a report.
+
+        This loads the `CodeRun`s that generated the data products, the `Object`s used by
+        those code runs and the input components, and hence the `DataProduct`s that will
+        make up the next level of the report.
+
+        @param data_products: an iterable of `DataProduct`s, or `DataProduct` ids
+
+        @return a list of the loaded `DataProduct`s, in the order given
+
+        """
+        data_product_ids = [getattr(dp, "id", dp) for dp in data_products]
+        missing = set(data_product_ids) - set(self.data_products)
+        if missing:
+            self.load_objects(
+                models.DataProduct.objects.filter(id__in=missing).values_list(
+                    "object_id", flat=True
+                )
+            )
+
+        level = [self.data_products[dp_id] for dp_id in data_product_ids]
+
+        component_ids = [
+            component.id
+            for data_product in level
+            for component in self._object_components[data_product.object_id]
+            if component.id not in self._component_code_run
+        ]
+        if not component_ids:
+            return level
+
+        for component_id in component_ids:
+            self._component_code_run[component_id] = None
+
+        new_code_runs = {}
+        for link in (
+            models.CodeRun.outputs.through.objects.filter(
+                objectcomponent_id__in=component_ids
+            )
+            .select_related("coderun__updated_by")
+            .order_by("-coderun__last_updated", "id")
+        ):
+            # a component is only generated by one code run, if there happen to be
+            # more use the most recent one
+            if self._component_code_run[link.objectcomponent_id] is not None:
+                continue
+            code_run = self.code_runs.get(link.coderun_id) or new_code_runs.get(
+                link.coderun_id, link.coderun
+            )
+            new_code_runs.setdefault(code_run.id, code_run)
+            self._component_code_run[link.objectcomponent_id] = code_run
+
+        self._load_code_runs(
+            [
+                code_run
+                for cr_id, code_run in new_code_runs.items()
+                if cr_id not in self.code_runs
+            ]
+        )
+
+        return level
+
+    def load_code_run(self, code_run):
+        """
+        Fetch a `CodeRun` along with its inputs and outputs.
+
+        @param code_run: a `CodeRun`, or a `CodeRun` id
+
+        @return the loaded `CodeRun`
+
+        """
+        code_run_id = getattr(code_run, "id", code_run)
+        if code_run_id not in self.code_runs:
+            code_run = models.CodeRun.objects.select_related("updated_by").get(
+                id=code_run_id
+            )
+            self._load_code_runs([code_run])
+        code_run = self.code_runs[code_run_id]
+
+        if code_run_id not in self._code_run_outputs:
+            output_links = list(
+                models.CodeRun.outputs.through.objects.filter(coderun_id=code_run_id)
+                .select_related("objectcomponent")
+                .order_by("id")
+            )
+            self.load_objects(link.objectcomponent.object_id for link in output_links)
+            outputs = self._code_run_outputs[code_run_id]
+            for link in output_links:
+                component = link.objectcomponent
+                component.object = self.objects[component.object_id]
+                outputs.append(component)
+
+        return code_run
+
+    def _load_code_runs(self, code_runs):
+        """
+        Add `CodeRun`s to the index, fetching the `Object`s they reference and their
+        input components in bulk.
+        """
+        if not code_runs:
+            return
+        for code_run in code_runs:
+            self.code_runs[code_run.id] = code_run
+
+        input_links = list(
+            models.CodeRun.inputs.through.objects.filter(
+                coderun_id__in=[code_run.id for code_run in code_runs]
+            )
+            .select_related("objectcomponent")
+            .order_by("id")
+        )
+
+        object_ids = {link.objectcomponent.object_id for link in input_links}
+        for code_run in code_runs:
+            object_ids.update(
+                (
+                    code_run.code_repo_id,
+                    code_run.model_config_id,
+                    code_run.submission_script_id,
+                )
+            )
+        self.load_objects(object_ids)
+
+        for code_run in code_runs:
+            code_run.code_repo = self.objects.get(code_run.code_repo_id)
+            code_run.model_config = self.objects.get(code_run.model_config_id)
+            code_run.submission_script = self.objects[code_run.submission_script_id]
+
+        for link in input_links:
+            component = link.objectcomponent
+            component.object = self.objects[component.object_id]
+            self._code_run_inputs[link.coderun_id].append(component)
+
+        self._load_user_authors(code_run.updated_by_id for code_run in code_runs)
+
+    def _load_user_authors(self, user_ids):
+        new_ids = set(user_ids) - set(self._user_authors)
+        if not new_ids:
+            return
+        for user_id in new_ids:
+            self._user_authors[user_id] = None
+        for user_author in (
+            models.UserAuthor.objects.filter(user_id__in=new_ids)
+            .select_related("author")
+            .order_by("-last_updated")
+        ):
+            if self._user_authors[user_author.user_id] is None:
+                self._user_authors[user_author.user_id] = user_author.author
+
+    def fingerprint(self):
+        """
+        Calculate a fingerprint of the loaded part of the graph.
+
+        The fingerprint covers the id and `last_updated` time of every record that has
+        been loaded, along with the links between them. Any change to a record in the
+        graph, or to which records are linked together, results in a new fingerprint.
+
+        @return a str containing the hex digest of the fingerprint
+
+        """
+        lines = set()
+
+        def add(record):
+            _add_record(lines, record)
+
+        for obj in self.objects.values():
+            add(obj)
+            add(obj.file_type)
+            if obj.storage_location is not None:
+                add(obj.storage_location)
+                add(obj.storage_location.storage_root)
+            try:
+                add(obj.code_repo_release)
+            except models.Object.code_repo_release.RelatedObjectDoesNotExist:
+                pass
+
+        for data_product in self.data_products.values():
+            add(data_product)
+            add(data_product.namespace)
+            try:
+                external_object = data_product.external_object
+            except models.DataProduct.external_object.RelatedObjectDoesNotExist:
+                continue
+            add(external_object)
+            if external_object.original_store is not None:
+                add(external_object.original_store)
+                add(external_object.original_store.storage_root)
+
+        for code_run in self.code_runs.values():
+            add(code_run)
+            lines.update(
+                f"input:{code_run.id}:{component.id}"
+                for component in self._code_run_inputs[code_run.id]
+            )
+            lines.update(
+                f"output:{code_run.id}:{component.id}"
+                for component in self._code_run_outputs.get(code_run.id, ())
+            )
+
+        for components in self._object_components.values():
+            for component in components:
+                add(component)
+        for component_id, code_run in self._component_code_run.items():
+            if code_run is not None:
+                lines.add(f"generated_by:{component_id}:{code_run.id}")
+        for component_id, issues in self._component_issues.items():
+            for issue in issues:
+                add(issue)
+                lines.add(f"issue:{component_id}:{issue.id}")
+        for object_id, authors in self._object_authors.items():
+            for author in authors:
+                add(author)
+                lines.add(f"author:{object_id}:{author.id}")
+        for licences in self._object_licences.values():
+            for licence in licences:
+                add(licence)
+        for user_id, author in self._user_authors.items():
+            add(author)
+            lines.add(f"user_author:{user_id}:{author.id if author else None}")
+
+        return _digest(lines)
+
+    def fragment_fingerprint(self, data_product):
+        """
+        Calculate a fingerprint of the records that a single level of the provenance of
+        a data product is generated from.
+
+        This covers the `Object` of the data product, along with its components, issues
+        and authors, the `CodeRun`s that generated it and the code repo, model config,
+        submission script and inputs of those code runs. Unlike `fingerprint`, it is not
+        changed by records further up or down the graph. The level containing the data
+        product must have been loaded.
+
+        @param data_product: a loaded `DataProduct`
+
+        @return a str containing the hex digest of the fingerprint
+
+        """
+        lines = set()
+        self._add_object_lines(lines, data_product.object)
+
+        for component in self.components_of(data_product.object):
+            code_run = self.code_run_of(component)
+            if code_run is None:
+                continue
+            lines.add(f"generated_by:{component.id}:{code_run.id}")
+            _add_record(lines, code_run)
+            user = code_run.updated_by
+            author = self.author_for_user(user)
+            _add_record(lines, author)
+            lines.add(f"user:{user.id}:{user.full_name()}")
+            lines.add(f"user_author:{user.id}:{author.id if author else None}")
+            for obj in (
+                code_run.code_repo,
+                code_run.model_config,
+                code_run.submission_script,
+            ):
+                if obj is not None:
+                    self._add_object_lines(lines, obj)
+            for input_component in self.inputs_of(code_run):
+                lines.add(f"input:{code_run.id}:{input_component.id}")
+                self._add_object_lines(lines, input_component.object)
+
+        return _digest(lines)
+
+    def _add_object_lines(self, lines, obj):
+        """
+        Add the lines fingerprinting an `Object`, along with the records describing it,
+        to a set of lines.
+        """
+        _add_record(lines, obj)
+        _add_record(lines, obj.file_type)
+        if obj.storage_location is not None:
+            _add_record(lines, obj.storage_location)
+            _add_record(lines, obj.storage_location.storage_root)
+        try:
+            _add_record(lines, obj.code_repo_release)
+        except models.Object.code_repo_release.RelatedObjectDoesNotExist:
+            pass
+
+        for data_product in self.data_products_of(obj):
+            lines.add(f"data_product:{obj.id}:{data_product.id}")
+            _add_record(lines, data_product)
+            _add_record(lines, data_product.namespace)
+            try:
+                external_object = data_product.external_object
+            except models.DataProduct.external_object.RelatedObjectDoesNotExist:
+                continue
+            _add_record(lines, external_object)
+            if external_object.original_store is not None:
+                _add_record(lines, external_object.original_store)
+                _add_record(lines, external_object.original_store.storage_root)
+
+        for component in self.components_of(obj):
+            _add_record(lines, component)
+            for issue in self.issues_of(component):
+                _add_record(lines, issue)
+                lines.add(f"issue:{component.id}:{issue.id}")
+        for author in self.authors_of(obj):
+            _add_record(lines, author)
+            lines.add(f"author:{obj.id}:{author.id}")
+
+    def data_products_of(self, obj):
+        """
+        @return the list of `DataProduct`s associated with the `Object`
+        """
+        return self._object_data_products[obj.id]
+
+    def components_of(self, obj):
+        """
+        @return the list of `ObjectComponent`s of the `Object`
+        """
+        return self._object_components[obj.id]
+
+    def authors_of(self, obj):
+        """
+        @return the list of `Author`s of the `Object`
+        """
+        return self._object_authors[obj.id]
+
+    def licences_of(self, obj):
+        """
+        @return the list of `Licence`s of the `Object`
+        """
+        return self._object_licences[obj.id]
+
+    def issues_of(self, component):
+        """
+        @return the list of `Issue`s attached to the `ObjectComponent`
+        """
+        return self._component_issues[component.id]
+
+    def code_run_of(self, component):
+        """
+        @return the `CodeRun` that generated the `ObjectComponent`, may be None
+        """
+        return self._component_code_run.get(component.id)
+
+    def inputs_of(self, code_run):
+        """
+        @return the list of input `ObjectComponent`s of the `CodeRun`
+        """
+        return self._code_run_inputs[code_run.id]
+
+    def outputs_of(self, code_run):
+        """
+        @return the list of output `ObjectComponent`s of a `CodeRun` loaded with
+        `load_code_run`
+        """
+        return self._code_run_outputs[code_run.id]
+
+    def author_for_user(self, user):
+        """
+        @return the `Author` linked to the user by a `UserAuthor`, may be None
+        """
+        return self._user_authors.get(user.id)
+
+    def input_data_products(self, data_product):
+        """
+        Get the list of data products used to produce the given data product.
+
+        @param data_product: a loaded `DataProduct`
+
+        @return a list of `DataProduct`s, may contain duplicates
+
+        """
+        input_data_products = []
+        for component in self.components_of(data_product.object):
+            code_run = self.code_run_of(component)
+            if code_run is None:
+                continue
+            input_data_products.extend(self.code_run_input_data_products(code_run))
+        return input_data_products
+
+    def code_run_input_data_products(self, code_run):
+        """
+        Get the list of data products used as inputs to the given code run.
+
+        @param code_run: a loaded `CodeRun`
+
+        @return a list of `DataProduct`s, may contain duplicates
+
+        """
+        input_data_products = []
+        for component in self.inputs_of(code_run):
+            input_data_products.extend(self.data_products_of(component.object))
+        return input_data_products
+
+
+def _add_record(lines, record):
+    if record is not None:
+        lines.add(f"{record._meta.label}:{record.id}:{record.last_updated.isoformat()}")
+
+
+def _digest(lines):
+    digest = hashlib.sha256()
+    for line in sorted(lines):
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class LineageWalk:
+    """
+    Track the `DataProduct`s and `CodeRun`s visited while walking the graph a level at
+    a time.
+
+    Where lineage is diamond shaped, i.e. several code runs share an upstream input, the
+    same node is reached by more than one path. Each node is only expanded the first
+    time that it is reached, and the number of nodes skipped is counted.
+    """
+
+    def __init__(self):
+        self.data_products = set()
+        self.code_runs = set()
+        self.skipped_data_products = 0
+        self.skipped_code_runs = 0
+
+    @property
+    def skipped(self):
+        """
+        @return the total number of nodes that were skipped
+        """
+        return self.skipped_data_products + self.skipped_code_runs
+
+    def unvisited(self, data_products):
+        """
+        Get the data products that have not been visited yet, marking them as visited.
+
+        @param data_products: an iterable of `DataProduct`s, may contain duplicates
+
+        @return a list of the `DataProduct`s that had not been visited, in the order
+            given
+
+        """
+        level = []
+        for data_product in data_products:
+            if data_product.id in self.data_products:
+                self.skipped_data_products += 1
+                continue
+            self.data_products.add(data_product.id)
+            level.append(data_product)
+        return level
+
+    def visit_code_run(self, code_run):
+        """
+        Mark a code run as visited.
+
+        @param code_run: a `CodeRun`, or a `CodeRun` id
+
+        @return True if the code run had not already been visited
+
+        """
+        code_run_id = getattr(code_run, "id", code_run)
+        if code_run_id in self.code_runs:
+            self.skipped_code_runs += 1
+            return False
+        self.code_runs.add(code_run_id)
+        return True
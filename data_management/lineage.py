@@ -0,0 +1,559 @@
+"""
+Maintenance of the `DataProductLineage` closure table.
+
+A `DataProduct` is a direct parent of another if a component of its `Object` is an
+input of a `CodeRun` that has a component of the other's `Object` as an output. The
+closure table holds a row for every ancestor of every `DataProduct`, along with the
+shortest distance between them, so a whole ancestry, or everything downstream of a
+product, can be found with a single indexed query instead of walking the graph one
+level at a time.
+
+The table is kept up to date by the signal receivers below, which recalculate the rows
+of the `DataProduct`s whose parents have changed, and of their descendants, whenever
+the `inputs` or `outputs` of a `CodeRun` change, a `DataProduct` is saved, an
+`ObjectComponent` is saved with a different `Object`, or a `DataProduct`, `CodeRun` or
+`ObjectComponent` is deleted. Saving a `CodeRun` does not change its lineage. Changes that do not send signals, such as
+`QuerySet.update` or raw SQL, are not tracked, after which the table can be recreated
+with the `rebuild_lineage` management command. The provenance fingerprints of the
+`DataProduct`s whose rows are recalculated are recalculated along with them, see
+`data_management.fingerprint`.
+
+`LineageQuery` finds everything upstream or downstream of a `DataProduct` directly from
+the `CodeRun` inputs and outputs with a recursive common table expression, so it does
+not depend on the closure table being up to date.
+
+The closure table also serves as the index of the impact of `Issue`s. A `DataProduct` is
+affected by an `Issue` attached to a component of its own `Object`, or of the `Object`
+of any of its ancestors, so the affected `DataProduct`s are found by joining the issue
+links to the closure table, and stay up to date as issues are attached and as the
+lineage grows.
+"""
+
+from collections import defaultdict
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from . import fingerprint, models
+
+BATCH_SIZE = 1000
+
+ANCESTORS = "ancestors"
+DESCENDANTS = "descendants"
+DIRECTIONS = (ANCESTORS, DESCENDANTS)
+
+DATA_PRODUCT = "data_product"
+CODE_RUN = "code_run"
+KINDS = (DATA_PRODUCT, CODE_RUN)
+
+
+def _parent_map(data_product_ids=None):
+    """
+    Find the direct parents of `DataProduct`s.
+
+    @param data_product_ids: an iterable of `DataProduct` ids, or None for all of them
+
+    @return a dict of sets of parent ids, keyed by `DataProduct` id
+
+    """
+    queryset = models.DataProduct.objects.all()
+    if data_product_ids is not None:
+        queryset = queryset.filter(id__in=data_product_ids)
+    parents = defaultdict(set)
+    for data_product_id, parent_id in queryset.filter(
+        object__components__outputs_of__inputs__object__data_products__isnull=False
+    ).values_list(
+        "id", "object__components__outputs_of__inputs__object__data_products"
+    ):
+        if parent_id is not None and parent_id != data_product_id:
+            parents[data_product_id].add(parent_id)
+    return parents
+
+
+def _closure(data_product_ids):
+    """
+    Read the existing ancestors of `DataProduct`s from the closure table.
+
+    @param data_product_ids: an iterable of `DataProduct` ids
+
+    @return a dict of dicts of distances keyed by ancestor id, keyed by `DataProduct` id
+
+    """
+    ancestors = defaultdict(dict)
+    for link in models.DataProductLineage.objects.filter(
+        descendant_id__in=data_product_ids
+    ).values_list("descendant_id", "ancestor_id", "distance"):
+        ancestors[link[0]][link[1]] = link[2]
+    return ancestors
+
+
+def _ancestors(data_product_id, parents, known):
+    """
+    Find the ancestors of a `DataProduct` by a breadth first search of its parents.
+
+    The search stops at any `DataProduct` in `known`, whose ancestors are taken from
+    there instead.
+
+    @param data_product_id: the id of the `DataProduct`
+    @param parents: a dict of sets of parent ids, keyed by `DataProduct` id
+    @param known: a dict of dicts of distances keyed by ancestor id, keyed by
+        `DataProduct` id
+
+    @return a dict of distances keyed by ancestor id
+
+    """
+    distances = {}
+
+    def add(ancestor, distance):
+        if distance < distances.get(ancestor, distance + 1):
+            distances[ancestor] = distance
+
+    frontier = [data_product_id]
+    seen = {data_product_id}
+    distance = 0
+    while frontier:
+        distance += 1
+        next_frontier = []
+        for node in frontier:
+            for parent in parents.get(node, ()):
+                if parent in seen:
+                    continue
+                seen.add(parent)
+                add(parent, distance)
+                if parent in known:
+                    for ancestor, extra in known[parent].items():
+                        add(ancestor, distance + extra)
+                else:
+                    next_frontier.append(parent)
+        frontier = next_frontier
+    distances.pop(data_product_id, None)
+    return distances
+
+
+def _create_rows(ancestors):
+    models.DataProductLineage.objects.bulk_create(
+        (
+            models.DataProductLineage(
+                ancestor_id=ancestor_id,
+                descendant_id=descendant_id,
+                distance=distance,
+            )
+            for descendant_id, distances in ancestors.items()
+            for ancestor_id, distance in distances.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def refresh(data_product_ids):
+    """
+    Recalculate the closure rows of `DataProduct`s whose parents have changed.
+
+    The rows of the given `DataProduct`s and of everything descended from them are
+    replaced. Any other ancestors reached are left as they are, and their existing rows
+    are used to complete the ancestry.
+
+    @param data_product_ids: an iterable of `DataProduct` ids
+
+    """
+    data_product_ids = set(data_product_ids)
+    if not data_product_ids:
+        return
+    with transaction.atomic():
+        affected = data_product_ids.union(
+            models.DataProductLineage.objects.filter(
+                ancestor_id__in=data_product_ids
+            ).values_list("descendant_id", flat=True)
+        )
+        models.DataProductLineage.objects.filter(descendant_id__in=affected).delete()
+        affected.intersection_update(
+            models.DataProduct.objects.filter(id__in=affected).values_list(
+                "id", flat=True
+            )
+        )
+
+        parents = _parent_map(affected)
+        boundary = set().union(*parents.values()) - affected
+        known = _closure(boundary)
+        for data_product_id in boundary:
+            known.setdefault(data_product_id, {})
+
+        _create_rows(
+            {
+                data_product_id: _ancestors(data_product_id, parents, known)
+                for data_product_id in affected
+            }
+        )
+
+        # the provenance fingerprints depend on the same parents
+        fingerprint.refresh(affected, descendants=False)
+
+
+def rebuild():
+    """
+    Recreate the whole closure table from the `CodeRun` inputs and outputs.
+
+    @return the number of rows in the table
+
+    """
+    with transaction.atomic():
+        models.DataProductLineage.objects.all().delete()
+        parents = _parent_map()
+        _create_rows(
+            {
+                data_product_id: _ancestors(data_product_id, parents, {})
+                for data_product_id in parents
+            }
+        )
+        return models.DataProductLineage.objects.count()
+
+
+class LineageQuery:
+    """
+    The `DataProduct`s or `CodeRun`s upstream or downstream of a `DataProduct`.
+
+    The lineage is found with a recursive common table expression, supported by both
+    PostgreSQL and SQLite, that follows the links from each `DataProduct` through the
+    `CodeRun`s that used it, or generated it, one level at a time up to `max_depth`
+    levels. Every record is reported with its depth, the smallest number of `CodeRun`s
+    between it and the starting `DataProduct`, and the results are ordered by depth and
+    then id, so they can be paged through by the position of the last record seen.
+    """
+
+    def __init__(self, data_product_id, direction, max_depth, kind=DATA_PRODUCT):
+        """
+        @param data_product_id: the id of the `DataProduct` to start from
+        @param direction: `ANCESTORS` or `DESCENDANTS`
+        @param max_depth: the maximum number of `CodeRun`s to follow
+        @param kind: `DATA_PRODUCT` or `CODE_RUN`, the type of record to find
+
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError("Invalid lineage direction: %s" % direction)
+        if kind not in KINDS:
+            raise ValueError("Invalid lineage kind: %s" % kind)
+        self.data_product_id = data_product_id
+        self.direction = direction
+        self.max_depth = max_depth
+        self.kind = kind
+        self.model = models.DataProduct if kind == DATA_PRODUCT else models.CodeRun
+        self.connection = connections[router.db_for_read(self.model)]
+
+    def _table(self, model):
+        return self.connection.ops.quote_name(model._meta.db_table)
+
+    def _column(self, model, field_name):
+        return self.connection.ops.quote_name(model._meta.get_field(field_name).column)
+
+    def _sql(self):
+        """
+        Build the common table expressions, `lineage` holding every (id, depth) pair
+        reached, and `nodes` holding the requested records with their smallest depth.
+
+        @return a tuple of the SQL and its parameters
+
+        """
+        inputs = models.CodeRun.inputs.through
+        outputs = models.CodeRun.outputs.through
+        if self.direction == DESCENDANTS:
+            used_by, leads_to = inputs, outputs
+        else:
+            used_by, leads_to = outputs, inputs
+        tables = {
+            "data_product": self._table(models.DataProduct),
+            "component": self._table(models.ObjectComponent),
+            "used_by": self._table(used_by),
+            "leads_to": self._table(leads_to),
+            "object_id": self._column(models.DataProduct, "object"),
+            "component_object_id": self._column(models.ObjectComponent, "object"),
+            "component_id": self._column(used_by, "objectcomponent"),
+            "code_run_id": self._column(used_by, "coderun"),
+        }
+        sql = (
+            "WITH RECURSIVE lineage (id, depth) AS ("
+            " SELECT id, 0 FROM {data_product} WHERE id = %s"
+            " UNION"
+            " SELECT next_dp.id, lineage.depth + 1 FROM lineage"
+            " INNER JOIN {data_product} dp ON dp.id = lineage.id"
+            " INNER JOIN {component} c1 ON c1.{component_object_id} = dp.{object_id}"
+            " INNER JOIN {used_by} l1 ON l1.{component_id} = c1.id"
+            " INNER JOIN {leads_to} l2 ON l2.{code_run_id} = l1.{code_run_id}"
+            " INNER JOIN {component} c2 ON c2.id = l2.{component_id}"
+            " INNER JOIN {data_product} next_dp"
+            " ON next_dp.{object_id} = c2.{component_object_id}"
+            " WHERE lineage.depth < %s"
+            ")"
+        ).format(**tables)
+        params = [self.data_product_id, self.max_depth]
+        if self.kind == DATA_PRODUCT:
+            sql += (
+                ", nodes (id, depth) AS ("
+                " SELECT id, MIN(depth) FROM lineage WHERE id <> %s GROUP BY id"
+                ")"
+            )
+            params.append(self.data_product_id)
+        else:
+            sql += (
+                ", nodes (id, depth) AS ("
+                " SELECT l1.{code_run_id}, MIN(lineage.depth) + 1 FROM lineage"
+                " INNER JOIN {data_product} dp ON dp.id = lineage.id"
+                " INNER JOIN {component} c1"
+                " ON c1.{component_object_id} = dp.{object_id}"
+                " INNER JOIN {used_by} l1 ON l1.{component_id} = c1.id"
+                " WHERE lineage.depth < %s GROUP BY l1.{code_run_id}"
+                ")"
+            ).format(**tables)
+            params.append(self.max_depth)
+        return sql, params
+
+    def count(self):
+        """
+        Count the records in the lineage.
+
+        @return the number of records
+
+        """
+        sql, params = self._sql()
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql + " SELECT COUNT(*) FROM nodes", params)
+            return cursor.fetchone()[0]
+
+    def page(self, limit, position=None, reverse=False):
+        """
+        Fetch a page of the records in the lineage.
+
+        @param limit: the maximum number of records to return
+        @param position: a tuple of the (depth, id) of the record before the page, or
+            after it if `reverse` is True, or None to start from the beginning, or end
+        @param reverse: True to page backwards from `position`
+
+        @return a list of (id, depth) tuples, in order of depth and then id
+
+        """
+        sql, params = self._sql()
+        sql += " SELECT id, depth FROM nodes"
+        if position is not None:
+            depth, id_ = position
+            if reverse:
+                sql += " WHERE depth < %s OR (depth = %s AND id < %s)"
+            else:
+                sql += " WHERE depth > %s OR (depth = %s AND id > %s)"
+            params.extend([depth, depth, id_])
+        if reverse:
+            sql += " ORDER BY depth DESC, id DESC"
+        else:
+            sql += " ORDER BY depth, id"
+        sql += " LIMIT %s"
+        params.append(limit)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if reverse:
+            rows.reverse()
+        return [(row[0], row[1]) for row in rows]
+
+
+def issue_impact(issue_ids):
+    """
+    Get the `DataProduct`s affected by any of the given `Issue`s.
+
+    @param issue_ids: an iterable of `Issue` ids
+
+    @return a `DataProduct` QuerySet
+
+    """
+    issue_ids = list(issue_ids)
+    direct = models.DataProduct.objects.filter(
+        object__components__issues__in=issue_ids
+    ).values("id")
+    downstream = models.DataProductLineage.objects.filter(
+        ancestor__object__components__issues__in=issue_ids
+    ).values("descendant_id")
+    return models.DataProduct.objects.filter(Q(id__in=direct) | Q(id__in=downstream))
+
+
+def affected_data_products(issue_ids):
+    """
+    Find the `DataProduct`s affected by each of the given `Issue`s.
+
+    @param issue_ids: an iterable of `Issue` ids
+
+    @return a dict of sets of `DataProduct` ids, keyed by `Issue` id
+
+    """
+    issue_ids = list(issue_ids)
+    affected = defaultdict(set)
+    issue_links = models.ObjectComponent.issues.through.objects.filter(
+        issue_id__in=issue_ids
+    )
+    for issue_id, data_product_id in issue_links.values_list(
+        "issue_id", "objectcomponent__object__data_products"
+    ):
+        if data_product_id is not None:
+            affected[issue_id].add(data_product_id)
+    for issue_id, data_product_id in models.DataProductLineage.objects.filter(
+        ancestor__object__components__issues__in=issue_ids
+    ).values_list("ancestor__object__components__issues", "descendant_id"):
+        affected[issue_id].add(data_product_id)
+    return affected
+
+
+def tainted_data_products(data_product_ids):
+    """
+    Find which of the given `DataProduct`s have an ancestor with an `Issue`.
+
+    @param data_product_ids: an iterable of `DataProduct` ids
+
+    @return a set of `DataProduct` ids
+
+    """
+    return set(
+        models.DataProductLineage.objects.filter(
+            descendant_id__in=list(data_product_ids),
+            ancestor__object__components__issues__isnull=False,
+        ).values_list("descendant_id", flat=True)
+    )
+
+
+def _products_of_objects(object_ids):
+    return set(
+        models.DataProduct.objects.filter(object_id__in=object_ids).values_list(
+            "id", flat=True
+        )
+    )
+
+
+def _products_of_components(component_ids):
+    return set(
+        models.DataProduct.objects.filter(
+            object__components__in=component_ids
+        ).values_list("id", flat=True)
+    )
+
+
+def _outputs_of_code_runs(code_run_ids):
+    return set(
+        models.DataProduct.objects.filter(
+            object__components__outputs_of__in=code_run_ids
+        ).values_list("id", flat=True)
+    )
+
+
+def _outputs_using_objects(object_ids):
+    return set(
+        models.DataProduct.objects.filter(
+            object__components__outputs_of__inputs__object__in=object_ids
+        ).values_list("id", flat=True)
+    )
+
+
+def refresh_for_objects(object_ids):
+    """
+    Recalculate the closure rows affected by a change to the `DataProduct`s of
+    `Object`s.
+
+    @param object_ids: an iterable of `Object` ids
+
+    """
+    object_ids = set(object_ids)
+    if object_ids:
+        refresh(_products_of_objects(object_ids) | _outputs_using_objects(object_ids))
+
+
+@receiver(m2m_changed, sender=models.CodeRun.inputs.through)
+def _inputs_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # the instance is an ObjectComponent and pk_set holds CodeRun ids
+        if action == "pre_clear":
+            instance._lineage_code_runs = list(
+                instance.inputs_of.values_list("id", flat=True)
+            )
+        elif action == "post_clear":
+            refresh(_outputs_of_code_runs(instance.__dict__.pop("_lineage_code_runs")))
+        elif action in ("post_add", "post_remove"):
+            refresh(_outputs_of_code_runs(pk_set))
+    elif action in ("post_add", "post_remove", "post_clear"):
+        refresh(_outputs_of_code_runs([instance.pk]))
+
+
+@receiver(m2m_changed, sender=models.CodeRun.outputs.through)
+def _outputs_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # the instance is an ObjectComponent and pk_set holds CodeRun ids
+        if action in ("post_add", "post_remove", "post_clear"):
+            refresh(_products_of_objects([instance.object_id]))
+    elif action == "pre_clear":
+        instance._lineage_outputs = _outputs_of_code_runs([instance.pk])
+    elif action == "post_clear":
+        refresh(instance.__dict__.pop("_lineage_outputs"))
+    elif action in ("post_add", "post_remove"):
+        refresh(_products_of_components(pk_set))
+
+
+@receiver(post_save, sender=models.DataProduct)
+def _data_product_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh(
+            {instance.pk} | _outputs_using_objects([instance.object_id]),
+        )
+
+
+@receiver(pre_save, sender=models.ObjectComponent)
+def _component_saving(sender, instance, raw=False, **kwargs):
+    if instance.pk is not None and not raw:
+        instance._lineage_object_id = (
+            models.ObjectComponent.objects.filter(pk=instance.pk)
+            .values_list("object_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=models.ObjectComponent)
+def _component_saved(sender, instance, created, raw=False, **kwargs):
+    old_object_id = instance.__dict__.pop("_lineage_object_id", None)
+    if created or raw or old_object_id in (None, instance.object_id):
+        return
+    # the component has moved to another object, so the data products of both objects
+    # and the outputs of the code runs using the component have new parents
+    code_run_ids = set(instance.inputs_of.values_list("id", flat=True)) | set(
+        instance.outputs_of.values_list("id", flat=True)
+    )
+    refresh(
+        _products_of_objects([old_object_id, instance.object_id])
+        | _outputs_of_code_runs(code_run_ids)
+    )
+
+
+@receiver(pre_delete, sender=models.DataProduct)
+def _data_product_deleting(sender, instance, **kwargs):
+    instance._lineage_descendants = list(
+        instance.descendant_links.values_list("descendant_id", flat=True)
+    )
+
+
+@receiver(pre_delete, sender=models.CodeRun)
+def _code_run_deleting(sender, instance, **kwargs):
+    instance._lineage_descendants = list(_outputs_of_code_runs([instance.pk]))
+
+
+@receiver(pre_delete, sender=models.ObjectComponent)
+def _component_deleting(sender, instance, **kwargs):
+    instance._lineage_descendants = list(
+        _products_of_components([instance.pk])
+        | _outputs_of_code_runs(instance.inputs_of.values_list("id", flat=True))
+    )
+
+
+@receiver(post_delete, sender=models.DataProduct)
+@receiver(post_delete, sender=models.CodeRun)
+@receiver(post_delete, sender=models.ObjectComponent)
+def _deleted(sender, instance, **kwargs):
+    refresh(instance.__dict__.pop("_lineage_descendants", ()))
@@ -0,0 +1,119 @@
+import io
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import prov.model
+import prov.serializers
+from django.core.management.base import BaseCommand
+from rdflib import Graph
+
+from data_management.prov import serialize_prov_document
+
+
+def _make_document(nodes):
+    """
+    Make a PROV document shaped like a provenance report, a chain of code runs each
+    using the data product generated by the one before it, with `nodes` entities,
+    activities and agents in total.
+    """
+    doc = prov.model.ProvDocument()
+    doc.add_namespace("lreg", "http://localhost:8000/")
+    doc.add_namespace("fair", "https://data.fairdatapipeline.org/vocab/#")
+    doc.add_namespace("dcterms", "http://purl.org/dc/terms/")
+    doc.add_namespace("dcat", "http://www.w3.org/ns/dcat#")
+    doc.add_namespace("foaf", "http://xmlns.com/foaf/spec/#")
+
+    issued = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    agent = doc.agent("lreg:api/author/1", {"foaf:name": "Benchmark Author"})
+    previous = None
+    for i in range((nodes - 1) // 2):
+        entity = doc.entity(
+            f"lreg:api/data_product/{i}",
+            {
+                "prov:type": "dcat:Dataset",
+                "dcterms:title": f"benchmark/data_product_{i}",
+                "dcat:hasVersion": "1.0.0",
+                "dcterms:issued": issued,
+                "fair:namespace": "benchmark",
+            },
+        )
+        activity = doc.activity(
+            f"lreg:api/code_run/{i}",
+            startTime=issued,
+            other_attributes={"dcterms:description": f"code run {i}"},
+        )
+        doc.wasAssociatedWith(activity, agent, None, None, {"prov:role": "fair:author"})
+        doc.wasGeneratedBy(entity, activity)
+        if previous is not None:
+            doc.used(activity, previous, None, None, {"prov:role": "fair:input_data"})
+            doc.wasDerivedFrom(entity, previous)
+        previous = entity
+    return doc
+
+
+def _serialize_via_trig(doc):
+    """
+    Serialise a PROV document as JSON-LD by way of TriG, as was done before the RDF
+    graph was built directly.
+    """
+    with io.StringIO() as buf:
+        serializer = prov.serializers.get("rdf")
+        serializer(doc).serialize(buf)
+        buf.seek(0)
+        graph = Graph()
+        graph.parse(data=buf.read(), format="trig")
+    context = {}
+    for prefix, uri in graph.namespaces():
+        context[prefix] = str(uri)
+    return graph.serialize(format="json-ld", indent=4, context=context)
+
+
+def _serialize_direct(doc):
+    return serialize_prov_document(doc, "json-ld", None)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the latency and peak memory of serialising a provenance report as "
+        "JSON-LD directly and by way of TriG"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--nodes",
+            type=int,
+            default=5000,
+            help="The number of nodes in the report, the default is 5000",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="The number of times to serialise the report, the default is 3",
+        )
+
+    def handle(self, **options):
+        doc = _make_document(options["nodes"])
+        self.stdout.write(
+            "Serialising a report of %d nodes as JSON-LD, best of %d"
+            % (options["nodes"], options["repeat"])
+        )
+        for name, serialize in (
+            ("via TriG", _serialize_via_trig),
+            ("direct", _serialize_direct),
+        ):
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                serialize(doc)
+                timings.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            serialize(doc)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.stdout.write(
+                "%-10s %8.3f s %10.1f MiB peak" % (name, min(timings), peak / 1024**2)
+            )
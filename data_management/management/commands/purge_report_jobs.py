@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from data_management import report_jobs
+
+
+class Command(BaseCommand):
+    help = "Remove the expired background report jobs and their files"
+
+    def handle(self, **options):
+        count = report_jobs.purge_expired()
+        self.stdout.write("Removed %d expired report jobs" % count)
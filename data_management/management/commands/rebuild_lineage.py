@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from data_management import fingerprint, lineage
+
+
+class Command(BaseCommand):
+    help = "Recreate the DataProduct lineage closure table and provenance fingerprints"
+
+    def handle(self, **options):
+        count = lineage.rebuild()
+        self.stdout.write("Created %d lineage records" % count)
+        count = fingerprint.rebuild()
+        self.stdout.write("Updated %d provenance fingerprints" % count)
@@ -34,6 +34,9 @@ class BaseModel(models.Model):
     REQUIRED_FIELDS = ()
     FILTERSET_FIELDS = "__all__"
     ADMIN_LIST_FIELDS = ()
+    BULK_CREATE = False
+    # the fields of a unique constraint, by which objects can be upserted
+    NATURAL_KEY = ()
 
     def reverse_name(self):
         return self.__class__.__name__.lower()
@@ -77,6 +80,43 @@ class NameField(models.CharField):
         super().__init__(*args, **kwargs)
 
 
+@NameField.register_lookup
+class GlobLookup(models.Lookup):
+    """
+    A lookup matching a Unix glob style pattern that only uses the `*` and `?`
+    wildcards, all other characters are matched literally. See `GlobFilter`.
+
+    On SQLite this is a `GLOB`, which unlike `LIKE` is case sensitive. On other
+    databases this is a `LIKE`. Both can use an index when the pattern starts with a
+    literal prefix, so the names of the most commonly filtered models are indexed.
+    """
+
+    lookup_name = "glob"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return "%s LIKE %s" % (lhs, rhs), lhs_params + rhs_params
+
+    def as_sqlite(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return "%s GLOB %s" % (lhs, rhs), lhs_params + rhs_params
+
+    def get_db_prep_lookup(self, value, connection):
+        if connection.vendor == "sqlite":
+            pattern = value.replace("[", "[[]")
+        else:
+            pattern = (
+                value.replace("\\", "\\\\")
+                .replace("%", "\\%")
+                .replace("_", "\\_")
+                .replace("*", "%")
+                .replace("?", "_")
+            )
+        return "%s", [pattern]
+
+
 class VersionField(models.CharField):
     """
     A field type used to specify that a field holds a semantic version.
@@ -120,6 +160,8 @@ class FileType(BaseModel):
 
     """
 
+    NATURAL_KEY = ("name", "extension")
+
     name = models.TextField(max_length=CHAR_FIELD_LENGTH, null=False, blank=False)
     extension = models.TextField(max_length=CHAR_FIELD_LENGTH, null=False, blank=False)
 
@@ -150,9 +192,12 @@ class Issue(BaseModel):
     `last_updated`: Datetime that this record was last updated
 
     `updated_by`: Reference to the user that updated this record
+
+    `affected_data_products`: List of `DataProduct` URLs affected by the `Issue`, those with the `Issue` attached to
+    one of their components along with everything derived from them
     """
 
-    EXTRA_DISPLAY_FIELDS = ("component_issues",)
+    EXTRA_DISPLAY_FIELDS = ("component_issues", "affected_data_products")
     SHORT_DESC_LENGTH = 40
 
     severity = models.PositiveSmallIntegerField(default=1)
@@ -227,6 +272,25 @@ class Author(BaseModel):
             return self.name
 
 
+class ObjectManager(models.Manager):
+    """
+    Manager for `Object`s, which creates the whole object `ObjectComponent`s for
+    `Object`s created with `bulk_create`, as `save` is not called.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if kwargs.get("ignore_conflicts") or kwargs.get("update_conflicts"):
+            raise ValueError("Objects can not be bulk created with conflict handling")
+        objs = super().bulk_create(objs, *args, **kwargs)
+        # the ids are not returned by all databases, so find them by the uuid
+        missing = {obj.uuid: obj for obj in objs if obj.pk is None}
+        if missing:
+            for uuid, pk in self.filter(uuid__in=missing).values_list("uuid", "id"):
+                missing[uuid].pk = pk
+        Object.create_whole_object_components(objs)
+        return objs
+
+
 class Object(BaseModel):
     """
     ***Core traceability object used to represent any data object such `DataProduct`, `CodeRepoRelease`, etc. ***
@@ -272,6 +336,7 @@ class Object(BaseModel):
         "keywords",
     )
     ADMIN_LIST_FIELDS = ("name", "is_orphan")
+    BULK_CREATE = True
 
     storage_location = models.ForeignKey(
         "StorageLocation",
@@ -287,16 +352,29 @@ class Object(BaseModel):
     authors = models.ManyToManyField(Author, blank=True)
     uuid = models.UUIDField(default=uuid4, editable=True, unique=True)
 
+    objects = ObjectManager()
+
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         super().save(*args, **kwargs)
 
-        # Create ObjectComponent representing the whole object
-        myself = Object.objects.get(id=self.id)
-        ObjectComponent.objects.create(
-            name="whole_object",
-            object=myself,
-            whole_object=True,
-            updated_by=myself.updated_by,
+        if adding:
+            self.create_whole_object_components([self])
+
+    @staticmethod
+    def create_whole_object_components(objects):
+        """
+        Create the `ObjectComponent`s representing the whole of each of the newly
+        created `Object`s.
+        """
+        ObjectComponent.objects.bulk_create(
+            ObjectComponent(
+                name="whole_object",
+                object=obj,
+                whole_object=True,
+                updated_by_id=obj.updated_by_id,
+            )
+            for obj in objects
         )
 
     def name(self):
@@ -386,11 +464,12 @@ class ObjectComponent(BaseModel):
 
     ADMIN_LIST_FIELDS = ("object", "name")
     EXTRA_DISPLAY_FIELDS = ("inputs_of", "outputs_of")
+    BULK_CREATE = True
 
     object = models.ForeignKey(
         Object, on_delete=models.PROTECT, related_name="components", null=False
     )
-    name = NameField(null=False, blank=False)
+    name = NameField(null=False, blank=False, db_index=True)
     issues = models.ManyToManyField(Issue, related_name="component_issues", blank=True)
     description = models.TextField(max_length=TEXT_FIELD_LENGTH, null=True, blank=True)
     whole_object = models.BooleanField(default=False)
@@ -513,6 +592,7 @@ class StorageRoot(BaseModel):
     """
 
     EXTRA_DISPLAY_FIELDS = ("locations",)
+    NATURAL_KEY = ("root",)
 
     root = URIField(null=False, blank=False, unique=True)
     local = models.BooleanField(default=False)
@@ -547,6 +627,8 @@ class StorageLocation(BaseModel):
     """
 
     ADMIN_LIST_FIELDS = ("storage_root", "path")
+    BULK_CREATE = True
+    NATURAL_KEY = ("storage_root", "hash", "public")
 
     path = models.CharField(max_length=PATH_FIELD_LENGTH, null=False, blank=False)
     hash = models.CharField(max_length=CHAR_FIELD_LENGTH, null=False, blank=False)
@@ -592,8 +674,9 @@ class Namespace(BaseModel):
     """
 
     ADMIN_LIST_FIELDS = ("name", "full_name", "website")
+    NATURAL_KEY = ("name",)
 
-    name = NameField(null=False, blank=False)
+    name = NameField(null=False, blank=False, db_index=True)
     full_name = models.CharField(max_length=CHAR_FIELD_LENGTH, null=True, blank=True)
     website = models.URLField(null=True, blank=True)
 
@@ -607,6 +690,20 @@ class Namespace(BaseModel):
         return self.name
 
 
+class DataProductManager(models.Manager):
+    """
+    Manager for `DataProduct`s, which updates the lineage closure table for
+    `DataProduct`s created with `bulk_create`, as no signals are sent.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from . import lineage
+
+        objs = super().bulk_create(objs, *args, **kwargs)
+        lineage.refresh_for_objects(obj.object_id for obj in objs)
+        return objs
+
+
 class DataProduct(BaseModel):
     """
     ***A data product that is used by or generated by a model.***
@@ -629,6 +726,9 @@ class DataProduct(BaseModel):
 
     `external_object`: `ExternalObject` API URL associated with this `DataProduct`
 
+    `provenance_fingerprint`: Hash of the file of this `DataProduct` and of the code and inputs used to generate it,
+    `DataProduct`s with the same fingerprint were generated identically
+
     `prov_report`: The provenance report for this `DataProduct`
 
     `ro_crate`: The RO Crate containing this `DataProduct` plus any available input files
@@ -642,6 +742,8 @@ class DataProduct(BaseModel):
         "prov_report",
         "ro_crate",
     )
+    BULK_CREATE = True
+    NATURAL_KEY = ("namespace", "name", "version")
 
     object = models.ForeignKey(
         Object, on_delete=models.PROTECT, related_name="data_products"
@@ -649,8 +751,13 @@ class DataProduct(BaseModel):
     namespace = models.ForeignKey(
         Namespace, on_delete=models.PROTECT, related_name="data_products"
     )
-    name = NameField(null=False, blank=False)
+    name = NameField(null=False, blank=False, db_index=True)
     version = VersionField()
+    provenance_fingerprint = models.CharField(
+        max_length=64, null=True, blank=True, editable=False, db_index=True
+    )
+
+    objects = DataProductManager()
 
     class Meta:
         constraints = [
@@ -671,6 +778,38 @@ class DataProduct(BaseModel):
         return "%s:%s version %s" % (self.namespace, self.name, self.version)
 
 
+class DataProductLineage(models.Model):
+    """
+    Transitive closure of the lineage of `DataProduct`s.
+
+    There is a row for every pair of `DataProduct`s where the `ancestor` was used, either
+    directly or through a chain of `CodeRun`s, to generate the `descendant`. `distance`
+    is the smallest number of `CodeRun`s between the two. The table is maintained by
+    `data_management.lineage` and is not exposed through the API.
+    """
+
+    ancestor = models.ForeignKey(
+        DataProduct, on_delete=models.CASCADE, related_name="descendant_links"
+    )
+    descendant = models.ForeignKey(
+        DataProduct, on_delete=models.CASCADE, related_name="ancestor_links"
+    )
+    distance = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("ancestor", "descendant"), name="unique_lineage"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=("descendant", "distance")),
+        ]
+
+    def __str__(self):
+        return "%s -> %s" % (self.ancestor_id, self.descendant_id)
+
+
 class ExternalObject(BaseModel):
     """
     *** An external data object, i.e. one that has comes from somewhere other than being generated as part of the
@@ -834,6 +973,7 @@ class Keyword(BaseModel):
     """
 
     ADMIN_LIST_FIELDS = ("object", "keyphrase")
+    NATURAL_KEY = ("object", "keyphrase")
 
     object = models.ForeignKey(
         Object, on_delete=models.PROTECT, related_name="keywords"
@@ -908,6 +1048,7 @@ class CodeRepoRelease(BaseModel):
     """
 
     ADMIN_LIST_FIELDS = ("name", "version")
+    NATURAL_KEY = ("name", "version")
 
     object = models.OneToOneField(
         Object, on_delete=models.PROTECT, related_name="code_repo_release"
@@ -947,6 +1088,7 @@ class KeyValue(BaseModel):
     """
 
     ADMIN_LIST_FIELDS = ("object", "key")
+    NATURAL_KEY = ("object", "key")
 
     object = models.ForeignKey(
         Object, on_delete=models.PROTECT, related_name="metadata"
@@ -963,6 +1105,44 @@ class KeyValue(BaseModel):
         return self.key
 
 
+class ReportJob(models.Model):
+    """
+    A job generating a provenance report or RO Crate in the background.
+
+    Jobs are created by POSTing to a report endpoint and are run by
+    `data_management.report_jobs`. `key` identifies the report that is generated, so
+    that identical requests share a job, and the generated file is kept until
+    `expires`. The table is only exposed through the report job endpoints.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (FINISHED, "Finished"),
+        (FAILED, "Failed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    key = models.CharField(max_length=64, unique=True)
+    report = models.CharField(max_length=CHAR_FIELD_LENGTH)
+    object_id = models.PositiveIntegerField()
+    format = models.CharField(max_length=CHAR_FIELD_LENGTH)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True)
+    content_type = models.CharField(max_length=CHAR_FIELD_LENGTH, blank=True)
+    file_name = models.CharField(max_length=CHAR_FIELD_LENGTH, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return "%s %s %s" % (self.report, self.object_id, self.status)
+
+
 def _is_base_model_subclass(name, cls):
     """
     Test if given class is a non-abstract subclasses of BaseModel
@@ -1,9 +1,10 @@
-import boto3
-
 from django.conf import settings
 
 
 def create_url(name, method, filename=None):
+    # boto3 is slow to import and only needed for object storage requests
+    import boto3
+
     bucket = settings.BUCKETS["default"]
     session = boto3.session.Session()
     s3_client = session.client(
@@ -1,5 +1,6 @@
 import io
 import json
+import logging
 import xml.etree.ElementTree
 
 from django.conf import settings
@@ -8,11 +9,16 @@ import prov.dot
 from prov.identifier import QualifiedName
 import prov.model
 import prov.serializers
-from rdflib import Graph
+from prov.serializers.provrdf import ProvRDFSerializer
+from rdflib import BNode, RDF, URIRef, XSD
+from rdflib.plugins.shared.jsonld.util import split_iri
 
 from data_management.views import external_object
 
-from . import models
+from . import models, render_pool, report_cache
+from .graph import LineageGraph, LineageWalk
+
+logger = logging.getLogger(__name__)
 
 # we need to tell SONAR to ignore 'http' in the vocab URLs
 DCAT_VOCAB_PREFIX = "dcat"
@@ -27,8 +33,90 @@ FOAF_VOCAB_NAMESPACE = "http://xmlns.com/foaf/spec/#"  # NOSONAR
 RDF_VOCAB_PREFIX = "rdf"
 RDF_VOCAB_NAMESPACE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"  # NOSONAR
 
+# the prefixes RDFLib binds in every graph, which the JSON-LD context always includes
+JSON_LD_DEFAULT_CONTEXT = {
+    "rdf": RDF_VOCAB_NAMESPACE,
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",  # NOSONAR
+    "xml": "http://www.w3.org/XML/1998/namespace",  # NOSONAR
+    "xsd": "http://www.w3.org/2001/XMLSchema#",  # NOSONAR
+}
+# literals of these types are written as JSON values rather than value objects, which
+# keeps their value but not their lexical form, e.g. an xsd:double written as "1.50E0"
+# is output as 1.5
+JSON_LD_NATIVE_TYPES = {XSD.boolean, XSD.integer, XSD.double, XSD.string}
+
+
+# the kinds of operation recorded in a provenance fragment
+_CALL = "call"
+_ONCE = "once"
+_CODE_RUN = "code_run"
+
+
+class _FragmentBuilder:
+    """
+    Records the records added to the provenance of a data product, in place of the
+    ProvDocument they are added to, so that they can be cached and replayed into any
+    document that includes the data product, see `_add_fragment`.
+
+    The methods of ProvDocument used to add records are recorded along with their
+    arguments and return the identifier of the record. Parts of the provenance that
+    depend on what the document already contains are recorded by child builders, see
+    `once` and `code_run`.
+    """
+
+    PROV_METHODS = frozenset(
+        (
+            "activity",
+            "agent",
+            "entity",
+            "specializationOf",
+            "used",
+            "wasAttributedTo",
+            "wasDerivedFrom",
+            "wasGeneratedBy",
+            "wasStartedBy",
+        )
+    )
+
+    def __init__(self):
+        self.ops = []
+
+    def __getattr__(self, name):
+        if name not in self.PROV_METHODS:
+            raise AttributeError(name)
+
+        def record(identifier, *args):
+            self.ops.append((_CALL, name, (identifier, *args)))
+            return identifier
+
+        return record
+
+    def once(self, identifier):
+        """
+        @param identifier: the identifier of a record
+
+        @return a _FragmentBuilder recording records that are only added if the
+            document does not already contain the record
+        """
+        builder = _FragmentBuilder()
+        self.ops.append((_ONCE, identifier, builder.ops))
+        return builder
 
-def _generate_object_meta(obj, vocab_namespaces):
+    def code_run(self, code_run_id, input_ids):
+        """
+        @param code_run_id: the id of a CodeRun
+        @param input_ids: the ids of the DataProducts used as inputs to the code run
+
+        @return a tuple of two _FragmentBuilders, the first recording the records added
+            the first time the code run is reached while walking the graph and the
+            second the records added when it has already been added
+        """
+        added, linked = _FragmentBuilder(), _FragmentBuilder()
+        self.ops.append((_CODE_RUN, code_run_id, input_ids, added.ops, linked.ops))
+        return added, linked
+
+
+def _generate_object_meta(obj, graph, vocab_namespaces):
     data = []
 
     data.append(
@@ -54,7 +142,7 @@ def _generate_object_meta(obj, vocab_namespaces):
             )
         )
 
-    for data_product in obj.data_products.all():
+    for data_product in graph.data_products_of(obj):
         data.append(
             (
                 QualifiedName(vocab_namespaces[FAIR_VOCAB_PREFIX], "namespace"),
@@ -74,8 +162,8 @@ def _generate_object_meta(obj, vocab_namespaces):
             )
         )
 
-    for component in obj.components.all():
-        for issue in component.issues.all():
+    for component in graph.components_of(obj):
+        for issue in graph.issues_of(component):
             data.append(
                 (
                     QualifiedName(vocab_namespaces[FAIR_VOCAB_PREFIX], "issue"),
@@ -99,7 +187,7 @@ def _add_author_agents(authors, doc, entity, reg_uri_prefix, vocab_namespaces):
     Add the authors to the entity as agents.
 
     @param authors: a list of authors from the Author table
-    @param doc: a ProvDocument that the agent will belong to
+    @param doc: a _FragmentBuilder that the agents are added to
     @param entity: the entity to attach the authors to
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
@@ -107,30 +195,22 @@ def _add_author_agents(authors, doc, entity, reg_uri_prefix, vocab_namespaces):
     """
     for author in authors:
         agent_id = f"{reg_uri_prefix}:api/author/{author.id}"
-        agent = doc.get_record(agent_id)
-        # check to see if we have already created an agent for this author
-        if len(agent) > 0:
-            # The prov documentation says a ProvRecord is returned, but actually a
-            # list of ProvRecord is returned
-            author_agent = agent[0]
-        else:
-            author_agent = doc.agent(
-                agent_id,
-                {
-                    QualifiedName(
-                        vocab_namespaces[RDF_VOCAB_PREFIX], "type"
-                    ): QualifiedName(PROV, "Person"),
-                    QualifiedName(
-                        vocab_namespaces[FOAF_VOCAB_PREFIX], "name"
-                    ): author.name,
-                    QualifiedName(
-                        vocab_namespaces[DCTERMS_VOCAB_PREFIX], "identifier"
-                    ): author.identifier,
-                },
-            )
+        # the agent is only created if it is not already in the document
+        doc.once(agent_id).agent(
+            agent_id,
+            {
+                QualifiedName(
+                    vocab_namespaces[RDF_VOCAB_PREFIX], "type"
+                ): QualifiedName(PROV, "Person"),
+                QualifiedName(vocab_namespaces[FOAF_VOCAB_PREFIX], "name"): author.name,
+                QualifiedName(
+                    vocab_namespaces[DCTERMS_VOCAB_PREFIX], "identifier"
+                ): author.identifier,
+            },
+        )
         doc.wasAttributedTo(
             entity,
-            author_agent,
+            agent_id,
             None,
             {
                 PROV_ROLE: QualifiedName(
@@ -141,13 +221,14 @@ def _add_author_agents(authors, doc, entity, reg_uri_prefix, vocab_namespaces):
 
 
 def _add_code_repo_release(
-    cr_activity, doc, code_repo, reg_uri_prefix, vocab_namespaces
+    cr_activity, doc, graph, code_repo, reg_uri_prefix, vocab_namespaces
 ):
     """
     Add code repo release to the code run activity.
 
-    @param cr_activity: a prov.activity representing the code run
-    @param doc: a ProvDocument that the entities will belong to
+    @param cr_activity: the identifier of the activity representing the code run
+    @param doc: a _FragmentBuilder that the entities are added to
+    @param graph: a LineageGraph containing the code_repo
     @param code_repo: a code_repo object
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
@@ -161,7 +242,7 @@ def _add_code_repo_release(
     if code_repo_release is None:
         code_release_entity = doc.entity(
             f"{reg_uri_prefix}:api/object/{code_repo.id}",
-            (*_generate_object_meta(code_repo, vocab_namespaces),),
+            (*_generate_object_meta(code_repo, graph, vocab_namespaces),),
         )
     else:
         code_release_entity = doc.entity(
@@ -171,7 +252,7 @@ def _add_code_repo_release(
                     QualifiedName(vocab_namespaces[RDF_VOCAB_PREFIX], "type"),
                     QualifiedName(vocab_namespaces[DCMITYPE_VOCAB_PREFIX], "Software"),
                 ),
-                *_generate_object_meta(code_repo, vocab_namespaces),
+                *_generate_object_meta(code_repo, graph, vocab_namespaces),
                 (
                     QualifiedName(vocab_namespaces[DCTERMS_VOCAB_PREFIX], "title"),
                     code_repo_release.name,
@@ -188,7 +269,7 @@ def _add_code_repo_release(
         )
 
     _add_author_agents(
-        code_repo.authors.all(),
+        graph.authors_of(code_repo),
         doc,
         code_release_entity,
         reg_uri_prefix,
@@ -203,17 +284,18 @@ def _add_code_repo_release(
     )
 
 
-def _add_code_run(dp_entity, doc, code_run, reg_uri_prefix, vocab_namespaces):
+def _add_code_run(dp_entity, doc, graph, code_run, reg_uri_prefix, vocab_namespaces):
     """
     Add code repo release to the code run activity.
 
-    @param dp_entity: a prov.entity representing the data_product
-    @param doc: a ProvDocument that the entities will belong to
+    @param dp_entity: the identifier of the entity representing the data_product
+    @param doc: a _FragmentBuilder that the entities are added to
+    @param graph: a LineageGraph containing the code_run
     @param code_run: a code_run object
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
 
-    @return a prov.activity representing the code run
+    @return the identifier of the activity representing the code run
 
     """
     cr_activity = doc.activity(
@@ -232,8 +314,8 @@ def _add_code_run(dp_entity, doc, code_run, reg_uri_prefix, vocab_namespaces):
 
     doc.wasGeneratedBy(dp_entity, cr_activity)
 
-    user_authors = models.UserAuthor.objects.filter(user=code_run.updated_by)
-    if len(user_authors) == 0:
+    user_author = graph.author_for_user(code_run.updated_by)
+    if user_author is None:
         run_agent = doc.agent(
             f"{reg_uri_prefix}:api/users/{code_run.updated_by.id}",
             {
@@ -246,29 +328,23 @@ def _add_code_run(dp_entity, doc, code_run, reg_uri_prefix, vocab_namespaces):
             },
         )
     else:
-        # we have an author linked to the user
-        agent_id = f"{reg_uri_prefix}:api/author/{user_authors[0].author.id}"
-        agent = doc.get_record(agent_id)
-        # check to see if we have already created an agent for this author
-        if len(agent) > 0:
-            # The prov documentation says a ProvRecord is returned, but actually a
-            # list of ProvRecord is returned
-            run_agent = agent[0]
-        else:
-            run_agent = doc.agent(
-                agent_id,
-                {
-                    QualifiedName(
-                        vocab_namespaces[RDF_VOCAB_PREFIX], "type"
-                    ): QualifiedName(PROV, "Person"),
-                    QualifiedName(
-                        vocab_namespaces[FOAF_VOCAB_PREFIX], "name"
-                    ): user_authors[0].author.name,
-                    QualifiedName(
-                        vocab_namespaces[FAIR_VOCAB_PREFIX], "identifier"
-                    ): user_authors[0].author.identifier,
-                },
-            )
+        # we have an author linked to the user, the agent is only created if it is not
+        # already in the document
+        run_agent = f"{reg_uri_prefix}:api/author/{user_author.id}"
+        doc.once(run_agent).agent(
+            run_agent,
+            {
+                QualifiedName(
+                    vocab_namespaces[RDF_VOCAB_PREFIX], "type"
+                ): QualifiedName(PROV, "Person"),
+                QualifiedName(
+                    vocab_namespaces[FOAF_VOCAB_PREFIX], "name"
+                ): user_author.name,
+                QualifiedName(
+                    vocab_namespaces[FAIR_VOCAB_PREFIX], "identifier"
+                ): user_author.identifier,
+            },
+        )
 
     doc.wasStartedBy(
         cr_activity,
@@ -288,9 +364,9 @@ def _add_external_object(
     """
     Add an external_object entity to the provenance document for the given data product.
 
-    @param doc: a ProvDocument that the entity will belong to
+    @param doc: a _FragmentBuilder that the entity is added to
     @param data_product: a data_product from the DataProduct table
-    @param data_product_entity: a prov.entity representing the data_product
+    @param data_product_entity: the identifier of the entity representing the data_product
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
 
@@ -381,6 +457,7 @@ def _add_external_object(
 def _add_input_data_products(
     cr_activity,
     doc,
+    graph,
     dp_entity,
     object_components,
     reg_uri_prefix,
@@ -389,9 +466,10 @@ def _add_input_data_products(
     """
     Add input data products to the code run activity.
 
-    @param cr_activity: a prov.activity representing the code run
-    @param doc: a ProvDocument that the entities will belong to
-    @param dp_entity: a prov.entity representing the data_product
+    @param cr_activity: the identifier of the activity representing the code run
+    @param doc: a _FragmentBuilder that the entities are added to
+    @param graph: a LineageGraph containing the object_components
+    @param dp_entity: the identifier of the entity representing the data_product
     @param object_components: a list of object_components from the ObjectComponent table
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
@@ -402,43 +480,36 @@ def _add_input_data_products(
     all_data_products = []
     for component in object_components:
         obj = component.object
-        data_products = obj.data_products.all()
+        data_products = graph.data_products_of(obj)
 
         for data_product in data_products:
-            file_id = f"{reg_uri_prefix}:api/data_product/{data_product.id}"
-
-            entity = doc.get_record(file_id)
-            # check to see if we have already created an entity for this data product
-            if len(entity) > 0:
-                # The prov documentation says a ProvRecord is returned, but actually a
-                # list of ProvRecord is returned
-                file_entity = entity[0]
-            else:
-                file_entity = doc.entity(
-                    file_id,
+            file_entity = f"{reg_uri_prefix}:api/data_product/{data_product.id}"
+
+            # the entity is only created if it is not already in the document
+            entity_doc = doc.once(file_entity)
+            entity_doc.entity(
+                file_entity,
+                (
                     (
-                        (
-                            QualifiedName(vocab_namespaces[RDF_VOCAB_PREFIX], "type"),
-                            QualifiedName(
-                                vocab_namespaces[DCAT_VOCAB_PREFIX], "Dataset"
-                            ),
-                        ),
-                        *_generate_object_meta(obj, vocab_namespaces),
+                        QualifiedName(vocab_namespaces[RDF_VOCAB_PREFIX], "type"),
+                        QualifiedName(vocab_namespaces[DCAT_VOCAB_PREFIX], "Dataset"),
                     ),
-                )
+                    *_generate_object_meta(obj, graph, vocab_namespaces),
+                ),
+            )
 
-                # add external object linked to the data product
-                _add_external_object(
-                    doc, data_product, file_entity, reg_uri_prefix, vocab_namespaces
-                )
+            # add external object linked to the data product
+            _add_external_object(
+                entity_doc, data_product, file_entity, reg_uri_prefix, vocab_namespaces
+            )
 
-                _add_author_agents(
-                    obj.authors.all(),
-                    doc,
-                    file_entity,
-                    reg_uri_prefix,
-                    vocab_namespaces,
-                )
+            _add_author_agents(
+                graph.authors_of(obj),
+                entity_doc,
+                file_entity,
+                reg_uri_prefix,
+                vocab_namespaces,
+            )
 
             # add link to the code run
             doc.used(
@@ -460,12 +531,15 @@ def _add_input_data_products(
     return all_data_products
 
 
-def _add_model_config(cr_activity, doc, model_config, reg_uri_prefix, vocab_namespaces):
+def _add_model_config(
+    cr_activity, doc, graph, model_config, reg_uri_prefix, vocab_namespaces
+):
     """
     Add model config to the code run activity.
 
-    @param cr_activity: a prov.activity representing the code run
-    @param doc: a ProvDocument that the entities will belong to
+    @param cr_activity: the identifier of the activity representing the code run
+    @param doc: a _FragmentBuilder that the entities are added to
+    @param graph: a LineageGraph containing the model_config
     @param model_config: a model_config object
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
@@ -473,11 +547,11 @@ def _add_model_config(cr_activity, doc, model_config, reg_uri_prefix, vocab_name
     """
     model_config_entity = doc.entity(
         f"{reg_uri_prefix}:api/object/{model_config.id}",
-        (*_generate_object_meta(model_config, vocab_namespaces),),
+        (*_generate_object_meta(model_config, graph, vocab_namespaces),),
     )
 
     _add_author_agents(
-        model_config.authors.all(),
+        graph.authors_of(model_config),
         doc,
         model_config_entity,
         reg_uri_prefix,
@@ -496,40 +570,38 @@ def _add_model_config(cr_activity, doc, model_config, reg_uri_prefix, vocab_name
     )
 
 
-def _add_prime_data_product(doc, data_product, reg_uri_prefix, vocab_namespaces):
+def _add_prime_data_product(doc, graph, data_product, reg_uri_prefix, vocab_namespaces):
     """
     Add the prime data product for this level of the provenance report.
 
-    @param doc: a ProvDocument that the entities will belong to
+    @param doc: a _FragmentBuilder that the entities are added to
+    @param graph: a LineageGraph containing the data_product
     @param data_product: The DataProduct to generate the PROV document for
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
 
-    @return the data product entity
+    @return the identifier of the data product entity
 
     """
-    data_product_id = f"{reg_uri_prefix}:api/data_product/{data_product.id}"
-    entity = doc.get_record(data_product_id)
-    # check to see if we have already created an entity for this data product
-    if len(entity) > 0:
-        # The prov documentation says a ProvRecord is returned, but actually a
-        # list of ProvRecord is returned
-        return entity[0]
+    dp_entity = f"{reg_uri_prefix}:api/data_product/{data_product.id}"
+    # the data product is only added if it is not already in the document, i.e. it was
+    # an input to a code run in the level above
+    doc = doc.once(dp_entity)
 
     # add the data product
-    dp_entity = doc.entity(
-        f"{reg_uri_prefix}:api/data_product/{data_product.id}",
+    doc.entity(
+        dp_entity,
         (
             (
                 QualifiedName(vocab_namespaces[RDF_VOCAB_PREFIX], "type"),
                 QualifiedName(vocab_namespaces[DCAT_VOCAB_PREFIX], "Dataset"),
             ),
-            *_generate_object_meta(data_product.object, vocab_namespaces),
+            *_generate_object_meta(data_product.object, graph, vocab_namespaces),
         ),
     )
 
     _add_author_agents(
-        data_product.object.authors.all(),
+        graph.authors_of(data_product.object),
         doc,
         dp_entity,
         reg_uri_prefix,
@@ -542,13 +614,14 @@ def _add_prime_data_product(doc, data_product, reg_uri_prefix, vocab_namespaces)
 
 
 def _add_submission_script(
-    cr_activity, doc, submission_script, reg_uri_prefix, vocab_namespaces
+    cr_activity, doc, graph, submission_script, reg_uri_prefix, vocab_namespaces
 ):
     """
     Add submission script to the code run activity.
 
-    @param cr_activity: a prov.activity representing the code run
-    @param doc: a ProvDocument that the entities will belong to
+    @param cr_activity: the identifier of the activity representing the code run
+    @param doc: a _FragmentBuilder that the entities are added to
+    @param graph: a LineageGraph containing the submission_script
     @param submission_script: a submission_script object
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
@@ -561,12 +634,12 @@ def _add_submission_script(
                 QualifiedName(vocab_namespaces[RDF_VOCAB_PREFIX], "type"),
                 QualifiedName(vocab_namespaces[DCMITYPE_VOCAB_PREFIX], "Software"),
             ),
-            *_generate_object_meta(submission_script, vocab_namespaces),
+            *_generate_object_meta(submission_script, graph, vocab_namespaces),
         ),
     )
 
     _add_author_agents(
-        submission_script.authors.all(),
+        graph.authors_of(submission_script),
         doc,
         submission_script_entity,
         reg_uri_prefix,
@@ -585,48 +658,73 @@ def _add_submission_script(
     )
 
 
-def _generate_prov_document(doc, data_product, reg_uri_prefix, vocab_namespaces):
+def _make_fragment(graph, data_product, reg_uri_prefix, vocab_namespaces):
     """
-    Add the next level to the provenance doc.
+    Make the fragment of provenance for a single level of a data product.
 
-    This takes a data product and finds generates it provenance. A list of input files
-    are returned so they can be used to create the next level of the provenane if
-    needed.
+    The fragment records the data product, the code runs that generated it and their
+    code repo, model config, submission script and inputs, without the provenance of
+    the inputs. It does not depend on where the data product is in the report, so a
+    report of any depth can be assembled from the fragments of the data products in
+    it, see `_add_fragment`.
 
-    @param doc: a ProvDocument that the entities will belong to
-    @param data_product: The DataProduct to generate the PROV document for
+    @param graph: a LineageGraph that the level containing data_product has been
+        loaded into
+    @param data_product: The DataProduct to generate the fragment for
     @param reg_uri_prefix: a str containing the name of the prefix
     @param vocab_namespaces: a dict containing the Namespaces for the vocab
 
-    @return a list of files that were used as input files, may be empty
+    @return a list of the operations that add the fragment to a ProvDocument
 
     """
+    builder = _FragmentBuilder()
+
     # add the the root data product
     dp_entity = _add_prime_data_product(
-        doc, data_product, reg_uri_prefix, vocab_namespaces
+        builder, graph, data_product, reg_uri_prefix, vocab_namespaces
     )
 
     # add the activity, i.e. the code run
-    components = data_product.object.components.all()
-    all_input_files = []
+    components = graph.components_of(data_product.object)
+    linked_code_runs = set()
 
     for component in components:
-        try:
-            code_run = component.outputs_of.all()[0]
-        except IndexError:
+        code_run = graph.code_run_of(component)
+        if code_run is None:
             # there is no code run for this component so we cannot add any more
             # provenance data
             continue
 
+        if code_run.id in linked_code_runs:
+            continue
+        linked_code_runs.add(code_run.id)
+
+        doc, link_doc = builder.code_run(
+            code_run.id,
+            [
+                input_file.id
+                for input_file in graph.code_run_input_data_products(code_run)
+            ],
+        )
+
+        # the code run, along with its inputs, may already have been added for another
+        # of its outputs, in which case only the links to this data product are needed
+        _link_code_run(link_doc, graph, dp_entity, code_run, reg_uri_prefix)
+
         # add the code run, this is the central activity
         cr_activity = _add_code_run(
-            dp_entity, doc, code_run, reg_uri_prefix, vocab_namespaces
+            dp_entity, doc, graph, code_run, reg_uri_prefix, vocab_namespaces
         )
 
         # add the code repo release
         if code_run.code_repo is not None:
             _add_code_repo_release(
-                cr_activity, doc, code_run.code_repo, reg_uri_prefix, vocab_namespaces
+                cr_activity,
+                doc,
+                graph,
+                code_run.code_repo,
+                reg_uri_prefix,
+                vocab_namespaces,
             )
 
         # add the model config
@@ -634,6 +732,7 @@ def _generate_prov_document(doc, data_product, reg_uri_prefix, vocab_namespaces)
             _add_model_config(
                 cr_activity,
                 doc,
+                graph,
                 code_run.model_config,
                 reg_uri_prefix,
                 vocab_namespaces,
@@ -643,27 +742,147 @@ def _generate_prov_document(doc, data_product, reg_uri_prefix, vocab_namespaces)
         _add_submission_script(
             cr_activity,
             doc,
+            graph,
             code_run.submission_script,
             reg_uri_prefix,
             vocab_namespaces,
         )
 
         # add input files
-        input_files = _add_input_data_products(
+        _add_input_data_products(
             cr_activity,
             doc,
+            graph,
             dp_entity,
-            code_run.inputs.all(),
+            graph.inputs_of(code_run),
             reg_uri_prefix,
             vocab_namespaces,
         )
 
-        all_input_files.extend(input_files)
+    return builder.ops
 
-    return all_input_files
 
+def _add_fragment(doc, walk, ops):
+    """
+    Add the fragment of provenance for a single level of a data product to the
+    provenance doc.
+
+    @param doc: a ProvDocument that the entities will belong to
+    @param walk: a LineageWalk recording the code runs that have already been added
+    @param ops: a list of operations, as returned by `_make_fragment`
+
+    @return a list of the ids of the data products used as inputs to the code runs that
+        were added, may be empty
 
-def generate_prov_document(data_product, depth, request):
+    """
+    input_ids = []
+    for op in ops:
+        if op[0] == _CALL:
+            _, method, args = op
+            getattr(doc, method)(*args)
+        elif op[0] == _ONCE:
+            _, identifier, once_ops = op
+            # The prov documentation says a ProvRecord is returned, but actually a
+            # list of ProvRecord is returned
+            if not doc.get_record(identifier):
+                _add_fragment(doc, walk, once_ops)
+        else:
+            _, code_run_id, code_run_input_ids, added_ops, linked_ops = op
+            if walk.visit_code_run(code_run_id):
+                _add_fragment(doc, walk, added_ops)
+                input_ids.extend(code_run_input_ids)
+            else:
+                _add_fragment(doc, walk, linked_ops)
+    return input_ids
+
+
+def _get_fragments(graph, level, reg_uri_prefix, vocab_namespaces):
+    """
+    Get the fragments of provenance for a level of data products, from the cache where
+    they are unchanged and otherwise by making them.
+
+    @param graph: a LineageGraph that the level has been loaded into
+    @param level: a list of DataProducts
+    @param reg_uri_prefix: a str containing the name of the prefix
+    @param vocab_namespaces: a dict containing the Namespaces for the vocab
+
+    @return a dict of the fragments keyed by DataProduct id
+
+    """
+    keys = {
+        data_product.id: report_cache.make_fragment_key(
+            data_product.id,
+            {prefix: namespace.uri for prefix, namespace in vocab_namespaces.items()},
+            graph.fragment_fingerprint(data_product),
+        )
+        for data_product in level
+    }
+    cached = report_cache.get_fragments(keys.values())
+
+    fragments = {}
+    new_fragments = {}
+    for data_product in level:
+        key = keys[data_product.id]
+        if key in cached:
+            fragments[data_product.id] = cached[key]
+            continue
+        fragment = _make_fragment(graph, data_product, reg_uri_prefix, vocab_namespaces)
+        fragments[data_product.id] = fragment
+        new_fragments[key] = fragment
+    report_cache.set_fragments(new_fragments)
+
+    logger.debug(
+        "Reused %d of %d cached provenance fragments",
+        len(level) - len(new_fragments),
+        len(level),
+    )
+    return fragments
+
+
+def _link_code_run(doc, graph, dp_entity, code_run, reg_uri_prefix):
+    """
+    Link a data product to a code run that has already been added to the doc.
+
+    @param doc: a _FragmentBuilder that the links are added to
+    @param graph: a LineageGraph containing the code_run
+    @param dp_entity: the identifier of the entity representing the data_product
+    @param code_run: a code_run object
+    @param reg_uri_prefix: a str containing the name of the prefix
+
+    """
+    doc.wasGeneratedBy(dp_entity, f"{reg_uri_prefix}:api/code_run/{code_run.id}")
+    for input_file in graph.code_run_input_data_products(code_run):
+        doc.wasDerivedFrom(
+            dp_entity, f"{reg_uri_prefix}:api/data_product/{input_file.id}"
+        )
+
+
+def load_prov_graph(data_product, depth):
+    """
+    Load the part of the provenance graph needed for a PROV document.
+
+    :param data_product: The DataProduct to generate the PROV document for
+    :param depth: The depth for the document. How many levels of code runs to include.
+
+    :return: A LineageGraph
+
+    """
+    graph = LineageGraph()
+    walk = LineageWalk()
+    level = graph.load_level(walk.unvisited([data_product]))
+    while depth > 1 and level:
+        level = graph.load_level(
+            walk.unvisited(
+                input_file
+                for data_product in level
+                for input_file in graph.input_data_products(data_product)
+            )
+        )
+        depth = depth - 1
+    return graph
+
+
+def generate_prov_document(data_product, depth, registry_url, graph=None, walk=None):
     """
     Generate a PROV document for a DataProduct detailing all the input and outputs and
     how they were generated.
@@ -672,26 +891,29 @@ def generate_prov_document(data_product, depth, request):
 
     :param data_product: The DataProduct to generate the PROV document for
     :param depth: The depth for the document. How many levels of code runs to include.
-    :param request: A request object
+    :param registry_url: The URL of the registry the document is generated from
+    :param graph: An optional LineageGraph, as returned by `load_prov_graph`, that the
+        document will be generated from
+    :param walk: An optional LineageWalk, which records the number of data products
+        and code runs that were reached more than once and so skipped
 
     :return: A PROV-O document
 
     """
-    url = request.build_absolute_uri("/")
     central_registry_url = settings.CENTRAL_REGISTRY_URL
     if not central_registry_url.endswith("/"):
         central_registry_url = f"{central_registry_url}/"
 
     doc = prov.model.ProvDocument()
 
-    if url == central_registry_url:
+    if registry_url == central_registry_url:
         # we are using the main registry
         reg_uri_prefix = "reg"
         doc.add_namespace(reg_uri_prefix, central_registry_url)
     else:
         # we are using a local registry
         reg_uri_prefix = "lreg"
-        doc.add_namespace(reg_uri_prefix, url)
+        doc.add_namespace(reg_uri_prefix, registry_url)
 
     # the vocab namespace is always the main registry
     doc.add_namespace(FAIR_VOCAB_PREFIX, f"{central_registry_url}vocab/#")
@@ -706,34 +928,58 @@ def generate_prov_document(data_product, depth, request):
     for namespace in doc.get_registered_namespaces():
         vocab_namespaces[namespace.prefix] = namespace
 
-    # get the initial set of input files
-    input_files = _generate_prov_document(
-        doc, data_product, reg_uri_prefix, vocab_namespaces
-    )
-
-    if depth == 1:
-        return doc
-
-    # add extra layers to the report if requested by the user
-    while depth > 1:
-        next_level_input_files = []
-
-        for input_file in input_files:
-            next_input_files = _generate_prov_document(
-                doc, input_file, reg_uri_prefix, vocab_namespaces
+    # loaded a level at a time, see LineageGraph
+    if graph is None:
+        graph = LineageGraph()
+    # nodes reached by more than one path are skipped, see LineageWalk
+    if walk is None:
+        walk = LineageWalk()
+    level = graph.load_level(walk.unvisited([data_product]))
+
+    # the provenance of each data product in the level, without that of its inputs, is
+    # a fragment that is cached and shared by all of the reports that include it
+    while True:
+        fragments = _get_fragments(graph, level, reg_uri_prefix, vocab_namespaces)
+        input_files = []
+        for level_data_product in level:
+            input_files.extend(
+                graph.data_products[input_id]
+                for input_id in _add_fragment(
+                    doc, walk, fragments[level_data_product.id]
+                )
             )
-            next_level_input_files.extend(next_input_files)
 
-        # reset the input files for the next level
-        input_files = next_level_input_files
+        # add extra layers to the report if requested by the user
         depth = depth - 1
-
+        if depth < 1:
+            break
+        level = graph.load_level(walk.unvisited(input_files))
+
+    logger.debug(
+        "Generated the provenance of data product %s, skipped %d data products and %d "
+        "code runs that had already been visited",
+        data_product.id,
+        walk.skipped_data_products,
+        walk.skipped_code_runs,
+    )
     return doc
 
 
-def highlight_issues(dot):
+def highlight_issues(dot, tainted_uris=()):
+    """
+    Highlight the issues on the nodes of a dot graph of a PROV document.
+
+    :param dot: A dot graph generated from the PROV document
+    :param tainted_uris: The URIs of the entities that were derived from one with an
+        issue, which are outlined in red
+
+    """
+    tainted_uris = set(tainted_uris)
     nodes = dot.get_node_list()
     for node in nodes:
+        if node.get_attributes().get("URL", "").strip('"') in tainted_uris:
+            node.set("color", "red")
+            node.set("penwidth", "2")
         if "fair:issue" in node.obj_dict["attributes"]["label"]:
             label = node.get_label()
             table = xml.etree.ElementTree.fromstring(label[1:-1:])
@@ -749,7 +995,126 @@ def highlight_issues(dot):
             node.set_label("<" + new_label + ">")
 
 
-def serialize_prov_document(doc, format_, aspect_ratio, dpi=None, show_attributes=True):
+def get_data_product_uris(doc, data_product_ids):
+    """
+    Get the URIs of DataProducts in a PROV document.
+
+    :param doc: A PROV document
+    :param data_product_ids: An iterable of DataProduct ids
+
+    :return: A set of the URIs of the DataProducts
+
+    """
+    for namespace in doc.get_registered_namespaces():
+        if namespace.prefix in ("reg", "lreg"):
+            return {
+                namespace[f"api/data_product/{data_product_id}"].uri
+                for data_product_id in data_product_ids
+            }
+    return set()
+
+
+class _TripleCollector:
+    """
+    Collects the triples of a PROV document encoded by the PROV-O serializer, in
+    place of the RDFLib graph that it would otherwise add them to.
+    """
+
+    def __init__(self):
+        self.namespaces = {}
+        self.triples = {}
+
+    def bind(self, prefix, namespace):
+        self.namespaces[prefix] = str(namespace)
+
+    def add(self, triple):
+        self.triples[triple] = None
+
+    def remove(self, triple):
+        self.triples.pop(triple, None)
+
+
+def _json_ld_value(value, shrink):
+    if isinstance(value, BNode):
+        return {"@id": value.n3()}
+    if isinstance(value, URIRef):
+        return {"@id": shrink(value)}
+    if value.datatype in JSON_LD_NATIVE_TYPES:
+        return value.toPython()
+    if value.datatype:
+        return {"@type": shrink(value.datatype), "@value": str(value)}
+    if value.language:
+        return {"@language": value.language, "@value": str(value)}
+    return str(value)
+
+
+def serialize_json_ld(doc):
+    """
+    Serialise a PROV document as JSON-LD using PROV-O.
+
+    The PROV-O triples are converted directly to JSON-LD node objects, rather than
+    by adding them to an RDFLib graph and serialising that, or by way of TriG. The
+    output takes the same form as RDFLib's JSON-LD serializer, a `@graph` of node
+    objects with IRIs shortened by the prefixes in the `@context`.
+
+    :param doc: A PROV document
+
+    :return: A str containing the JSON-LD
+
+    """
+    collector = _TripleCollector()
+    collector.bind("prov", PROV.uri)
+    serializer = ProvRDFSerializer(doc)
+    serializer.encode_container(doc, container=collector)
+    # the bundles are merged into a single graph
+    for bundle in doc.bundles:
+        serializer.encode_container(bundle, container=collector)
+
+    context = dict(JSON_LD_DEFAULT_CONTEXT)
+    context.update(collector.namespaces)
+    prefixes = {namespace: prefix for prefix, namespace in context.items()}
+
+    def shrink(iri):
+        namespace, name = split_iri(str(iri))
+        prefix = prefixes.get(namespace)
+        if prefix:
+            return f"{prefix}:{name}"
+        return str(iri)
+
+    nodes = {}
+    for subject, predicate, value in collector.triples:
+        if isinstance(subject, BNode):
+            node_id = subject.n3()
+        else:
+            node_id = shrink(subject)
+        node = nodes.setdefault(node_id, {"@id": node_id})
+        if predicate == RDF.type:
+            key = "@type"
+            if isinstance(value, URIRef):
+                value = shrink(value)
+            else:
+                value = _json_ld_value(value, shrink)
+        else:
+            key = shrink(predicate)
+            value = _json_ld_value(value, shrink)
+        if key not in node:
+            node[key] = value
+        elif isinstance(node[key], list):
+            node[key].append(value)
+        else:
+            node[key] = [node[key], value]
+
+    if len(nodes) == 1:
+        (result,) = nodes.values()
+    else:
+        result = {"@graph": list(nodes.values())}
+    result["@context"] = context
+    return json.dumps(result, indent=4, sort_keys=True, ensure_ascii=False)
+
+
+def serialize_prov_document(
+    doc, format_, aspect_ratio, dpi=None, show_attributes=True, tainted_uris=()
+):
     """
     Serialise a PROV document as either a JPEG or SVG image or an XML or JSON-LD or
     PROV-N report.
@@ -759,22 +1124,18 @@ def serialize_prov_document(doc, format_, aspect_ratio, dpi=None, show_attribute
     :param aspect_ratio: a float used to define the ratio for images
     :param dpi:  a float used to define the dpi for images
     :param show_attributes: a boolean, shows attributes of elements when True
+    :param tainted_uris: the URIs of the entities to outline in red on images, see
+        `highlight_issues`
 
     :return: The PROV report in the specified format
 
     """
     if format_ in ("jpg", "svg"):
         dot = prov.dot.prov_to_dot(doc, show_element_attributes=show_attributes)
-        highlight_issues(dot)
+        highlight_issues(dot, tainted_uris)
         dot.set_ratio(aspect_ratio)
         dot.set_dpi(dpi)
-        with io.BytesIO() as buf:
-            if format_ == "jpg":
-                buf.write(dot.create_jpg())
-            else:
-                buf.write(dot.create_svg())
-            buf.seek(0)
-            return buf.read()
+        return render_pool.render(dot, format_)
 
     elif format_ == "xml":
         with io.StringIO() as buf:
@@ -791,18 +1152,7 @@ def serialize_prov_document(doc, format_, aspect_ratio, dpi=None, show_attribute
             return buf.read()
 
     elif format_ == "json-ld":
-        with io.StringIO() as buf:
-            serializer = prov.serializers.get("rdf")
-            serializer(doc).serialize(buf)
-            buf.seek(0)
-            graph = Graph()
-            graph.parse(data=buf.read(), format="trig")
-        # we should be able to use `context = dict(graph.namespaces())` but this
-        # appears not to work in RDFlib 5.0.0
-        context = {}
-        for prefix, uri in graph.namespaces():
-            context[prefix] = str(uri)
-        return graph.serialize(format="json-ld", indent=4, context=context)
+        return serialize_json_ld(doc)
 
     else:
         with io.StringIO() as buf:
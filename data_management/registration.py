@@ -0,0 +1,352 @@
+"""
+Registration of a whole `CodeRun` from a single manifest.
+
+Registering the run of a pipeline record by record takes a request, and a transaction,
+for every `StorageLocation`, `Object`, `ObjectComponent` and `DataProduct` it produced
+before the `CodeRun` itself can be created. Instead the manifest of the run, validated
+by `CodeRunManifestSerializer`, is registered in one transaction with a bulk insert for
+each kind of record, so the number of queries does not grow with the number of inputs
+and outputs.
+
+The records the run refers to are matched by their natural keys. Existing
+`StorageRoot`s, `StorageLocation`s, `Namespace`s and `CodeRepoRelease`s are reused and
+only those that are missing are created. New `Object`s are created for the code, config
+and submission script of the run, unless the code is an existing release, and for each
+of its outputs. As the `DataProduct`s are created last, with the `CodeRun` already
+linked to their components, the lineage closure table and the provenance fingerprints
+are brought up to date along with them, see `DataProductManager`.
+"""
+
+from . import models
+
+BATCH_SIZE = 1000
+
+CODE_FIELDS = ("code_repo", "model_config", "submission_script")
+
+WHOLE_OBJECT = "whole_object"
+
+
+def find(queryset, key_fields, keys):
+    """
+    Find records by their natural keys with a single query.
+
+    The records are filtered on the values of each of the key fields, and those that
+    match a whole key are picked out of the results, rather than the query being built
+    from a condition for each key.
+
+    :param queryset: The queryset to search
+    :param key_fields: A tuple of the names of the fields making up the keys
+    :param keys: An iterable of tuples of the values of the key fields
+
+    :return: A dict of the ids of the records found, keyed by their natural keys
+
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+    queryset = queryset.filter(
+        **{
+            f"{field}__in": {key[index] for key in keys}
+            for index, field in enumerate(key_fields)
+        }
+    )
+    found = {}
+    for row in queryset.values_list("id", *key_fields):
+        if row[1:] in keys:
+            found[row[1:]] = row[0]
+    return found
+
+
+def resolve_inputs(inputs):
+    """
+    Find the `ObjectComponent`s used as the inputs of a `CodeRun`.
+
+    :param inputs: An iterable of tuples of the namespace, name and version of a
+        `DataProduct` and the name of the component of its `Object`
+
+    :return: A dict of the ids of the components found, keyed by the tuples
+
+    """
+    return find(
+        models.ObjectComponent.objects.all(),
+        (
+            "object__data_products__namespace__name",
+            "object__data_products__name",
+            "object__data_products__version",
+            "name",
+        ),
+        inputs,
+    )
+
+
+def find_data_products(keys):
+    """
+    Find existing `DataProduct`s.
+
+    :param keys: An iterable of tuples of the namespace, name and version of a
+        `DataProduct`
+
+    :return: A dict of the ids of the `DataProduct`s found, keyed by the tuples
+
+    """
+    return find(
+        models.DataProduct.objects.all(), ("namespace__name", "name", "version"), keys
+    )
+
+
+def _bulk_create(model, objs, key_fields):
+    """
+    Insert new records, finding the ids of any that the database did not return by
+    their natural keys.
+    """
+    objs = model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    missing = {
+        tuple(getattr(obj, field) for field in key_fields): obj
+        for obj in objs
+        if obj.pk is None
+    }
+    for key, pk in find(model.objects.all(), key_fields, missing).items():
+        missing[key].pk = pk
+    return objs
+
+
+def _get_or_create(model, key_fields, keys, user):
+    """
+    Find records by their natural keys, creating those that do not exist.
+
+    :return: A dict of the ids of the records, keyed by their natural keys
+
+    """
+    keys = set(keys)
+    ids = find(model.objects.all(), key_fields, keys)
+    created = _bulk_create(
+        model,
+        [
+            model(updated_by=user, **dict(zip(key_fields, key)))
+            for key in sorted(keys - set(ids))
+        ],
+        key_fields,
+    )
+    for obj in created:
+        ids[tuple(getattr(obj, field) for field in key_fields)] = obj.pk
+    return ids
+
+
+def _storage_locations(manifests, user):
+    """
+    Find the `StorageLocation`s of the objects in a manifest, creating those that do
+    not exist along with their `StorageRoot`s.
+
+    :return: A dict of `StorageLocation` ids, keyed by the ids of the manifests
+
+    """
+    locations = {
+        id(manifest): manifest["storage_location"]
+        for manifest in manifests
+        if manifest.get("storage_location")
+    }
+    root_ids = _get_or_create(
+        models.StorageRoot,
+        ("root",),
+        ((location["storage_root"],) for location in locations.values()),
+        user,
+    )
+
+    key_fields = ("storage_root_id", "hash", "public")
+    keys = {
+        manifest_id: (
+            root_ids[(location["storage_root"],)],
+            location["hash"],
+            location["public"],
+        )
+        for manifest_id, location in locations.items()
+    }
+    ids = find(models.StorageLocation.objects.all(), key_fields, keys.values())
+
+    new = {}
+    for manifest_id, key in keys.items():
+        if key not in ids and key not in new:
+            new[key] = models.StorageLocation(
+                storage_root_id=key[0],
+                path=locations[manifest_id]["path"],
+                hash=key[1],
+                public=key[2],
+                updated_by=user,
+            )
+    for obj in _bulk_create(models.StorageLocation, list(new.values()), key_fields):
+        ids[(obj.storage_root_id, obj.hash, obj.public)] = obj.pk
+
+    return {manifest_id: ids[key] for manifest_id, key in keys.items()}
+
+
+def register(manifest, user):
+    """
+    Register a `CodeRun` along with everything it used and produced.
+
+    :param manifest: The validated data of a `CodeRunManifestSerializer`
+    :param user: The user registering the run
+
+    :return: A dict of the records making up the run, holding the `CodeRun`, the
+        code, config and submission script `Object`s, the `CodeRepoRelease`, the ids of
+        the input `ObjectComponent`s and, for each output, a dict of its `DataProduct`,
+        `Object`, `StorageLocation` id and the ids of its components keyed by name
+
+    """
+    outputs = manifest.get("outputs", [])
+    code = {
+        field: manifest[field]
+        for field in CODE_FIELDS
+        if manifest.get(field) is not None
+    }
+
+    release = None
+    release_manifest = code.get("code_repo", {}).get("release")
+    if release_manifest is not None:
+        release = (
+            models.CodeRepoRelease.objects.filter(
+                name=release_manifest["name"], version=release_manifest["version"]
+            )
+            .select_related("object")
+            .first()
+        )
+    if release is not None:
+        # the code is an existing release, so its object is reused
+        code_objects = {"code_repo": release.object}
+        del code["code_repo"]
+    else:
+        code_objects = {}
+
+    location_ids = _storage_locations(list(code.values()) + outputs, user)
+
+    def make_object(object_manifest):
+        return models.Object(
+            storage_location_id=location_ids.get(id(object_manifest)),
+            description=object_manifest.get("description"),
+            file_type_id=object_manifest.get("file_type"),
+            updated_by=user,
+        )
+
+    code_objects.update((field, make_object(code[field])) for field in code)
+    output_objects = [make_object(output) for output in outputs]
+    new_objects = [code_objects[field] for field in code] + output_objects
+    models.Object.objects.bulk_create(new_objects, batch_size=BATCH_SIZE)
+
+    authors = models.Object.authors.through
+    authors.objects.bulk_create(
+        (
+            authors(object_id=obj.pk, author_id=author_id)
+            for obj, object_manifest in zip(
+                new_objects, [code[field] for field in code] + outputs
+            )
+            for author_id in dict.fromkeys(object_manifest.get("authors", ()))
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    if release_manifest is not None and release is None:
+        release = models.CodeRepoRelease.objects.create(
+            object=code_objects["code_repo"],
+            name=release_manifest["name"],
+            version=release_manifest["version"],
+            website=release_manifest.get("website"),
+            updated_by=user,
+        )
+
+    # the whole object component of each new object was created along with it
+    components = {
+        (object_id, WHOLE_OBJECT): component_id
+        for object_id, component_id in models.ObjectComponent.objects.filter(
+            object__in=output_objects, whole_object=True
+        ).values_list("object_id", "id")
+    }
+    new_components = _bulk_create(
+        models.ObjectComponent,
+        [
+            models.ObjectComponent(
+                object_id=obj.pk,
+                name=component["name"],
+                description=component.get("description"),
+                updated_by=user,
+            )
+            for obj, output in zip(output_objects, outputs)
+            for component in output.get("components", ())
+            if component["name"] != WHOLE_OBJECT
+        ],
+        ("object_id", "name"),
+    )
+    components.update(
+        ((component.object_id, component.name), component.pk)
+        for component in new_components
+    )
+
+    code_run = models.CodeRun.objects.create(
+        code_repo=code_objects.get("code_repo"),
+        model_config=code_objects.get("model_config"),
+        submission_script=code_objects["submission_script"],
+        run_date=manifest["run_date"],
+        description=manifest["description"],
+        uuid=manifest["uuid"],
+        updated_by=user,
+    )
+
+    input_ids = list(
+        dict.fromkeys(item["component_id"] for item in manifest.get("inputs", ()))
+    )
+    output_components = []
+    for obj, output in zip(output_objects, outputs):
+        # an output that is not split into components is produced as a whole
+        names = [component["name"] for component in output.get("components", ())]
+        output_components.append(
+            {name: components[(obj.pk, name)] for name in names or [WHOLE_OBJECT]}
+        )
+    output_ids = [
+        component_id for ids in output_components for component_id in ids.values()
+    ]
+    for field, component_ids in (("inputs", input_ids), ("outputs", output_ids)):
+        through = getattr(models.CodeRun, field).through
+        through.objects.bulk_create(
+            (
+                through(coderun_id=code_run.pk, objectcomponent_id=component_id)
+                for component_id in component_ids
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+    namespace_ids = _get_or_create(
+        models.Namespace,
+        ("name",),
+        ((output["namespace"],) for output in outputs),
+        user,
+    )
+    data_products = _bulk_create(
+        models.DataProduct,
+        [
+            models.DataProduct(
+                object=obj,
+                namespace_id=namespace_ids[(output["namespace"],)],
+                name=output["name"],
+                version=output["version"],
+                updated_by=user,
+            )
+            for obj, output in zip(output_objects, outputs)
+        ],
+        ("namespace_id", "name", "version"),
+    )
+
+    return {
+        "code_run": code_run,
+        "code_repo_release": release,
+        **{field: code_objects.get(field) for field in CODE_FIELDS},
+        "inputs": input_ids,
+        "outputs": [
+            {
+                "data_product": data_product,
+                "object": obj,
+                "storage_location": obj.storage_location_id,
+                "components": ids,
+            }
+            for data_product, obj, ids in zip(
+                data_products, output_objects, output_components
+            )
+        ],
+    }
@@ -0,0 +1,242 @@
+"""
+Pool of GraphViz processes used to render provenance reports as images.
+
+Rendering a large provenance graph as a `JPEG` or `SVG` image can keep GraphViz busy
+for tens of seconds. Renders are therefore run by a bounded pool of worker threads,
+each running one `dot` process at a time, so that no more than `PROV_RENDER_WORKERS`
+`dot` processes are run at once by each server process. At most
+`PROV_RENDER_QUEUE_DEPTH` further renders may wait for a worker, beyond that
+`RenderPoolBusy` is raised and the API responds with 503 rather than holding on to yet
+another request. A `dot` process that runs for longer than `PROV_RENDER_TIMEOUT`
+seconds is killed and `RenderTimeout` is raised.
+
+The time each render waited for a worker and the time GraphViz took are logged and
+accumulated, see `get_stats`.
+"""
+
+import functools
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_DEPTH = 8
+DEFAULT_TIMEOUT = 60
+
+
+class RenderPoolBusy(Exception):
+    """
+    Raised when every worker in the render pool is busy and the queue of renders
+    waiting for one is full.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    """
+    Raised when GraphViz takes longer than the render timeout.
+    """
+
+
+class RenderPool:
+    """
+    A bounded pool of worker threads that run GraphViz.
+
+    :param workers: The number of `dot` processes that may be run at once
+    :param queue_depth: The number of renders that may wait for a worker
+    :param timeout: The number of seconds a `dot` process may run for
+
+    """
+
+    def __init__(self, workers, queue_depth, timeout):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prov-render"
+        )
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {
+            "rendered": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "failed": 0,
+            "queue_wait_seconds": 0.0,
+            "max_queue_wait_seconds": 0.0,
+            "render_seconds": 0.0,
+            "max_render_seconds": 0.0,
+        }
+
+    def render(self, dot, format_):
+        """
+        Render a graph with GraphViz, waiting for a worker if they are all busy.
+
+        :param dot: A `pydot.Dot` graph
+        :param format_: The GraphViz output format, i.e. jpg or svg
+
+        :return: The bytes output by GraphViz
+
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.queue_depth:
+                self._stats["rejected"] += 1
+                raise RenderPoolBusy(
+                    "All %d provenance report renderers are busy and %d renders are "
+                    "waiting" % (self.workers, self.queue_depth),
+                    self.timeout,
+                )
+            self._pending += 1
+
+        try:
+            source = dot.to_string().encode("utf-8")
+            future = self._executor.submit(
+                self._run, dot.prog, source, format_, time.monotonic()
+            )
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return future.result()
+
+    def _run(self, prog, source, format_, submitted):
+        started = time.monotonic()
+        queue_wait = started - submitted
+        try:
+            process = subprocess.run(
+                [prog, f"-T{format_}"],
+                input=source,
+                capture_output=True,
+                timeout=self.timeout,
+            )
+        except subprocess.TimeoutExpired:
+            self._record("timed_out", queue_wait, time.monotonic() - started)
+            raise RenderTimeout(
+                "Rendering the provenance report took longer than %d seconds"
+                % self.timeout
+            )
+        except BaseException:
+            self._record("failed", queue_wait, time.monotonic() - started)
+            raise
+
+        if process.returncode != 0:
+            self._record("failed", queue_wait, time.monotonic() - started)
+            raise RuntimeError(
+                '"%s" returned code %d: %s'
+                % (prog, process.returncode, process.stderr.decode("utf-8", "replace"))
+            )
+        self._record("rendered", queue_wait, time.monotonic() - started)
+        return process.stdout
+
+    def _record(self, outcome, queue_wait, render_time):
+        with self._lock:
+            self._pending -= 1
+            stats = self._stats
+            stats[outcome] += 1
+            stats["queue_wait_seconds"] += queue_wait
+            stats["max_queue_wait_seconds"] = max(
+                stats["max_queue_wait_seconds"], queue_wait
+            )
+            stats["render_seconds"] += render_time
+            stats["max_render_seconds"] = max(stats["max_render_seconds"], render_time)
+        logger.info(
+            "Provenance report render %s after waiting %.3f s, GraphViz ran for %.3f s",
+            outcome.replace("_", " "),
+            queue_wait,
+            render_time,
+        )
+
+    def get_stats(self):
+        """
+        Get the metrics of the pool.
+
+        :return: A dict of the configuration of the pool, the number of renders that
+            are running or waiting, the counts of renders by outcome, and the total
+            and maximum seconds spent waiting for a worker and running GraphViz
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+        stats["workers"] = self.workers
+        stats["queue_depth"] = self.queue_depth
+        stats["timeout"] = self.timeout
+        return stats
+
+
+@functools.lru_cache(maxsize=None)
+def graphviz_available(prog="dot"):
+    """
+    Check whether GraphViz is installed. The check runs `dot` once per process, the
+    first time it is needed, and the result is cached.
+
+    :param prog: The GraphViz program to look for
+
+    :return: A boolean, True if the program can be run
+
+    """
+    try:
+        subprocess.run(
+            [prog, "-V"],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            timeout=DEFAULT_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return True
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Get the render pool of this process, creating it from the `PROV_RENDER_WORKERS`,
+    `PROV_RENDER_QUEUE_DEPTH` and `PROV_RENDER_TIMEOUT` settings on first use.
+
+    :return: A `RenderPool`
+
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool(
+                getattr(settings, "PROV_RENDER_WORKERS", DEFAULT_WORKERS),
+                getattr(settings, "PROV_RENDER_QUEUE_DEPTH", DEFAULT_QUEUE_DEPTH),
+                getattr(settings, "PROV_RENDER_TIMEOUT", DEFAULT_TIMEOUT),
+            )
+        return _pool
+
+
+def render(dot, format_):
+    """
+    Render a graph with GraphViz using the render pool of this process.
+
+    :param dot: A `pydot.Dot` graph
+    :param format_: The GraphViz output format, i.e. jpg or svg
+
+    :return: The bytes output by GraphViz
+
+    """
+    return get_pool().render(dot, format_)
+
+
+def get_stats():
+    """
+    Get the metrics of the render pool of this process, see `RenderPool.get_stats`.
+
+    :return: A dict of metrics
+
+    """
+    return get_pool().get_stats()
@@ -0,0 +1,169 @@
+"""
+Cache of rendered provenance reports.
+
+Rendering a provenance report, particularly running GraphViz to produce the `JPEG` and
+`SVG` images, is far more expensive than loading the part of the provenance graph that it
+is generated from. Rendered reports are therefore cached, keyed on the parameters of the
+report and a fingerprint of every record in its provenance graph, see
+`LineageGraph.fingerprint`.
+
+As the key is derived from the content of the graph, any change to a record in the
+graph results in a new key, so a stale report is never returned. Entries that can no
+longer be reached are removed by the eviction policy of the cache backend. The cache
+used is the one named by the `PROV_REPORT_CACHE` setting, by default a local memory
+cache bounded by `MAX_ENTRIES`, which evicts the least recently used entries first.
+
+Reports of different depths, or of different data products, share much of their
+provenance, so the provenance of a single level of each data product is also cached as
+a fragment that reports are assembled from. A fragment is keyed on a fingerprint of
+only the records it is generated from, see `LineageGraph.fragment_fingerprint`, so it
+is reused by every report that includes the data product until the code run that
+generated it, its components, issues or authors, or the inputs of the code run change.
+The cache used for fragments is the one named by the `PROV_FRAGMENT_CACHE` setting.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = "prov_report"
+FRAGMENT_KEY_PREFIX = "prov_fragment"
+# changed whenever the content of the fragments changes, so old ones are not reused
+FRAGMENT_VERSION = 1
+
+
+def get_cache(setting="PROV_REPORT_CACHE"):
+    """
+    Get the cache used to store rendered provenance reports or provenance fragments.
+
+    :param setting: The name of the setting naming the cache
+
+    :return: A Django cache, or None if report caching has been disabled
+
+    """
+    alias = getattr(settings, setting, None)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def make_key(
+    data_product_id,
+    depth,
+    format_,
+    aspect_ratio,
+    dpi,
+    show_attributes,
+    registry_url,
+    fingerprint,
+    tainted=(),
+):
+    """
+    Make the cache key for a rendered provenance report.
+
+    :param data_product_id: The id of the DataProduct the report is for
+    :param depth: The depth of the report
+    :param format_: The format of the report
+    :param aspect_ratio: The aspect ratio used for images
+    :param dpi: The dpi used for images
+    :param show_attributes: A boolean, True if the attributes are shown on images
+    :param registry_url: The URL of the registry the report was requested from
+    :param fingerprint: The fingerprint of the provenance graph of the report
+    :param tainted: The ids of the DataProducts highlighted as derived from one with an
+        issue
+
+    :return: A str containing the cache key
+
+    """
+    parts = (
+        data_product_id,
+        depth,
+        format_,
+        aspect_ratio,
+        dpi,
+        bool(show_attributes),
+        registry_url,
+        fingerprint,
+        tuple(sorted(tainted)),
+    )
+    digest = hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+    return f"{KEY_PREFIX}:{digest}"
+
+
+def get_report(key):
+    """
+    Get a rendered provenance report from the cache.
+
+    :param key: A key generated by `make_key`
+
+    :return: The rendered report, or None if it is not in the cache
+
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    return cache.get(key)
+
+
+def set_report(key, value):
+    """
+    Add a rendered provenance report to the cache.
+
+    :param key: A key generated by `make_key`
+    :param value: The rendered report
+
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.set(key, value, timeout=None)
+
+
+def make_fragment_key(data_product_id, namespaces, fingerprint):
+    """
+    Make the cache key for the provenance fragment of a data product.
+
+    :param data_product_id: The id of the DataProduct the fragment is for
+    :param namespaces: A dict of the URIs of the namespaces of the report, keyed by
+        prefix
+    :param fingerprint: The fingerprint of the records the fragment is generated from
+
+    :return: A str containing the cache key
+
+    """
+    parts = (
+        FRAGMENT_VERSION,
+        data_product_id,
+        tuple(sorted(namespaces.items())),
+        fingerprint,
+    )
+    digest = hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+    return f"{FRAGMENT_KEY_PREFIX}:{digest}"
+
+
+def get_fragments(keys):
+    """
+    Get provenance fragments from the cache.
+
+    :param keys: An iterable of keys generated by `make_fragment_key`
+
+    :return: A dict of the fragments that are in the cache, keyed by key
+
+    """
+    cache = get_cache("PROV_FRAGMENT_CACHE")
+    if cache is None:
+        return {}
+    return cache.get_many(keys)
+
+
+def set_fragments(fragments):
+    """
+    Add provenance fragments to the cache.
+
+    :param fragments: A dict of fragments keyed by keys generated by
+        `make_fragment_key`
+
+    """
+    cache = get_cache("PROV_FRAGMENT_CACHE")
+    if cache is not None and fragments:
+        cache.set_many(fragments, timeout=None)
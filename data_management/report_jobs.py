@@ -0,0 +1,324 @@
+"""
+Generation of provenance reports and RO Crates in the background.
+
+Deep provenance images and large RO Crates can take longer to generate than a client or
+proxy is prepared to wait for a response. Rather than a GET, a POST to a report
+endpoint creates a `ReportJob`, which is run by a pool of `REPORT_JOB_WORKERS` threads in
+the server process, no message broker is needed. The progress of the job is reported by
+the job endpoint, and once it has finished the generated file is served from
+`REPORT_JOB_DIR` until `REPORT_JOB_TTL` seconds have passed, after which the job and its
+file are removed. At most `REPORT_JOB_QUEUE_DEPTH` jobs may wait for a worker in each
+server process, beyond that `ReportJobQueueFull` is raised and the API responds with 503.
+
+Identical requests share a job while it is queued, running or its file is available, so
+a client that retries does not generate the same report again. As with the reports
+cached by the GET endpoints, a shared file may describe the registry as it was up to
+`REPORT_JOB_TTL` seconds earlier. A job left queued or running by a server process that
+exited is removed once it has expired. Expired jobs are purged by the requests creating
+jobs at most once every `REPORT_JOB_PURGE_INTERVAL` seconds, or by the
+`purge_report_jobs` management command.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_TTL = 3600
+DEFAULT_QUEUE_DEPTH = 8
+DEFAULT_PURGE_INTERVAL = 60
+RETRY_AFTER = 30
+
+
+class ReportJobQueueFull(Exception):
+    """
+    Raised when every report job worker is busy and the queue of jobs waiting for one
+    is full.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_job_dir():
+    """
+    Get the directory the files generated by report jobs are written to, creating it
+    if it does not exist.
+
+    :return: A str containing the path of the directory
+
+    """
+    job_dir = getattr(settings, "REPORT_JOB_DIR", None) or os.path.join(
+        settings.BASE_DIR, "report_jobs"
+    )
+    os.makedirs(job_dir, exist_ok=True)
+    return job_dir
+
+
+def get_path(job):
+    """
+    Get the path of the file generated by a report job.
+
+    :param job: A ReportJob, or its id
+
+    :return: A str containing the path of the file
+
+    """
+    job_id = getattr(job, "id", job)
+    return os.path.join(get_job_dir(), str(job_id))
+
+
+def _get_ttl():
+    return timedelta(seconds=getattr(settings, "REPORT_JOB_TTL", DEFAULT_TTL))
+
+
+def make_key(report, object_id, format_, params, registry_url):
+    """
+    Make the key identifying the report generated by a job.
+
+    :param report: The name of the report endpoint
+    :param object_id: The id of the record the report is for
+    :param format_: The format of the report
+    :param params: A dict of the parameters of the report
+    :param registry_url: The URL of the registry the report was requested from
+
+    :return: A str containing the key
+
+    """
+    parts = (report, object_id, format_, tuple(sorted(params.items())), registry_url)
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "REPORT_JOB_WORKERS", DEFAULT_WORKERS),
+                thread_name_prefix="report-job",
+            )
+        return _executor
+
+
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def _reserve():
+    """
+    Reserve a place for a new job among those queued or running in this process.
+    """
+    global _pending
+    workers = getattr(settings, "REPORT_JOB_WORKERS", DEFAULT_WORKERS)
+    queue_depth = getattr(settings, "REPORT_JOB_QUEUE_DEPTH", DEFAULT_QUEUE_DEPTH)
+    with _pending_lock:
+        if _pending >= workers + queue_depth:
+            raise ReportJobQueueFull(
+                "All %d report job workers are busy and %d jobs are waiting"
+                % (workers, queue_depth),
+                RETRY_AFTER,
+            )
+        _pending += 1
+
+
+def _release():
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+_last_purge = None
+_purge_lock = threading.Lock()
+
+
+def _purge_if_due():
+    """
+    Remove the expired report jobs, unless they were removed less than
+    `REPORT_JOB_PURGE_INTERVAL` seconds ago by this process.
+    """
+    global _last_purge
+    interval = getattr(settings, "REPORT_JOB_PURGE_INTERVAL", DEFAULT_PURGE_INTERVAL)
+    now = time.monotonic()
+    with _purge_lock:
+        if _last_purge is not None and now - _last_purge < interval:
+            return
+        _last_purge = now
+    purge_expired()
+
+
+def submit(report, object_id, format_, params, registry_url, generate):
+    """
+    Get the job generating a report, creating a job and queueing it to be run if there
+    is no queued, running or unexpired finished job for an identical request.
+
+    :param report: The name of the report endpoint
+    :param object_id: The id of the record the report is for
+    :param format_: The format of the report
+    :param params: A dict of the parameters of the report
+    :param registry_url: The URL of the registry the report was requested from
+    :param generate: A callable that generates the report, returning a tuple of its
+        content, as bytes, a str or an iterable of bytes, its content type and the name
+        of the file to serve it as
+
+    :return: A tuple of the ReportJob and a boolean, True if the job was created
+
+    :raises ReportJobQueueFull: If a job is needed but too many are waiting for a
+        worker
+
+    """
+    _purge_if_due()
+    key = make_key(report, object_id, format_, params, registry_url)
+
+    job = models.ReportJob.objects.filter(key=key).first()
+    if job is not None:
+        if job.status != models.ReportJob.FAILED and job.expires > timezone.now():
+            return job, False
+        _delete([job.id])
+
+    workers = getattr(settings, "REPORT_JOB_WORKERS", DEFAULT_WORKERS)
+    if workers:
+        _reserve()
+    job = None
+    try:
+        with transaction.atomic():
+            job = models.ReportJob.objects.create(
+                key=key,
+                report=report,
+                object_id=object_id,
+                format=format_,
+                expires=timezone.now() + _get_ttl(),
+            )
+    except IntegrityError:
+        # an identical request created a job first
+        return models.ReportJob.objects.get(key=key), False
+    finally:
+        if workers and job is None:
+            _release()
+
+    if workers:
+        transaction.on_commit(
+            lambda: _get_executor().submit(_run_in_worker, job.id, generate)
+        )
+    else:
+        # without workers the job is run by the request that created it
+        transaction.on_commit(lambda: run(job.id, generate))
+    return job, True
+
+
+def _run_in_worker(job_id, generate):
+    try:
+        run(job_id, generate)
+    finally:
+        _release()
+        # the worker threads outlive requests, so their connections are not closed
+        connections.close_all()
+
+
+def run(job_id, generate):
+    """
+    Run a report job, writing the file it generates to `REPORT_JOB_DIR`.
+
+    :param job_id: The id of the ReportJob
+    :param generate: The callable that generates the report, see `submit`
+
+    """
+    started = models.ReportJob.objects.filter(
+        id=job_id, status=models.ReportJob.QUEUED
+    ).update(status=models.ReportJob.RUNNING)
+    if not started:
+        # the job has been removed
+        return
+
+    path = get_path(job_id)
+    try:
+        content, content_type, file_name = generate()
+        _write(path, content)
+    except Exception as err:
+        logger.exception("Report job %s failed", job_id)
+        _remove(path)
+        now = timezone.now()
+        models.ReportJob.objects.filter(id=job_id).update(
+            status=models.ReportJob.FAILED,
+            error=str(err) or err.__class__.__name__,
+            finished=now,
+            expires=now + _get_ttl(),
+        )
+        return
+
+    now = timezone.now()
+    finished = models.ReportJob.objects.filter(id=job_id).update(
+        status=models.ReportJob.FINISHED,
+        content_type=content_type,
+        file_name=file_name,
+        finished=now,
+        expires=now + _get_ttl(),
+    )
+    if not finished:
+        # the job expired and was removed while it was running
+        _remove(path)
+
+
+def _write(path, content):
+    """
+    Write the content of a report to a file, which only appears once it is complete.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if isinstance(content, bytes):
+        content = (content,)
+
+    part_path = path + ".part"
+    try:
+        with open(part_path, "wb") as f:
+            for chunk in content:
+                f.write(chunk)
+        os.replace(part_path, path)
+    except BaseException:
+        _remove(part_path)
+        raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _delete(job_ids):
+    for job_id in job_ids:
+        _remove(get_path(job_id))
+    models.ReportJob.objects.filter(id__in=job_ids).delete()
+
+
+def purge_expired():
+    """
+    Remove the expired report jobs and their files.
+
+    :return: The number of jobs removed
+
+    """
+    job_ids = list(
+        models.ReportJob.objects.filter(expires__lte=timezone.now()).values_list(
+            "id", flat=True
+        )
+    )
+    _delete(job_ids)
+    return len(job_ids)
@@ -1,23 +1,185 @@
 from collections import OrderedDict
-from rest_framework import pagination, response
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import exceptions, pagination, response
+from rest_framework.pagination import Cursor
+
+COUNT_EXACT = "exact"
+COUNT_ESTIMATE = "estimate"
+COUNT_NONE = "none"
+COUNT_MODES = (COUNT_EXACT, COUNT_ESTIMATE, COUNT_NONE)
 
 
 class CustomPagination(pagination.CursorPagination):
+    """
+    Cursor pagination that also reports the number of results.
+
+    Counting every row matching the query can be expensive on large tables, so how the
+    count is calculated can be chosen with the `count` query parameter, or for all
+    requests with the `PAGINATION_COUNT` setting:
+
+    * `exact`: the exact number of results, the default
+    * `estimate`: for an unfiltered query on PostgreSQL the row estimate from the
+      table statistics, otherwise the exact number of results up to
+      `PAGINATION_COUNT_LIMIT`, beyond which the limit is returned. The response also
+      contains `count_estimated`, which is true if the count is not exact.
+    * `none`: no count is calculated and the count is returned as null
+
+    Whatever the count mode, the results are paged by the cursor in the same way.
+    """
+
     ordering = "-id"
     page_size_query_param = "page_size"
+    count_query_param = "count"
 
     def paginate_queryset(self, queryset, request, view=None):
-        self.count = queryset.count()
+        self.count_mode = self.get_count_mode(request)
+        self.count_estimated = False
+        if self.count_mode == COUNT_NONE:
+            self.count = None
+        elif self.count_mode == COUNT_ESTIMATE:
+            self.count, self.count_estimated = self.estimate_count(queryset)
+        else:
+            self.count = queryset.count()
         return super().paginate_queryset(queryset, request, view)
 
-    def get_paginated_response(self, data):
-        return response.Response(
-            OrderedDict(
-                [
-                    ("count", self.count),
-                    ("next", self.get_next_link()),
-                    ("previous", self.get_previous_link()),
-                    ("results", data),
-                ]
+    def get_count_mode(self, request):
+        mode = request.query_params.get(
+            self.count_query_param, getattr(settings, "PAGINATION_COUNT", COUNT_EXACT)
+        )
+        if mode not in COUNT_MODES:
+            raise exceptions.ValidationError(
+                {
+                    self.count_query_param: "Invalid count, must be one of [%s]"
+                    % ", ".join(COUNT_MODES)
+                }
+            )
+        return mode
+
+    def estimate_count(self, queryset):
+        """
+        Estimate the number of results of the queryset.
+
+        :param queryset: The queryset being paginated
+
+        :return: A tuple of the count and True if the count is an estimate
+
+        """
+        if not queryset.query.where and not queryset.query.distinct:
+            estimate = self.get_table_estimate(queryset)
+            if estimate is not None:
+                return estimate, True
+
+        limit = getattr(settings, "PAGINATION_COUNT_LIMIT", 10000)
+        # counting a sliced queryset only scans up to the limit
+        count = queryset.order_by()[: limit + 1].count()
+        if count > limit:
+            return limit, True
+        return count, False
+
+    def get_table_estimate(self, queryset):
+        """
+        Get the number of rows in the table of the queryset from the statistics kept by
+        PostgreSQL.
+
+        :param queryset: The queryset being paginated
+
+        :return: The estimated number of rows, or None if there is no estimate
+
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
             )
+            row = cursor.fetchone()
+        # reltuples is -1 if the table has never been vacuumed or analysed
+        if row is None or row[0] < 0:
+            return None
+        return int(row[0])
+
+    def get_paginated_response(self, data):
+        fields = [("count", self.count)]
+        if self.count_mode == COUNT_ESTIMATE:
+            fields.append(("count_estimated", self.count_estimated))
+        fields.extend(
+            [
+                ("next", self.get_next_link()),
+                ("previous", self.get_previous_link()),
+                ("results", data),
+            ]
+        )
+        return response.Response(OrderedDict(fields))
+
+
+class LineagePagination(CustomPagination):
+    """
+    Cursor pagination of the records of a `LineageQuery`.
+
+    The records are ordered by depth and then id, and the cursor holds the depth and id
+    of the record at the edge of the page, so each page is fetched directly rather than
+    by skipping over the records before it. The count modes are the same as for
+    `CustomPagination`, except that an estimated count is always exact.
+    """
+
+    def paginate_lineage(self, lineage, request):
+        """
+        Get the page of records of the lineage requested.
+
+        :param lineage: A `LineageQuery`
+        :param request: The request for the page
+
+        :return: A list of (id, depth) tuples
+
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            position, self.reverse = None, False
+        else:
+            position, self.reverse = self.decode_position(cursor), cursor.reverse
+
+        rows = lineage.page(self.page_size + 1, position, self.reverse)
+        has_more = len(rows) > self.page_size
+        if has_more:
+            rows = rows[1:] if self.reverse else rows[:-1]
+        if self.reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = rows
+
+        self.count_mode = self.get_count_mode(request)
+        self.count_estimated = False
+        self.count = None if self.count_mode == COUNT_NONE else lineage.count()
+        return rows
+
+    def decode_position(self, cursor):
+        try:
+            depth, id_ = cursor.position.split(":")
+            return int(depth), int(id_)
+        except (AttributeError, ValueError):
+            raise exceptions.NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        depth, id_ = self.page[-1][1], self.page[-1][0]
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position="%d:%d" % (depth, id_))
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        depth, id_ = self.page[0][1], self.page[0][0]
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position="%d:%d" % (depth, id_))
         )
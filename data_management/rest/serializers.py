@@ -1,11 +1,22 @@
+from urllib import parse
 from uuid import uuid4
 
 from django.contrib.auth.models import Group
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Exists, OuterRef
 from django.contrib.auth import get_user_model
+from django.urls import Resolver404, get_script_prefix, resolve
+from django.utils.encoding import uri_to_iri
 from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.relations import MANY_RELATION_KWARGS
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 
-from data_management import models
+from data_management import lineage, models, registration, validators
+
+LATEST = "latest"
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -28,14 +39,201 @@ class GroupSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["url", "name"]
 
 
+class ReportJobSerializer(serializers.ModelSerializer):
+    """
+    Class for serializing the ReportJob model.
+    """
+
+    url = serializers.HyperlinkedIdentityField(view_name="report_job")
+    report_url = serializers.SerializerMethodField()
+    file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.ReportJob
+        fields = [
+            "url",
+            "id",
+            "report",
+            "report_url",
+            "format",
+            "status",
+            "error",
+            "created",
+            "finished",
+            "expires",
+            "file",
+        ]
+
+    def get_report_url(self, obj):
+        return reverse(
+            obj.report,
+            kwargs={"pk": obj.object_id},
+            request=self.context.get("request"),
+        )
+
+    def get_file(self, obj):
+        if obj.status != models.ReportJob.FINISHED:
+            return None
+        return reverse(
+            "report_job_file",
+            kwargs={"pk": obj.id},
+            request=self.context.get("request"),
+        )
+
+
+class BatchedHyperlinkedRelatedField(serializers.HyperlinkedRelatedField):
+    """
+    A hyperlinked related field which also accepts the id of the related object.
+
+    With `many=True` the field is a `BatchedManyRelatedField`, which fetches all of the
+    related objects at once.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {"child_relation": cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BatchedManyRelatedField(**list_kwargs)
+
+    def get_lookup_value(self, data):
+        """
+        Get the value that the related object is looked up by from a hyperlink or an
+        id, without querying the database.
+
+        :param data: A hyperlink to the related object, or its id
+
+        :return: The value of the `lookup_field` of the related object
+
+        """
+        if isinstance(data, int) and not isinstance(data, bool):
+            return data
+        try:
+            if data.isdigit():
+                return data
+            http_prefix = data.startswith(("http:", "https:"))
+        except AttributeError:
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+        if http_prefix:
+            # If needed convert absolute URLs to relative path
+            data = parse.urlparse(data).path
+            prefix = get_script_prefix()
+            if data.startswith(prefix):
+                data = "/" + data[len(prefix) :]
+
+        try:
+            match = resolve(uri_to_iri(parse.unquote(data)))
+        except Resolver404:
+            self.fail("no_match")
+
+        request = self.context.get("request")
+        try:
+            expected_viewname = request.versioning_scheme.get_versioned_viewname(
+                self.view_name, request
+            )
+        except AttributeError:
+            expected_viewname = self.view_name
+        if match.view_name != expected_viewname:
+            self.fail("incorrect_match")
+
+        return match.kwargs[self.lookup_url_kwarg]
+
+    def to_internal_value(self, data):
+        lookup_value = self.get_lookup_value(data)
+        try:
+            return self.get_queryset().get(**{self.lookup_field: lookup_value})
+        except (ObjectDoesNotExist, ValueError, TypeError):
+            self.fail("does_not_exist")
+
+
+class BatchedManyRelatedField(serializers.ManyRelatedField):
+    """
+    A list of hyperlinks to, or ids of, related objects, such as the `inputs` and
+    `outputs` of a `CodeRun`.
+
+    DRF's `ManyRelatedField` fetches each related object with a query of its own, and
+    stops at the first that is invalid. Instead all of the hyperlinks are parsed first
+    and the related objects are fetched with a single query, and every invalid or
+    missing reference is reported in the one validation error.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, "__iter__"):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail("empty")
+
+        child = self.child_relation
+        queryset = child.get_queryset()
+        if child.lookup_field == "pk":
+            lookup_field = queryset.model._meta.pk
+        else:
+            lookup_field = queryset.model._meta.get_field(child.lookup_field)
+
+        errors = {}
+        lookup_values = {}
+        for index, item in enumerate(data):
+            try:
+                lookup_values[index] = lookup_field.to_python(
+                    child.get_lookup_value(item)
+                )
+            except serializers.ValidationError as exc:
+                errors[index] = [
+                    ErrorDetail(f"{detail} ({item})", code=detail.code)
+                    for detail in exc.detail
+                ]
+            except DjangoValidationError:
+                lookup_values[index] = None
+
+        related = queryset.in_bulk(
+            {value for value in lookup_values.values() if value is not None},
+            field_name=lookup_field.name,
+        )
+        for index, value in lookup_values.items():
+            if value not in related:
+                errors[index] = [
+                    ErrorDetail(
+                        f"{child.error_messages['does_not_exist']} ({data[index]})",
+                        code="does_not_exist",
+                    )
+                ]
+        if errors:
+            # the errors are reported in the order of the references
+            raise serializers.ValidationError(
+                [detail for index in sorted(errors) for detail in errors[index]]
+            )
+
+        return [related[value] for value in lookup_values.values()]
+
+
+class HyperlinkedIdField(BatchedHyperlinkedRelatedField):
+    """
+    A hyperlink to, or id of, a related object, which is checked to be a valid
+    reference and converted to the id without the object being fetched, so that the
+    objects referenced throughout a `CodeRunManifestSerializer` can be fetched at once.
+    """
+
+    def to_internal_value(self, data):
+        try:
+            return self.get_queryset().model._meta.pk.to_python(
+                self.get_lookup_value(data)
+            )
+        except DjangoValidationError:
+            self.fail("does_not_exist")
+
+
 class BaseSerializer(serializers.HyperlinkedModelSerializer):
     """
     Base class for serializing the data management objects.
 
     Serializes all the defined fields on the model as well as any non-database field or method specified in the models
-    EXTRA_DISPLAY_FIELDS.
+    EXTRA_DISPLAY_FIELDS. Lists of related objects are validated with a single query, see `BatchedManyRelatedField`.
     """
 
+    serializer_related_field = BatchedHyperlinkedRelatedField
+
     class Meta:
         model = models.BaseModel
         fields = "__all__"
@@ -44,15 +242,89 @@ class BaseSerializer(serializers.HyperlinkedModelSerializer):
         expanded_fields = super().get_field_names(declared_fields, info)
         return expanded_fields + list(self.Meta.model.EXTRA_DISPLAY_FIELDS)
 
+    def get_query_plan(self):
+        """
+        Get the related objects that need to be fetched with the objects being
+        serialized, so that serializing a list of objects does not need a query per
+        object.
+
+        The plan is derived from the relational fields of the serializer. Hyperlinks to
+        many related objects are prefetched, as is the reverse side of a one-to-one
+        relation. A forward relation only needs the id of the related object, which is
+        already loaded. Any further lookups can be declared with `select_related` and
+        `prefetch_related` on the serializer's Meta.
+
+        :return: A tuple of the select_related lookups and prefetch_related lookups
+
+        """
+        cls = type(self)
+        if "_query_plan" not in cls.__dict__:
+            model = self.Meta.model
+            select_related = list(getattr(self.Meta, "select_related", ()))
+            prefetch_related = list(getattr(self.Meta, "prefetch_related", ()))
+            for field in self.fields.values():
+                if field.write_only or field.source == "*" or "." in field.source:
+                    continue
+                if isinstance(field, serializers.ManyRelatedField):
+                    prefetch_related.append(field.source)
+                elif isinstance(field, serializers.RelatedField):
+                    try:
+                        model_field = model._meta.get_field(field.source)
+                    except FieldDoesNotExist:
+                        continue
+                    if model_field.one_to_one and model_field.auto_created:
+                        select_related.append(field.source)
+            cls._query_plan = (tuple(select_related), tuple(prefetch_related))
+        return cls._query_plan
+
+    def setup_queryset(self, queryset):
+        """
+        Apply the query plan, see `get_query_plan`, to a queryset of the objects to be
+        serialized.
+        """
+        select_related, prefetch_related = self.get_query_plan()
+        return queryset.select_related(*select_related).prefetch_related(
+            *prefetch_related
+        )
+
 
 class BaseSerializerUUID(BaseSerializer):
     uuid = serializers.UUIDField(initial=uuid4, default=uuid4)
 
 
+class IssueListSerializer(serializers.ListSerializer):
+    """
+    Serializes a list of `Issue`s, finding the data products affected by all of them
+    at once rather than with queries for each `Issue`.
+    """
+
+    def to_representation(self, data):
+        issues = list(data.all() if hasattr(data, "all") else data)
+        affected = lineage.affected_data_products(issue.id for issue in issues)
+        for issue in issues:
+            issue.affected_data_product_ids = affected[issue.id]
+        return super().to_representation(issues)
+
+
 class IssueSerializer(BaseSerializerUUID):
+    affected_data_products = serializers.SerializerMethodField()
 
     class Meta(BaseSerializer.Meta):
         model = models.Issue
+        list_serializer_class = IssueListSerializer
+
+    def get_affected_data_products(self, obj):
+        data_product_ids = getattr(obj, "affected_data_product_ids", None)
+        if data_product_ids is None:
+            data_product_ids = lineage.affected_data_products([obj.id])[obj.id]
+        return [
+            reverse(
+                "dataproduct-detail",
+                kwargs={"pk": data_product_id},
+                request=self.context.get("request"),
+            )
+            for data_product_id in sorted(data_product_ids)
+        ]
 
 
 class CodeRunSerializer(BaseSerializer):
@@ -80,15 +352,21 @@ class DataProductSerializer(BaseSerializer):
         fields = "__all__"
         read_only_fields = model.EXTRA_DISPLAY_FIELDS
 
-    def get_internal_format(self, obj):
-        internal_format = serializers.BooleanField()
-        internal_format = any(
-            [
-                component.whole_object == False
-                for component in obj.object.components.all()
-            ]
+    def setup_queryset(self, queryset):
+        queryset = super().setup_queryset(queryset)
+        # an internal format is one with components other than the whole object
+        return queryset.annotate(
+            has_internal_format=Exists(
+                models.ObjectComponent.objects.filter(
+                    object=OuterRef("object"), whole_object=False
+                )
+            )
         )
-        return internal_format
+
+    def get_internal_format(self, obj):
+        if hasattr(obj, "has_internal_format"):
+            return obj.has_internal_format
+        return obj.object.components.filter(whole_object=False).exists()
 
     def get_prov_report(self, obj):
         request = self.context.get("request")
@@ -103,6 +381,215 @@ class DataProductSerializer(BaseSerializer):
         return obj.ro_crate()
 
 
+class StorageLocationManifestSerializer(serializers.Serializer):
+    storage_root = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH)
+    path = serializers.CharField(max_length=models.PATH_FIELD_LENGTH)
+    hash = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH)
+    public = serializers.BooleanField(default=True)
+
+
+class ObjectManifestSerializer(serializers.Serializer):
+    storage_location = StorageLocationManifestSerializer(required=False)
+    description = serializers.CharField(
+        max_length=models.TEXT_FIELD_LENGTH, required=False, allow_null=True
+    )
+    file_type = HyperlinkedIdField(
+        view_name="filetype-detail",
+        queryset=models.FileType.objects.all(),
+        required=False,
+        allow_null=True,
+    )
+    authors = serializers.ListField(
+        child=HyperlinkedIdField(
+            view_name="author-detail", queryset=models.Author.objects.all()
+        ),
+        required=False,
+    )
+
+
+class CodeRepoReleaseManifestSerializer(serializers.Serializer):
+    name = serializers.CharField(
+        max_length=models.CHAR_FIELD_LENGTH, validators=[validators.NameValidator()]
+    )
+    version = serializers.CharField(
+        max_length=models.CHAR_FIELD_LENGTH,
+        validators=[validators.VersionValidator()],
+    )
+    website = serializers.URLField(required=False, allow_null=True)
+
+
+class CodeRepoManifestSerializer(ObjectManifestSerializer):
+    release = CodeRepoReleaseManifestSerializer(required=False)
+
+
+class ComponentManifestSerializer(serializers.Serializer):
+    name = serializers.CharField(
+        max_length=models.CHAR_FIELD_LENGTH, validators=[validators.NameValidator()]
+    )
+    description = serializers.CharField(
+        max_length=models.TEXT_FIELD_LENGTH, required=False, allow_null=True
+    )
+
+
+class DataProductKeyField(serializers.CharField):
+    """
+    The natural key of a `DataProduct` given as "namespace:name@version", which is
+    converted to a tuple of the namespace, name and version.
+
+    :param allow_latest: Whether the version may be given as "latest"
+
+    """
+
+    default_error_messages = {
+        "invalid": 'Expected a data product of the form "namespace:name@version"'
+    }
+
+    def __init__(self, allow_latest=False, **kwargs):
+        self.allow_latest = allow_latest
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        namespace, _, rest = value.partition(":")
+        name, _, version = rest.rpartition("@")
+        if not (namespace and name and version):
+            self.fail("invalid")
+        if not (self.allow_latest and version == LATEST):
+            try:
+                validators.VersionValidator()(version)
+            except DjangoValidationError as exc:
+                raise serializers.ValidationError(exc.messages)
+        return namespace, name, version
+
+
+class InputManifestSerializer(serializers.Serializer):
+    data_product = DataProductKeyField()
+    component = serializers.CharField(default=registration.WHOLE_OBJECT)
+
+
+class OutputManifestSerializer(ObjectManifestSerializer):
+    namespace = serializers.CharField(
+        max_length=models.CHAR_FIELD_LENGTH, validators=[validators.NameValidator()]
+    )
+    name = serializers.CharField(
+        max_length=models.CHAR_FIELD_LENGTH, validators=[validators.NameValidator()]
+    )
+    version = serializers.CharField(
+        max_length=models.CHAR_FIELD_LENGTH,
+        validators=[validators.VersionValidator()],
+    )
+    components = ComponentManifestSerializer(many=True, required=False)
+
+    def validate_components(self, value):
+        names = [component["name"] for component in value]
+        if len(set(names)) != len(names):
+            raise serializers.ValidationError("The component names must be unique")
+        return value
+
+
+class CodeRunManifestSerializer(serializers.Serializer):
+    """
+    Validates the manifest of a whole `CodeRun`, see `CodeRunViewSet.register`.
+
+    The references to `FileType`s and `Author`s throughout the manifest are fetched with
+    a query for each model, the input components with a single query, and the outputs
+    are checked not to exist with a single query. A uniqueness error is reported for an
+    output that already exists.
+    """
+
+    run_date = serializers.DateTimeField()
+    description = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH)
+    uuid = serializers.UUIDField(default=uuid4)
+    code_repo = CodeRepoManifestSerializer(required=False, allow_null=True)
+    model_config = ObjectManifestSerializer(required=False, allow_null=True)
+    submission_script = ObjectManifestSerializer()
+    inputs = InputManifestSerializer(many=True, required=False)
+    outputs = OutputManifestSerializer(many=True, required=False)
+
+    def validate(self, attrs):
+        errors = {}
+
+        def add_error(path, field, message, code):
+            # the errors of the inputs and outputs are lists, with an empty entry for
+            # each valid item, as for a list serializer
+            if len(path) == 1:
+                item_errors = errors.setdefault(path[0], {})
+            else:
+                name, index = path
+                item_errors = errors.setdefault(
+                    name, [{} for _ in range(len(attrs[name]))]
+                )[index]
+            item_errors.setdefault(field, []).append(ErrorDetail(message, code=code))
+
+        objects = [
+            ((name,), attrs[name])
+            for name in registration.CODE_FIELDS
+            if attrs.get(name) is not None
+        ]
+        objects.extend(
+            (("outputs", index), output)
+            for index, output in enumerate(attrs.get("outputs", ()))
+        )
+        for field, model in (
+            ("file_type", models.FileType),
+            ("authors", models.Author),
+        ):
+            references = {
+                path: (obj[field] if isinstance(obj[field], list) else [obj[field]])
+                for path, obj in objects
+                if obj.get(field) is not None
+            }
+            found = set(
+                model.objects.filter(
+                    id__in={id_ for ids in references.values() for id_ in ids}
+                ).values_list("id", flat=True)
+            )
+            message = serializers.HyperlinkedRelatedField.default_error_messages[
+                "does_not_exist"
+            ]
+            for path, ids in references.items():
+                for id_ in ids:
+                    if id_ not in found:
+                        add_error(path, field, f"{message} ({id_})", "does_not_exist")
+
+        inputs = attrs.get("inputs", [])
+        component_ids = registration.resolve_inputs(
+            item["data_product"] + (item["component"],) for item in inputs
+        )
+        for index, item in enumerate(inputs):
+            key = item["data_product"] + (item["component"],)
+            item["component_id"] = component_ids.get(key)
+            if item["component_id"] is None:
+                add_error(
+                    ("inputs", index),
+                    "data_product",
+                    'Component "%s" of data product "%s:%s@%s" does not exist'
+                    % (item["component"], *item["data_product"]),
+                    "does_not_exist",
+                )
+
+        outputs = attrs.get("outputs", [])
+        keys = [
+            (output["namespace"], output["name"], output["version"])
+            for output in outputs
+        ]
+        existing = registration.find_data_products(keys)
+        seen = set()
+        for index, key in enumerate(keys):
+            if key in existing or key in seen:
+                add_error(
+                    ("outputs", index),
+                    api_settings.NON_FIELD_ERRORS_KEY,
+                    'Data product "%s:%s@%s" already exists' % key,
+                    "unique",
+                )
+            seen.add(key)
+
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+
 for name, cls in models.all_models.items():
     if name in ("Issue", "DataProduct", "CodeRun"):
         continue
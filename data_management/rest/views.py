@@ -1,14 +1,18 @@
+import abc
 from copy import deepcopy
 import fnmatch
 
+import semver
+
 from django import forms, db
 from rest_framework.authentication import (
     SessionAuthentication,
     BasicAuthentication,
     TokenAuthentication,
 )
-from rest_framework.decorators import renderer_classes
+from rest_framework.decorators import action, renderer_classes
 from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.fields import ListField
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework import (
     viewsets,
@@ -21,26 +25,32 @@ from rest_framework import (
     filters as rest_filters,
 )
 from rest_framework.response import Response
-from pydot import Dot
-from django.db import IntegrityError
+from rest_framework.reverse import reverse
+from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
+from django.db import IntegrityError, transaction
 from django_filters.rest_framework import DjangoFilterBackend, filterset
 from django_filters import constants, filters
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
-from django.http import Http404, JsonResponse
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
 from django.conf import settings as conf_settings
-
-from data_management import models, object_storage, settings
+from django.utils import timezone
+
+from data_management import (
+    lineage,
+    models,
+    object_storage,
+    registration,
+    render_pool,
+    report_cache,
+    report_jobs,
+    settings,
+)
 from data_management import object_storage
 from data_management.rest import serializers
-from data_management.prov import generate_prov_document, serialize_prov_document
-from data_management.rocrate import (
-    generate_ro_crate_from_dp,
-    generate_ro_crate_from_cr,
-    serialize_ro_crate,
-)
+from data_management.rest.pagination import LineagePagination
 
 
 class BadQuery(APIException):
@@ -48,6 +58,21 @@ class BadQuery(APIException):
     default_code = "bad_query"
 
 
+class PayloadTooLarge(APIException):
+    status_code = 413
+    default_code = "payload_too_large"
+
+
+class ServiceUnavailable(APIException):
+    status_code = 503
+    default_code = "service_unavailable"
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        # sent as the Retry-After header by the exception handler
+        self.wait = wait
+
+
 class JPEGRenderer(renderers.BaseRenderer):
     """
     Custom rendered for returning JPEG images.
@@ -146,7 +171,151 @@ class ZipRenderer(renderers.BaseRenderer):
         return data
 
 
-class ProvReportView(views.APIView):
+def ro_crate_content(crate, format_):
+    """
+    Serialise an RO Crate.
+
+    The zip file is produced as it is read rather than being written to disk first.
+
+    @param crate: the RO Crate object
+    @param format_: the format to serialise the crate as
+
+    @return an iterator of the bytes of the zip file for the zip format, otherwise the
+        serialised ro-crate-metadata file
+
+    """
+    # rocrate, prov and rdflib are slow to import so are only imported when a report
+    # is requested
+    from data_management.rocrate import (
+        ROCrateTooLarge,
+        serialize_ro_crate,
+        stream_ro_crate_zip,
+    )
+
+    if format_ != "zip":
+        return serialize_ro_crate(crate, format_)
+
+    try:
+        return stream_ro_crate_zip(
+            crate, getattr(conf_settings, "RO_CRATE_MAX_BYTES", None)
+        )
+    except ROCrateTooLarge as err:
+        raise PayloadTooLarge(str(err))
+
+
+def ro_crate_response(content, request, file_name):
+    """
+    Create the response for an RO Crate.
+
+    The zip file is streamed as it is produced.
+
+    @param content: the RO Crate serialised by `ro_crate_content`
+    @param request: the request object
+    @param file_name: a str containing the name used for the zip file
+
+    @return a StreamingHttpResponse for the zip format, otherwise a Response
+
+    """
+    if request.accepted_renderer.format != "zip":
+        return Response(content)
+
+    response = StreamingHttpResponse(content, content_type=ZipRenderer.media_type)
+    response["Content-Disposition"] = f'attachment; filename="{file_name}.zip"'
+    return response
+
+
+class ReportJobMixin(abc.ABC):
+    """
+    Lets a report be generated in the background, see `data_management.report_jobs`.
+
+    A POST creates a job generating the report, or returns the job of an identical
+    earlier request. The body of the POST holds the `format` of the report along with
+    any of the query parameters of a GET. The response is the job, see `ReportJobView`.
+    """
+
+    report_model = None
+    report_name = None
+    report_file_prefix = None
+
+    def get_renderers(self):
+        if self.request.method == "POST":
+            # the response is the job rather than the report
+            return [renderers.JSONRenderer(), renderers.BrowsableAPIRenderer()]
+        return super().get_renderers()
+
+    @abc.abstractmethod
+    def get_report_params(self, params):
+        """
+        Read the parameters of the report.
+
+        :param params: The query parameters of a GET or the body of a POST
+
+        :return: A dict of the parameters passed to `generate_report`
+
+        """
+
+    @classmethod
+    @abc.abstractmethod
+    def generate_report(cls, registry_url, obj, format_, **params):
+        """
+        Generate a report. As a job may be run after the request that created it has
+        finished, the report is generated from plain values rather than the view and
+        its request.
+
+        :param registry_url: The URL of the registry the report was requested from
+        :param obj: The record the report is for
+        :param format_: The format of the report
+        :param params: The parameters returned by `get_report_params`
+
+        :return: The data passed to the renderer of the format
+
+        """
+
+    def post(self, request, pk):
+        obj = get_object_or_404(self.report_model, pk=pk)
+
+        format_ = request.data.get("format")
+        renderer_classes = [
+            renderer
+            for renderer in self.renderer_classes
+            if renderer.format == format_ and format_ != "api"
+        ]
+        if not renderer_classes:
+            raise BadQuery(
+                "format must be one of %s"
+                % ", ".join(
+                    renderer.format
+                    for renderer in self.renderer_classes
+                    if renderer.format != "api"
+                )
+            )
+        renderer = renderer_classes[0]()
+        params = self.get_report_params(request.data)
+        registry_url = request.build_absolute_uri("/")
+        generate_report = type(self).generate_report
+        file_name = f"{self.report_file_prefix}_{obj.id}.{format_}"
+
+        def generate():
+            data = generate_report(registry_url, obj, format_, **params)
+            return (
+                renderer.render(data, renderer.media_type, {}),
+                renderer.media_type,
+                file_name,
+            )
+
+        try:
+            job, _ = report_jobs.submit(
+                self.report_name, obj.id, format_, params, registry_url, generate
+            )
+        except report_jobs.ReportJobQueueFull as err:
+            raise ServiceUnavailable(str(err), wait=err.retry_after)
+        data = serializers.ReportJobSerializer(job, context={"request": request}).data
+        return Response(
+            data, status=status.HTTP_202_ACCEPTED, headers={"Location": data["url"]}
+        )
+
+
+class ProvReportView(ReportJobMixin, views.APIView):
     """
     ***The provenance report for a `DataProduct`.***
 
@@ -165,23 +334,33 @@ class ProvReportView(views.APIView):
 
     `depth` (optional): An integer used to determine how many code runs to include,
     the default is 1
+
+    ### Generating the report in the background:
+
+    A `POST` with the `format` of the report and any of the query parameters in its
+    body creates a job that generates the report, see `ReportJobView`.
     """
 
-    try:
-        Dot(prog="dot").create()
-        # GraphViz is installed so the JPEG and SVG renderers are made available.
-        renderer_classes = [
-            renderers.BrowsableAPIRenderer,
-            renderers.JSONRenderer,
-            JSONLDRenderer,
-            JPEGRenderer,
-            SVGRenderer,
-            XMLRenderer,
-            ProvnRenderer,
-        ]
-    except FileNotFoundError:
+    report_model = models.DataProduct
+    report_name = "prov_report"
+    report_file_prefix = "prov_report"
+
+    @property
+    def renderer_classes(self):
+        # GraphViz is looked for on first use rather than when this module is imported
+        if render_pool.graphviz_available():
+            # GraphViz is installed so the JPEG and SVG renderers are made available.
+            return [
+                renderers.BrowsableAPIRenderer,
+                renderers.JSONRenderer,
+                JSONLDRenderer,
+                JPEGRenderer,
+                SVGRenderer,
+                XMLRenderer,
+                ProvnRenderer,
+            ]
         # GraphViz is not installed so the JPEG and SVG renderers are NOT available.
-        renderer_classes = [
+        return [
             renderers.BrowsableAPIRenderer,
             renderers.JSONRenderer,
             JSONLDRenderer,
@@ -191,46 +370,191 @@ class ProvReportView(views.APIView):
 
     def get(self, request, pk):
         data_product = get_object_or_404(models.DataProduct, pk=pk)
+        params = self.get_report_params(request.query_params)
+        return Response(
+            self.generate_report(
+                request.build_absolute_uri("/"),
+                data_product,
+                request.accepted_renderer.format,
+                **params,
+            )
+        )
 
-        show_attributes = request.query_params.get("attributes", True)
-        if show_attributes == "False":
+    def get_report_params(self, params):
+        show_attributes = params.get("attributes", True)
+        if show_attributes in ("False", False):
             show_attributes = False
 
         default_aspect_ratio = 0.71
-        aspect_ratio = request.query_params.get("aspect_ratio", default_aspect_ratio)
+        aspect_ratio = params.get("aspect_ratio", default_aspect_ratio)
         try:
             aspect_ratio = float(aspect_ratio)
-        except ValueError:
+        except (TypeError, ValueError):
             aspect_ratio = default_aspect_ratio
 
         default_depth = 1
-        depth = request.query_params.get("depth", default_depth)
+        depth = params.get("depth", default_depth)
         try:
             depth = int(depth)
-        except ValueError:
+        except (TypeError, ValueError):
             depth = default_depth
         if depth < 1:
             depth = 1
 
-        dpi = request.query_params.get("dpi", None)
+        dpi = params.get("dpi", None)
         try:
             dpi = float(dpi)
         except (TypeError, ValueError):
             dpi = None
 
-        doc = generate_prov_document(data_product, depth, request)
+        return {
+            "show_attributes": bool(show_attributes),
+            "aspect_ratio": aspect_ratio,
+            "depth": depth,
+            "dpi": dpi,
+        }
 
-        value = serialize_prov_document(
-            doc,
-            request.accepted_renderer.format,
+    @classmethod
+    def generate_report(
+        cls,
+        registry_url,
+        data_product,
+        format_,
+        show_attributes,
+        aspect_ratio,
+        depth,
+        dpi,
+    ):
+        from data_management.prov import (
+            generate_prov_document,
+            get_data_product_uris,
+            load_prov_graph,
+            serialize_prov_document,
+        )
+
+        graph = load_prov_graph(data_product, depth)
+
+        # rendered reports are cached against the content of the provenance graph, so
+        # data products in the report derived from one with an issue are highlighted
+        # on images, found from the lineage closure table
+        tainted = set()
+        if format_ in ("jpg", "svg"):
+            tainted = lineage.tainted_data_products(graph.data_products)
+
+        # any change to the graph gives a new key
+        cache_key = report_cache.make_key(
+            data_product.id,
+            depth,
+            format_,
             aspect_ratio,
             dpi,
-            show_attributes=bool(show_attributes),
+            show_attributes,
+            registry_url,
+            graph.fingerprint(),
+            tainted,
+        )
+        value = report_cache.get_report(cache_key)
+        if value is None:
+            doc = generate_prov_document(data_product, depth, registry_url, graph)
+
+            try:
+                value = serialize_prov_document(
+                    doc,
+                    format_,
+                    aspect_ratio,
+                    dpi,
+                    show_attributes=show_attributes,
+                    tainted_uris=get_data_product_uris(doc, tainted),
+                )
+            except render_pool.RenderPoolBusy as err:
+                raise ServiceUnavailable(str(err), wait=err.retry_after)
+            except render_pool.RenderTimeout as err:
+                raise ServiceUnavailable(
+                    "%s, try a lower depth or another format" % err
+                )
+            report_cache.set_report(cache_key, value)
+        return value
+
+
+class ProvRenderStatsView(views.APIView):
+    """
+    ***Metrics of the GraphViz renders of provenance report images.***
+
+    The metrics are those of the server process that handles the request: the number
+    of renders that are running or waiting for a renderer, the number that were
+    rendered, rejected as the queue was full, timed out or failed, and the total and
+    maximum seconds spent waiting for a renderer and running GraphViz.
+    """
+
+    authentication_classes = [
+        SessionAuthentication,
+        BasicAuthentication,
+        TokenAuthentication,
+    ]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response(render_pool.get_stats())
+
+
+class ReportJobView(views.APIView):
+    """
+    ***A job generating a provenance report or RO Crate in the background.***
+
+    Jobs are created by a `POST` to the provenance report or RO Crate endpoints, with
+    the `format` of the report and any of the query parameters of the endpoint in its
+    body. Identical requests share a job, rather than generating the report again,
+    until it expires.
+
+    ### Read-only Fields:
+    `url`: Reference to the job
+
+    `report`: The name of the report, `prov_report`, `data_product_ro_crate` or
+    `code_run_ro_crate`
+
+    `report_url`: The endpoint of the report
+
+    `format`: The format of the report
+
+    `status`: One of `queued`, `running`, `finished` or `failed`
+
+    `error`: Why the job failed
+
+    `created`: Datetime that the job was created
+
+    `finished`: Datetime that the job finished or failed
+
+    `expires`: Datetime after which the job and its file are removed
+
+    `file`: Reference to the generated file, once the job has finished
+    """
+
+    def get(self, request, pk):
+        job = get_object_or_404(models.ReportJob, pk=pk)
+        return Response(
+            serializers.ReportJobSerializer(job, context={"request": request}).data
         )
-        return Response(value)
 
 
-class CodeRunROCrateView(views.APIView):
+class ReportJobFileView(views.APIView):
+    """
+    ***The file generated by a `ReportJob`.***
+    """
+
+    def get(self, request, pk):
+        job = get_object_or_404(
+            models.ReportJob, pk=pk, status=models.ReportJob.FINISHED
+        )
+        try:
+            f = open(report_jobs.get_path(job), "rb")
+        except FileNotFoundError:
+            raise Http404("The report has expired")
+        return FileResponse(
+            f, as_attachment=True, filename=job.file_name, content_type=job.content_type
+        )
+
+
+class CodeRunROCrateView(ReportJobMixin, views.APIView):
     """
     ***The RO Crate for a `CodeRun`.***
 
@@ -275,8 +599,17 @@ class CodeRunROCrateView(views.APIView):
     `depth` (optional): An integer used to determine how many code runs to include,
     the default is 1.
 
+    ### Generating the RO Crate in the background:
+
+    A `POST` with the `format` of the RO Crate and any of the query parameters in its
+    body creates a job that generates the RO Crate, see `ReportJobView`.
+
     """
 
+    report_model = models.CodeRun
+    report_name = "code_run_ro_crate"
+    report_file_prefix = "code_run"
+
     renderer_classes = [
         renderers.BrowsableAPIRenderer,
         renderers.JSONRenderer,
@@ -286,22 +619,35 @@ class CodeRunROCrateView(views.APIView):
 
     def get(self, request, pk):
         code_run = get_object_or_404(models.CodeRun, pk=pk)
+        params = self.get_report_params(request.query_params)
+        content = self.generate_report(
+            request.build_absolute_uri("/"),
+            code_run,
+            request.accepted_renderer.format,
+            **params,
+        )
+        return ro_crate_response(content, request, f"code_run_{code_run.id}")
 
+    def get_report_params(self, params):
         default_depth = 1
-        depth = request.query_params.get("depth", default_depth)
+        depth = params.get("depth", default_depth)
         try:
             depth = int(depth)
-        except ValueError:
+        except (TypeError, ValueError):
             depth = default_depth
         if depth < 1:
             depth = 1
+        return {"depth": depth}
 
-        crate = generate_ro_crate_from_cr(code_run, depth, request)
+    @classmethod
+    def generate_report(cls, registry_url, code_run, format_, depth):
+        from data_management.rocrate import generate_ro_crate_from_cr
 
-        return Response(serialize_ro_crate(crate, request.accepted_renderer.format))
+        crate = generate_ro_crate_from_cr(code_run, depth, registry_url)
+        return ro_crate_content(crate, format_)
 
 
-class DataProductROCrateView(views.APIView):
+class DataProductROCrateView(ReportJobMixin, views.APIView):
     """
     ***The RO Crate for a `DataProduct`.***
 
@@ -346,8 +692,17 @@ class DataProductROCrateView(views.APIView):
     `depth` (optional): An integer used to determine how many code runs to include,
     the default is 1.
 
+    ### Generating the RO Crate in the background:
+
+    A `POST` with the `format` of the RO Crate and any of the query parameters in its
+    body creates a job that generates the RO Crate, see `ReportJobView`.
+
     """
 
+    report_model = models.DataProduct
+    report_name = "data_product_ro_crate"
+    report_file_prefix = "data_product"
+
     renderer_classes = [
         renderers.BrowsableAPIRenderer,
         renderers.JSONRenderer,
@@ -357,19 +712,32 @@ class DataProductROCrateView(views.APIView):
 
     def get(self, request, pk):
         data_product = get_object_or_404(models.DataProduct, pk=pk)
+        params = self.get_report_params(request.query_params)
+        content = self.generate_report(
+            request.build_absolute_uri("/"),
+            data_product,
+            request.accepted_renderer.format,
+            **params,
+        )
+        return ro_crate_response(content, request, f"data_product_{data_product.id}")
 
+    def get_report_params(self, params):
         default_depth = 1
-        depth = request.query_params.get("depth", default_depth)
+        depth = params.get("depth", default_depth)
         try:
             depth = int(depth)
-        except ValueError:
+        except (TypeError, ValueError):
             depth = default_depth
         if depth < 1:
             depth = 1
+        return {"depth": depth}
 
-        crate = generate_ro_crate_from_dp(data_product, depth, request)
+    @classmethod
+    def generate_report(cls, registry_url, data_product, format_, depth):
+        from data_management.rocrate import generate_ro_crate_from_dp
 
-        return Response(serialize_ro_crate(crate, request.accepted_renderer.format))
+        crate = generate_ro_crate_from_dp(data_product, depth, registry_url)
+        return ro_crate_content(crate, format_)
 
 
 class DataExtractionView(views.APIView):
@@ -399,6 +767,90 @@ class DataExtractionView(views.APIView):
         return Response(context)
 
 
+class LineageView(views.APIView):
+    """
+    ***The `DataProduct`s or `CodeRun`s upstream or downstream of a `DataProduct`.***
+
+    `descendants` lists everything that was derived from the `DataProduct`, either
+    directly or through a chain of `CodeRun`s, and `ancestors` lists everything that
+    it was derived from. Each result has a `depth`, the smallest number of `CodeRun`s
+    between it and the `DataProduct`, and results are ordered by `depth` and then id.
+
+    ### Query parameters:
+
+    `type` (optional): `data_product`, the default, or `code_run`
+
+    `depth` (optional): An integer used to limit how many code runs to follow, by
+    default the maximum of `LINEAGE_MAX_DEPTH`
+
+    `count_only` (optional): If `true` only the `count` of the results is returned
+
+    `count` (optional): How the count is calculated, `exact` or `none`
+
+    `page_size` (optional): The number of results in each page
+    """
+
+    direction = lineage.DESCENDANTS
+    allowed_query_params = (
+        "count",
+        "count_only",
+        "cursor",
+        "depth",
+        "format",
+        "page_size",
+        "type",
+    )
+    serializer_classes = {
+        lineage.DATA_PRODUCT: serializers.DataProductSerializer,
+        lineage.CODE_RUN: serializers.CodeRunSerializer,
+    }
+
+    def get(self, request, pk):
+        if set(request.query_params.keys()) - set(self.allowed_query_params):
+            raise BadQuery(
+                detail="Invalid query arguments, only query arguments [%s] are allowed"
+                % ", ".join(self.allowed_query_params)
+            )
+        data_product = get_object_or_404(models.DataProduct, pk=pk)
+
+        kind = request.query_params.get("type", lineage.DATA_PRODUCT)
+        if kind not in lineage.KINDS:
+            raise BadQuery(
+                detail="Invalid type, must be one of [%s]" % ", ".join(lineage.KINDS)
+            )
+
+        max_depth = getattr(conf_settings, "LINEAGE_MAX_DEPTH", 100)
+        depth = request.query_params.get("depth", max_depth)
+        try:
+            depth = int(depth)
+        except ValueError:
+            raise BadQuery(detail="Invalid depth, must be an integer")
+        if depth < 1:
+            raise BadQuery(detail="Invalid depth, must be at least 1")
+        depth = min(depth, max_depth)
+
+        query = lineage.LineageQuery(data_product.id, self.direction, depth, kind)
+        if request.query_params.get("count_only") in ("true", "True", "1"):
+            return Response({"count": query.count()})
+
+        paginator = LineagePagination()
+        rows = paginator.paginate_lineage(query, request)
+
+        serializer_class = self.serializer_classes[kind]
+        queryset = serializer_class().setup_queryset(
+            query.model.objects.filter(id__in=[id_ for id_, depth in rows])
+        )
+        records = {record.id: record for record in queryset}
+        data = serializer_class(
+            [records[id_] for id_, depth in rows],
+            many=True,
+            context={"request": request},
+        ).data
+        for item, (id_, depth) in zip(data, rows):
+            item["depth"] = depth
+        return paginator.get_paginated_response(data)
+
+
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API views (GET only) for the User model.
@@ -455,6 +907,43 @@ class APIIntegrityError(exceptions.APIException):
     default_code = "integrity_error"
 
 
+def compile_glob(pattern):
+    """
+    Compile a Unix glob style pattern into a lookup that the database can run
+    efficiently.
+
+    A pattern without any wildcards is an exact match and a pattern using only the `*`
+    and `?` wildcards uses the `glob` lookup, see `models.GlobLookup`, both of which can
+    use an index on the field. Only a pattern containing a character class, such as
+    `[0-9]`, falls back to a regular expression.
+
+    :param pattern: The glob pattern
+
+    :return: A tuple of the lookup type and the value to look up
+
+    """
+    i, n = 0, len(pattern)
+    while i < n:
+        if pattern[i] == "[":
+            # mirror fnmatch, a "[" without a closing "]" is a literal character
+            j = i + 1
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j < n:
+                # The regex generated by fnmatch is not compatible with PostgreSQL so we
+                # need to do remove the ?s: characters and we also add a \A at the start so
+                # that it matches on the entire string.
+                return "regex", "\\A" + fnmatch.translate(pattern).replace("?s:", "")
+        i += 1
+    if "*" in pattern or "?" in pattern:
+        return "glob", pattern
+    return "exact", pattern
+
+
 class GlobFilter(filters.Filter):
     """
     Custom API filter which can be used to add Unix glob style pattern matching to a field.
@@ -469,11 +958,9 @@ class GlobFilter(filters.Filter):
             return qs
         if self.distinct:
             qs = qs.distinct()
-        # The regex generated by fnmatch is not compatible with PostgreSQL so we need to do remove the ?s: characters
-        # and we also add a \A at the start so that it matches on the entire string.
-        regex_value = "\\A" + fnmatch.translate(value).replace("?s:", "")
-        lookup = "%s__regex" % (self.field_name,)
-        qs = self.get_method(qs)(**{lookup: regex_value})
+        lookup_type, lookup_value = compile_glob(value)
+        lookup = "%s__%s" % (self.field_name, lookup_type)
+        qs = self.get_method(qs)(**{lookup: lookup_value})
         return qs
 
     field_class = forms.CharField
@@ -494,6 +981,22 @@ class CustomFilterSet(filterset.FilterSet):
     )
 
 
+class DataProductFilterSet(CustomFilterSet):
+    """
+    Filters for `DataProduct`s, adding `affected_by_issue` to find the data products
+    affected by an `Issue`.
+    """
+
+    affected_by_issue = filters.NumberFilter(method="filter_affected_by_issue")
+
+    class Meta:
+        model = models.DataProduct
+        fields = models.DataProduct.FILTERSET_FIELDS
+
+    def filter_affected_by_issue(self, queryset, name, value):
+        return queryset.filter(id__in=lineage.issue_impact([value]).values("id"))
+
+
 class CustomDjangoFilterBackend(DjangoFilterBackend):
     """
     Custom filtering backend which we use to add the CustomFilterSet filtering.
@@ -502,6 +1005,18 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
     default_filter_set = CustomFilterSet
 
 
+def has_error_code(detail, code):
+    """
+    Check whether any of the errors in the nested lists and dicts of errors reported
+    by a serializer has a code.
+    """
+    if isinstance(detail, dict):
+        return any(has_error_code(value, code) for value in detail.values())
+    if isinstance(detail, list):
+        return any(has_error_code(value, code) for value in detail)
+    return getattr(detail, "code", None) == code
+
+
 class BaseViewSet(
     mixins.CreateModelMixin,
     mixins.ListModelMixin,
@@ -522,9 +1037,12 @@ class BaseViewSet(
     filter_backends = [CustomDjangoFilterBackend, rest_filters.OrderingFilter]
     ordering = ["-id"]
 
+    extra_filterset_fields = ()
+
     def list(self, request, *args, **kwargs):
         if self.model.FILTERSET_FIELDS == "__all__":
             filterset_fields = self.model.field_names() + (
+                "count",
                 "cursor",
                 "format",
                 "ordering",
@@ -532,11 +1050,13 @@ class BaseViewSet(
             )
         else:
             filterset_fields = self.model.FILTERSET_FIELDS + (
+                "count",
                 "cursor",
                 "format",
                 "ordering",
                 "page_size",
             )
+        filterset_fields += self.extra_filterset_fields
         if set(request.query_params.keys()) - set(filterset_fields):
             args = ", ".join(filterset_fields)
             raise BadQuery(
@@ -546,12 +1066,18 @@ class BaseViewSet(
         return super().list(request, *args, **kwargs)
 
     def get_queryset(self):
-        return self.model.objects.all()
+        queryset = self.model.objects.all()
+        if self.action in ("list", "retrieve"):
+            queryset = self.get_serializer().setup_queryset(queryset)
+        return queryset
 
     def create(self, request, *args, **kwargs):
         """
-        Customising the create method to raise a 409 on uniqueness validation failing.
+        Customising the create method to raise a 409 on uniqueness validation failing,
+        and to upsert the object when the `upsert` query argument is true.
         """
+        if request.query_params.get("upsert", "").lower() in ("true", "1"):
+            return self.upsert(request)
         try:
             return super().create(request, *args, **kwargs)
         except ValidationError as ex:
@@ -570,6 +1096,191 @@ class BaseViewSet(
         except IntegrityError as ex:
             raise APIIntegrityError(str(ex))
 
+    def upsert(self, request):
+        """
+        Create an object, or update the existing object with the same natural key.
+
+        The natural key is the unique constraint given by the model's `NATURAL_KEY`, so
+        a client does not need to look an object up before creating it, and concurrent
+        requests for the same object do not conflict. The object is returned with a 201
+        if it was created and a 200 if it already existed. The status is best-effort,
+        see `perform_upsert`, so clients should not rely on it to tell which of several
+        concurrent requests created the object.
+
+        :param request: The request, the data of which is the object
+
+        :return: A Response
+
+        """
+        key_fields = self.model.NATURAL_KEY
+        if not key_fields:
+            raise BadQuery(
+                detail="%s objects do not have a natural key to upsert by"
+                % self.model.__name__
+            )
+
+        serializer = self.get_serializer(data=request.data)
+        # an existing object with the same natural key is updated rather than rejected,
+        # any other uniqueness conflict is left to the database and reported as a 409
+        serializer.validators = [
+            validator
+            for validator in serializer.validators
+            if not isinstance(validator, UniqueTogetherValidator)
+        ]
+        for field in serializer.fields.values():
+            field.validators = [
+                validator
+                for validator in field.validators
+                if not isinstance(validator, UniqueValidator)
+            ]
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            with transaction.atomic():
+                instance, created = self.perform_upsert(serializer.validated_data)
+        except IntegrityError as ex:
+            raise APIIntegrityError(str(ex))
+
+        serializer = self.get_serializer(instance)
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    def perform_upsert(self, data):
+        """
+        Insert an object, or update the existing object with the same natural key,
+        adding the current user as the models updated_by.
+
+        Where the database supports it the object is written by a single
+        `INSERT ... ON CONFLICT DO UPDATE`, otherwise by `update_or_create`. An existing
+        object that would not be changed is not written at all.
+
+        As the `INSERT ... ON CONFLICT DO UPDATE` does not report whether it inserted
+        or updated the row, whether the object was created is taken from looking it up
+        beforehand. This is best-effort: if a concurrent request creates or deletes the
+        object between the lookup and the write, the flag is wrong, though the object
+        itself is written correctly. The flag returned by `update_or_create` is taken
+        from the write.
+
+        :param data: The validated data of the object
+
+        :return: A tuple of the object and a boolean, True if it was created, which is
+            best-effort as described above
+
+        """
+        model = self.model
+        key = {}
+        for name in model.NATURAL_KEY:
+            field = model._meta.get_field(name)
+            key[name] = data[name] if name in data else field.get_default()
+        values = {name: value for name, value in data.items() if name not in key}
+
+        existing = model.objects.filter(**key).first()
+        if existing is not None:
+            current = model(**values)
+            if all(
+                model._meta.get_field(name).value_from_object(existing)
+                == model._meta.get_field(name).value_from_object(current)
+                for name in values
+            ):
+                return existing, False
+
+        connection = db.connections[model.objects.db]
+        if not connection.features.supports_update_conflicts_with_target:
+            instance, created = model.objects.update_or_create(
+                defaults={**values, "updated_by": self.request.user}, **key
+            )
+            return instance, created
+
+        model.objects.bulk_create(
+            [model(updated_by=self.request.user, **key, **values)],
+            update_conflicts=True,
+            unique_fields=list(key),
+            update_fields=list(values) + ["updated_by", "last_updated"],
+        )
+        return model.objects.get(**key), existing is None
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create a list of objects in a single transaction.
+
+        Each object is validated in the same way as for a single create. If all of the
+        objects are valid they are all created, and the list of created objects is
+        returned in the same order. Otherwise nothing is created and a list of the errors
+        is returned, with an empty entry for each valid object. A 409 is returned if any
+        of the errors are due to a uniqueness constraint.
+        """
+        if not self.model.BULK_CREATE:
+            raise exceptions.MethodNotAllowed(request.method)
+        if not isinstance(request.data, list):
+            raise BadQuery(detail="Expected a list of objects")
+        max_items = getattr(conf_settings, "BULK_CREATE_MAX_ITEMS", None)
+        if max_items is not None and len(request.data) > max_items:
+            raise BadQuery(
+                detail="Too many objects, at most %d can be created at once" % max_items
+            )
+
+        item_serializers = [self.get_serializer(data=item) for item in request.data]
+        errors = []
+        conflict = False
+        for serializer in item_serializers:
+            if serializer.is_valid():
+                errors.append({})
+                continue
+            errors.append(serializer.errors)
+            conflict = conflict or has_error_code(serializer.errors, "unique")
+        if any(errors):
+            if conflict:
+                raise APIIntegrityError(errors)
+            raise ValidationError(errors)
+
+        try:
+            with transaction.atomic():
+                instances = self.perform_bulk_create(item_serializers)
+        except IntegrityError as ex:
+            raise APIIntegrityError(str(ex))
+
+        serializer = self.get_serializer(instances, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def perform_bulk_create(self, item_serializers):
+        """
+        Create the objects of validated serializers with `bulk_create`, adding the current
+        user as the models updated_by.
+        """
+        many_to_many_fields = self.model._meta.many_to_many
+        instances = []
+        related = []
+        for serializer in item_serializers:
+            data = dict(serializer.validated_data)
+            related.append(
+                {
+                    field.name: data.pop(field.name)
+                    for field in many_to_many_fields
+                    if field.name in data
+                }
+            )
+            instances.append(self.model(updated_by=self.request.user, **data))
+        self.model.objects.bulk_create(instances)
+
+        for field in many_to_many_fields:
+            through = field.remote_field.through
+            through.objects.bulk_create(
+                through(
+                    **{
+                        field.m2m_field_name(): instance,
+                        field.m2m_reverse_field_name(): target,
+                    }
+                )
+                for instance, instance_related in zip(instances, related)
+                # a target given more than once is linked once, as by a single create
+                for target in dict.fromkeys(instance_related.get(field.name, ()))
+            )
+
+        return instances
+
 
 class ObjectStorageView(views.APIView):
     """
@@ -628,7 +1339,8 @@ class IssueViewSet(BaseViewSet, mixins.UpdateModelMixin):
 class DataProductViewSet(BaseViewSet, mixins.UpdateModelMixin):
     model = models.DataProduct
     serializer_class = serializers.DataProductSerializer
-    filterset_fields = models.DataProduct.FILTERSET_FIELDS
+    filterset_class = DataProductFilterSet
+    extra_filterset_fields = ("affected_by_issue",)
     __doc__ = models.DataProduct.__doc__
 
     def create(self, request, *args, **kwargs):
@@ -638,6 +1350,103 @@ class DataProductViewSet(BaseViewSet, mixins.UpdateModelMixin):
             request.data["ro_crate"] = ""
         return super().create(request, *args, **kwargs)
 
+    @action(detail=False, methods=["post"])
+    def resolve(self, request, *args, **kwargs):
+        """
+        Resolve a list of `DataProduct`s given by their natural keys.
+
+        Each `DataProduct` is given as "namespace:name@version", where the version may
+        be "latest" for the highest semantic version. All of the `DataProduct`s are
+        found with a single query, and the URLs of each along with its `Object` and
+        `StorageLocation` are returned in the same order. The `url` of any that does
+        not exist is null.
+
+        :param request: The request, the data of which is the list of data products
+
+        :return: A Response
+
+        """
+        if not isinstance(request.data, list):
+            raise BadQuery(detail="Expected a list of data products")
+        max_items = getattr(conf_settings, "RESOLVE_MAX_ITEMS", None)
+        if max_items is not None and len(request.data) > max_items:
+            raise BadQuery(
+                detail="Too many data products, at most %d can be resolved at once"
+                % max_items
+            )
+        keys = ListField(
+            child=serializers.DataProductKeyField(allow_latest=True)
+        ).run_validation(request.data)
+
+        # every version is needed to find the latest
+        query = Q(pk__in=[])
+        for namespace, name, version in dict.fromkeys(keys):
+            if version == serializers.LATEST:
+                query |= Q(namespace__name=namespace, name=name)
+            else:
+                query |= Q(namespace__name=namespace, name=name, version=version)
+        versions = {}
+        if keys:
+            for data_product in models.DataProduct.objects.filter(query).select_related(
+                "namespace", "object__storage_location__storage_root"
+            ):
+                versions.setdefault(
+                    (data_product.namespace.name, data_product.name), {}
+                )[data_product.version] = data_product
+
+        results = []
+        for item, (namespace, name, version) in zip(request.data, keys):
+            candidates = versions.get((namespace, name), {})
+            if version == serializers.LATEST and candidates:
+                version = max(candidates, key=semver.VersionInfo.parse)
+            results.append(self.get_resolved(request, item, candidates.get(version)))
+        return Response(results)
+
+    def get_resolved(self, request, item, data_product):
+        """
+        Get the URLs of a resolved `DataProduct`, see `resolve`.
+        """
+        result = dict.fromkeys(
+            (
+                "url",
+                "namespace",
+                "name",
+                "version",
+                "object",
+                "storage_location",
+                "storage_root",
+                "location",
+                "hash",
+            )
+        )
+        result["data_product"] = item
+        if data_product is None:
+            return result
+        result.update(
+            url=reverse(
+                "dataproduct-detail", kwargs={"pk": data_product.pk}, request=request
+            ),
+            namespace=data_product.namespace.name,
+            name=data_product.name,
+            version=data_product.version,
+            object=reverse(
+                "object-detail", kwargs={"pk": data_product.object_id}, request=request
+            ),
+        )
+        location = data_product.object.storage_location
+        if location is not None:
+            result.update(
+                storage_location=reverse(
+                    "storagelocation-detail",
+                    kwargs={"pk": location.pk},
+                    request=request,
+                ),
+                storage_root=location.storage_root.root,
+                location=location.full_uri(),
+                hash=location.hash,
+            )
+        return result
+
 
 class CodeRunViewSet(BaseViewSet, mixins.UpdateModelMixin, mixins.DestroyModelMixin):
     model = models.CodeRun
@@ -645,6 +1454,177 @@ class CodeRunViewSet(BaseViewSet, mixins.UpdateModelMixin, mixins.DestroyModelMi
     filterset_fields = models.CodeRun.FILTERSET_FIELDS
     __doc__ = models.CodeRun.__doc__
 
+    @action(detail=True, methods=["post"], url_path="inputs/add", url_name="add-inputs")
+    def add_inputs(self, request, *args, **kwargs):
+        """
+        Add a list of `ObjectComponent`s to the inputs of the `CodeRun`.
+        """
+        return self.change_components(request, "inputs", add=True)
+
+    @action(
+        detail=True,
+        methods=["post"],
+        url_path="inputs/remove",
+        url_name="remove-inputs",
+    )
+    def remove_inputs(self, request, *args, **kwargs):
+        """
+        Remove a list of `ObjectComponent`s from the inputs of the `CodeRun`.
+        """
+        return self.change_components(request, "inputs", add=False)
+
+    @action(
+        detail=True, methods=["post"], url_path="outputs/add", url_name="add-outputs"
+    )
+    def add_outputs(self, request, *args, **kwargs):
+        """
+        Add a list of `ObjectComponent`s to the outputs of the `CodeRun`.
+        """
+        return self.change_components(request, "outputs", add=True)
+
+    @action(
+        detail=True,
+        methods=["post"],
+        url_path="outputs/remove",
+        url_name="remove-outputs",
+    )
+    def remove_outputs(self, request, *args, **kwargs):
+        """
+        Remove a list of `ObjectComponent`s from the outputs of the `CodeRun`.
+        """
+        return self.change_components(request, "outputs", add=False)
+
+    def change_components(self, request, field_name, add):
+        """
+        Add `ObjectComponent`s to, or remove them from, the inputs or outputs of the
+        `CodeRun`, without the whole list being sent again.
+
+        The components are given as a list of hyperlinks or ids. Only the links that
+        need to be added or removed are inserted or deleted, in a single query, and the
+        number changed is returned along with the number of components now linked.
+
+        :param request: The request, the data of which is the list of components
+        :param field_name: Either "inputs" or "outputs"
+        :param add: True to add the components, False to remove them
+
+        :return: A Response
+
+        """
+        if not isinstance(request.data, list):
+            raise BadQuery(detail="Expected a list of object components")
+        max_items = getattr(conf_settings, "BULK_CREATE_MAX_ITEMS", None)
+        if max_items is not None and len(request.data) > max_items:
+            raise BadQuery(
+                detail="Too many object components, at most %d can be changed at once"
+                % max_items
+            )
+
+        code_run = self.get_object()
+        field = self.get_serializer().fields[field_name]
+        component_ids = {
+            component.id for component in field.run_validation(request.data)
+        }
+
+        related = getattr(code_run, field_name)
+        with transaction.atomic():
+            linked = set(
+                related.filter(id__in=component_ids).values_list("id", flat=True)
+            )
+            if add:
+                changed = component_ids - linked
+                related.add(*changed)
+            else:
+                changed = linked
+                related.remove(*changed)
+            if changed:
+                # the m2m handlers have already refreshed the lineage and fingerprints,
+                # which saving the code run would do again
+                models.CodeRun.objects.filter(pk=code_run.pk).update(
+                    updated_by=request.user, last_updated=timezone.now()
+                )
+            count = related.count()
+
+        return Response({"added" if add else "removed": len(changed), "count": count})
+
+    @action(detail=False, methods=["post"])
+    def register(self, request, *args, **kwargs):
+        """
+        Register a whole `CodeRun` from a manifest, in a single transaction.
+
+        The manifest holds the `run_date`, `description` and optional `uuid` of the run,
+        its `submission_script`, optional `model_config` and optional `code_repo`, which
+        may name a `release`, each given with its `storage_location`. The `inputs` are
+        given by the natural key of their `DataProduct`, as "namespace:name@version",
+        and the name of a `component`, by default the whole object. The `outputs` are
+        given with the `namespace`, `name` and `version` of each new `DataProduct`, its
+        `storage_location` and any named `components`. Existing storage roots,
+        storage locations, namespaces and code releases are reused, and the URLs of
+        the records making up the run are returned.
+
+        :param request: The request, the data of which is the manifest
+
+        :return: A Response
+
+        """
+        if not isinstance(request.data, dict):
+            raise BadQuery(detail="Expected a code run manifest")
+        max_items = getattr(conf_settings, "BULK_CREATE_MAX_ITEMS", None)
+        for field in ("inputs", "outputs"):
+            items = request.data.get(field)
+            if max_items is not None and isinstance(items, list):
+                if len(items) > max_items:
+                    raise BadQuery(
+                        detail="Too many %s, at most %d can be registered at once"
+                        % (field, max_items)
+                    )
+
+        serializer = serializers.CodeRunManifestSerializer(
+            data=request.data, context=self.get_serializer_context()
+        )
+        if not serializer.is_valid():
+            if has_error_code(serializer.errors, "unique"):
+                raise APIIntegrityError(serializer.errors)
+            raise ValidationError(serializer.errors)
+
+        try:
+            with transaction.atomic():
+                run = registration.register(serializer.validated_data, request.user)
+        except IntegrityError as ex:
+            raise APIIntegrityError(str(ex))
+
+        def url(view_name, pk):
+            if pk is None:
+                return None
+            return reverse(view_name, kwargs={"pk": pk}, request=request)
+
+        data = {
+            "code_run": url("coderun-detail", run["code_run"].pk),
+            "code_repo_release": url(
+                "codereporelease-detail", getattr(run["code_repo_release"], "pk", None)
+            ),
+        }
+        for field in registration.CODE_FIELDS:
+            data[field] = url("object-detail", getattr(run[field], "pk", None))
+        data["inputs"] = [
+            url("objectcomponent-detail", component_id)
+            for component_id in run["inputs"]
+        ]
+        data["outputs"] = [
+            {
+                "data_product": url("dataproduct-detail", output["data_product"].pk),
+                "object": url("object-detail", output["object"].pk),
+                "storage_location": url(
+                    "storagelocation-detail", output["storage_location"]
+                ),
+                "components": {
+                    name: url("objectcomponent-detail", component_id)
+                    for name, component_id in output["components"].items()
+                },
+            }
+            for output in run["outputs"]
+        ]
+        return Response(data, status=status.HTTP_201_CREATED)
+
 
 for name, cls in models.all_models.items():
     if name in ("Issue", "DataProduct", "CodeRun"):
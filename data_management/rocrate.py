@@ -45,13 +45,18 @@ The contents of the ro-crate-metadata file can be viewed as `JSON` or `JSON-LD`.
 """
 
 from datetime import datetime
+from io import BytesIO, StringIO
 import json
 import mimetypes
-import tempfile
+import os
+import urllib.request
+import zipfile
 
+from rocrate.model.file import File
 from rocrate.model.person import Person
 from rocrate.rocrate import ContextEntity
 from rocrate.rocrate import ROCrate
+from rocrate.utils import is_url
 
 from data_management.views import external_object
 
@@ -59,6 +64,7 @@ import requests
 
 from . import models
 from . import settings
+from .graph import LineageGraph, LineageWalk
 
 
 RO_TYPE = "@type"
@@ -66,6 +72,10 @@ FILE = "file:"
 SHA1 = {"sha1": "https://w3id.org/ro/terms/workflow-run#sha1"}
 CLI_URL = "https://github.com/FAIRDataPipeline/FAIR-CLI"
 REMOTE_STORAGE_ROOT = "https://data.fairdatapipeline.org/data/"
+# the number of bytes read from a file at a time when streaming the zip file
+ZIP_BLOCK_SIZE = 64 * 1024
+# the number of seconds to wait for a remote file bundled into the zip file
+REMOTE_FETCH_TIMEOUT = 60
 
 
 def _add_authors(authors, crate, entity, registry_url):
@@ -174,23 +184,19 @@ def _add_external_object(crate, external_object):
     return crate_external_object
 
 
-def _add_licenses(crate, crate_entity, file_object, registry_url):
+def _add_licenses(crate, crate_entity, graph, file_object, registry_url):
     """
     Add licenses from the file_object to the crate_entity.
 
     @param crate: the RO Crate object
     @param crate_entity: an entity to add the license to
+    @param graph: a LineageGraph containing the file_object
     @param file_object: an "object" from the database representing a file
     @param registry_url: a str containing the registry URL
 
     """
     license_entities = []
-    try:
-        licenses = file_object.licences.all()
-    except AttributeError:
-        licenses = []
-
-    for license_ in licenses:
+    for license_ in graph.licences_of(file_object):
         if license_.identifier is not None:
             license_id = license_.identifier
         else:
@@ -273,73 +279,87 @@ def _get_default_license(crate):
     return default_license
 
 
-def _generate_ro_crate_from_dp(data_product, crate, registry_url, output_flag):
+def _generate_ro_crate_from_dp(
+    data_product, crate, graph, walk, registry_url, output_flag
+):
     """
     Update an RO Crate based around the data product.
 
     @param data_product: a data_product from the DataProduct table
     @param crate: the RO Crate object
+    @param graph: a LineageGraph that the level containing data_product has been
+        loaded into
+    @param walk: a LineageWalk recording the code runs that have already been added
     @param registry_url: a str containing the registry URL
     @param output_flag (bool): true if the data product is an output
 
     """
     crate_data_product = _get_data_product(
-        crate, data_product, registry_url, output_flag
+        crate, graph, data_product, registry_url, output_flag
     )
 
     # add the activity, i.e. the code run
-    components = data_product.object.components.all()
+    components = graph.components_of(data_product.object)
 
     for component in components:
-        try:
-            code_run = component.outputs_of.all()[0]
-        except IndexError:
+        code_run = graph.code_run_of(component)
+        if code_run is None:
             # there is no code run for this component so we cannot add any more
             # provenance data
             continue
 
+        if not walk.visit_code_run(code_run):
+            # the code run, along with its inputs, has already been added for another
+            # of its outputs
+            crate_code_run = crate.get(f"{registry_url}api/code_run/{code_run.id}")
+            crate_code_run["result"] = crate_data_product
+            continue
+
         input_files = []
 
         # add the code run
         crate_code_run = _get_code_run(
-            crate_data_product, crate, code_run, registry_url
+            crate_data_product, crate, graph, code_run, registry_url
         )
 
         # add the code repo release
         if code_run.code_repo is not None:
             crate_code_run["instrument"] = _get_code_repo_release(
-                crate, code_run.code_repo, registry_url
+                crate, graph, code_run.code_repo, registry_url
             )
 
         # add the model config
         if code_run.model_config is not None:
             model_config = _get_software(
-                crate, code_run.model_config, registry_url, "model_config"
+                crate, graph, code_run.model_config, registry_url, "model_config"
             )
             input_files.append(model_config)
 
         # add the submission script
         submission_script = _get_software(
-            crate, code_run.submission_script, registry_url, "submission_script"
+            crate, graph, code_run.submission_script, registry_url, "submission_script"
         )
         input_files.append(submission_script)
 
         # get data files
         input_files.extend(
-            _get_data_products(crate, code_run.inputs.all(), registry_url, False)
+            _get_data_products(
+                crate, graph, graph.inputs_of(code_run), registry_url, False
+            )
         )
 
         # add input files
         crate_code_run["object"] = input_files
 
 
-def _generate_ro_crate_from_cr(code_run, crate, registry_url):
+def _generate_ro_crate_from_cr(code_run, crate, graph, registry_url):
     """
     Crate an RO Crate based around the code run.
 
     @param code_run: a code_run from the CodeRun table
     @param crate: the RO Crate object
-    @param request: A request object
+    @param graph: a LineageGraph that the code_run has been loaded into
+    @param registry_url: a str containing the registry URL
 
     @return the RO Crate object
 
@@ -348,30 +368,32 @@ def _generate_ro_crate_from_cr(code_run, crate, registry_url):
     crate_data_product = None
 
     # add the code run
-    crate_code_run = _get_code_run(crate_data_product, crate, code_run, registry_url)
+    crate_code_run = _get_code_run(
+        crate_data_product, crate, graph, code_run, registry_url
+    )
 
     # add the code repo release
     if code_run.code_repo is not None:
         crate_code_run["instrument"] = _get_code_repo_release(
-            crate, code_run.code_repo, registry_url
+            crate, graph, code_run.code_repo, registry_url
         )
 
     # add the model config
     if code_run.model_config is not None:
         model_config = _get_software(
-            crate, code_run.model_config, registry_url, "model_config"
+            crate, graph, code_run.model_config, registry_url, "model_config"
         )
         input_files.append(model_config)
 
     # add the submission script
     submission_script = _get_software(
-        crate, code_run.submission_script, registry_url, "submission_script"
+        crate, graph, code_run.submission_script, registry_url, "submission_script"
     )
     input_files.append(submission_script)
 
     # get data files
     input_files.extend(
-        _get_data_products(crate, code_run.inputs.all(), registry_url, False)
+        _get_data_products(crate, graph, graph.inputs_of(code_run), registry_url, False)
     )
 
     # add input files
@@ -379,15 +401,16 @@ def _generate_ro_crate_from_cr(code_run, crate, registry_url):
 
     # add output files
     crate_code_run["result"] = _get_data_products(
-        crate, code_run.outputs.all(), registry_url, True
+        crate, graph, graph.outputs_of(code_run), registry_url, True
     )
 
 
-def _get_code_repo_release(crate, code_repo, registry_url):
+def _get_code_repo_release(crate, graph, code_repo, registry_url):
     """
     Create an RO Crate ContextEntity representing a code repo release.
 
     @param crate: the RO Crate object
+    @param graph: a LineageGraph containing the code_repo
     @param code_repo: a code_repo object
     @param registry_url: a str containing the registry URL
 
@@ -422,7 +445,7 @@ def _get_code_repo_release(crate, code_repo, registry_url):
     )
 
     _add_authors(
-        code_repo.authors.all(),
+        graph.authors_of(code_repo),
         crate,
         crate_code_release,
         registry_url,
@@ -432,12 +455,13 @@ def _get_code_repo_release(crate, code_repo, registry_url):
     return crate_code_release
 
 
-def _get_code_run(crate_data_product, crate, code_run, registry_url):
+def _get_code_run(crate_data_product, crate, graph, code_run, registry_url):
     """
     Create an RO Crate ContextEntity representing the code run and add the data product.
 
     @param crate_data_product: an RO data entity representing a data product
     @param crate: the RO Crate object
+    @param graph: a LineageGraph containing the code_run
     @param code_run: a code_run object
     @param registry_url: a str containing the registry URL
 
@@ -459,9 +483,9 @@ def _get_code_run(crate_data_product, crate, code_run, registry_url):
 
     crate.add(crate_code_run)
 
-    user_authors = models.UserAuthor.objects.filter(user=code_run.updated_by)
+    user_author = graph.author_for_user(code_run.updated_by)
 
-    if len(user_authors) == 0:
+    if user_author is None:
         agent_id = f"{registry_url}api/users/{code_run.updated_by.id}"
         crate.add(
             Person(
@@ -471,14 +495,12 @@ def _get_code_run(crate_data_product, crate, code_run, registry_url):
 
     else:
         # we have an author linked to the user
-        if user_authors[0].author.identifier is not None:
+        if user_author.identifier is not None:
             # if present use the identifier as the id
-            agent_id = user_authors[0].author.identifier
+            agent_id = user_author.identifier
         else:
-            agent_id = f"{registry_url}api/author/{user_authors[0].author.id}"
-        crate.add(
-            Person(crate, agent_id, properties={"name": user_authors[0].author.name})
-        )
+            agent_id = f"{registry_url}api/author/{user_author.id}"
+        crate.add(Person(crate, agent_id, properties={"name": user_author.name}))
 
     crate_code_run["agent"] = {"@id": agent_id}
 
@@ -488,11 +510,12 @@ def _get_code_run(crate_data_product, crate, code_run, registry_url):
     return crate_code_run
 
 
-def _get_data_product(crate, data_product, registry_url, output):
+def _get_data_product(crate, graph, data_product, registry_url, output):
     """
     Create an RO Crate file entity representing the data product.
 
     @param crate: RO Crate entity
+    @param graph: a LineageGraph containing the data_product
     @param data_product: a data_product from the DataProduct table
     @param registry_url: a str containing the registry URL
     @param output (bool): true if the data product is an output
@@ -508,10 +531,10 @@ def _get_data_product(crate, data_product, registry_url, output):
             crate, data_product, registry_url, output
         )
 
-    _add_licenses(crate, crate_data_product, data_product.object, registry_url)
+    _add_licenses(crate, crate_data_product, graph, data_product.object, registry_url)
 
     _add_authors(
-        data_product.object.authors.all(),
+        graph.authors_of(data_product.object),
         crate,
         crate_data_product,
         registry_url,
@@ -520,11 +543,12 @@ def _get_data_product(crate, data_product, registry_url, output):
     return crate_data_product
 
 
-def _get_data_products(crate, object_components, registry_url, output):
+def _get_data_products(crate, graph, object_components, registry_url, output):
     """
     Add input data products to the RO Crate code run entity.
 
     @param crate: the RO Crate object
+    @param graph: a LineageGraph containing the object_components
     @param object_components: a list of object_components from the ObjectComponent table
     @param registry_url: a str containing the registry URL
     @param output (bool): true if the data product is an output
@@ -535,11 +559,11 @@ def _get_data_products(crate, object_components, registry_url, output):
     all_data_products = []
     for component in object_components:
         obj = component.object
-        data_products = obj.data_products.all()
+        data_products = graph.data_products_of(obj)
 
         for data_product in data_products:
             crate_data_product = _get_data_product(
-                crate, data_product, registry_url, output
+                crate, graph, data_product, registry_url, output
             )
             all_data_products.append(crate_data_product)
 
@@ -576,51 +600,6 @@ def _get_external_object(crate, data_product, registry_url):
     return _add_external_object(crate, external_object)
 
 
-def _get_input_files_for_code_run(code_run):
-    """
-    Get the list of data products used to produce the given code run.
-
-    @param code_run: a code run from the CodeRun table
-
-    @return a list of data products
-
-    """
-    all_code_run_inputs = []
-    for component in code_run.inputs.all():
-        all_code_run_inputs.extend(component.object.data_products.all())
-
-    return all_code_run_inputs
-
-
-def _get_input_files_for_data_product(data_product):
-    """
-    Get the list of data products used to produce the given data product.
-
-    @param data_product: a data product from the DataProduct table
-
-    @return a list of data products
-
-    """
-    all_input_files = []
-
-    for initial_dp_component in data_product.object.components.all():
-        try:
-            code_run = initial_dp_component.outputs_of.all()[0]
-        except IndexError:
-            # there is no code run for this component so we cannot add any more
-            # data inputs data
-            continue
-
-        # now get the inputs for this code run
-        all_code_run_inputs = []
-        for component in code_run.inputs.all():
-            all_code_run_inputs.extend(component.object.data_products.all())
-
-        all_input_files.extend(all_code_run_inputs)
-
-    return all_input_files
-
-
 def _get_local_data_product(crate, data_product, registry_url, output):
     """
     Create an RO Crate file entity representing the data product.
@@ -703,11 +682,12 @@ def _get_mime_type(extension):
     return mime_type
 
 
-def _get_software(crate, software_object, registry_url, software_type):
+def _get_software(crate, graph, software_object, registry_url, software_type):
     """
     Create a file entity for the model configuration.
 
     @param crate: the RO Crate object
+    @param graph: a LineageGraph containing the software_object
     @param software_object: an "object" representing the software
     @param registry_url: a str containing the registry URL
     @param software_type: a str containing the name of the type of software
@@ -762,10 +742,10 @@ def _get_software(crate, software_object, registry_url, software_type):
         crate_software_object["sha1"] = software_object.storage_location.hash
         crate.metadata.extra_terms.update(SHA1)
 
-    _add_licenses(crate, crate_software_object, software_object, registry_url)
+    _add_licenses(crate, crate_software_object, graph, software_object, registry_url)
 
     _add_authors(
-        software_object.authors.all(),
+        graph.authors_of(software_object),
         crate,
         crate_software_object,
         registry_url,
@@ -774,28 +754,31 @@ def _get_software(crate, software_object, registry_url, software_type):
     return crate_software_object
 
 
-def generate_ro_crate_from_cr(code_run, depth, request):
+def generate_ro_crate_from_cr(code_run, depth, registry_url):
     """
     Crate an RO Crate based around the code run.
 
     @param code_run: a code_run from the CodeRun table
     @param depth: The depth for the crate. How many levels of code runs to include.
-    @param request: A request object
+    @param registry_url: The URL of the registry the crate is generated from
 
     @return the RO Crate object
 
     """
     mimetypes.init()
-    registry_url = request.build_absolute_uri("/")
 
     crate = ROCrate()
     crate.publisher = "FAIR Data Pipeline"
     crate.datePublished = datetime.now().isoformat()
     crate.name = f"RO Crate for code run {code_run.id}"
 
+    # loaded a level at a time, see LineageGraph
+    graph = LineageGraph()
+    code_run = graph.load_code_run(code_run)
+
     # add the licenses from each of the data products to the ROCrate
-    for output in code_run.outputs.all():
-        _add_licenses(crate, crate, output.object, registry_url)
+    for output in graph.outputs_of(code_run):
+        _add_licenses(crate, crate, graph, output.object, registry_url)
     if crate.license is None:
         crate_license = _get_default_license(crate)
         crate.add(crate_license)
@@ -803,22 +786,24 @@ def generate_ro_crate_from_cr(code_run, depth, request):
 
     _add_metadata_license(crate)
 
-    _generate_ro_crate_from_cr(code_run, crate, registry_url)
-
-    if depth == 1:
-        return crate
+    _generate_ro_crate_from_cr(code_run, crate, graph, registry_url)
 
-    input_data_products = _get_input_files_for_code_run(code_run)
+    # nodes reached by more than one path are skipped, see LineageWalk
+    walk = LineageWalk()
+    walk.visit_code_run(code_run)
+    input_data_products = graph.code_run_input_data_products(code_run)
 
     # add extra layers to the report if requested by the user
     while depth > 1:
         next_level_input_data_products = []
 
-        for data_product in input_data_products:
-            _generate_ro_crate_from_dp(data_product, crate, registry_url, False)
+        for data_product in graph.load_level(walk.unvisited(input_data_products)):
+            _generate_ro_crate_from_dp(
+                data_product, crate, graph, walk, registry_url, False
+            )
 
             next_level_input_data_products.extend(
-                _get_input_files_for_data_product(data_product)
+                graph.input_data_products(data_product)
             )
 
         # reset the input files for the next level
@@ -828,19 +813,18 @@ def generate_ro_crate_from_cr(code_run, depth, request):
     return crate
 
 
-def generate_ro_crate_from_dp(data_product, depth, request):
+def generate_ro_crate_from_dp(data_product, depth, registry_url):
     """
     Crate an RO Crate based around the data product.
 
     @param data_product: a data_product from the DataProduct table
     @param depth: The depth for the crate. How many levels of code runs to include.
-    @param request: A request object
+    @param registry_url: The URL of the registry the crate is generated from
 
     @return the RO Crate object
 
     """
     mimetypes.init()
-    registry_url = request.build_absolute_uri("/")
 
     crate = ROCrate()
     crate.publisher = "FAIR Data Pipeline"
@@ -848,7 +832,13 @@ def generate_ro_crate_from_dp(data_product, depth, request):
     crate.name = f"RO Crate for {data_product.name}"
     crate.version = data_product.version
 
-    _add_licenses(crate, crate, data_product.object, registry_url)
+    # loaded a level at a time, see LineageGraph
+    graph = LineageGraph()
+    # nodes reached by more than one path are skipped, see LineageWalk
+    walk = LineageWalk()
+    (data_product,) = graph.load_level(walk.unvisited([data_product]))
+
+    _add_licenses(crate, crate, graph, data_product.object, registry_url)
     if crate.license is None:
         crate_license = _get_default_license(crate)
         crate.add(crate_license)
@@ -857,22 +847,21 @@ def generate_ro_crate_from_dp(data_product, depth, request):
     _add_metadata_license(crate)
 
     # add the the main data product
-    _generate_ro_crate_from_dp(data_product, crate, registry_url, True)
-
-    if depth == 1:
-        return crate
+    _generate_ro_crate_from_dp(data_product, crate, graph, walk, registry_url, True)
 
-    input_data_products = _get_input_files_for_data_product(data_product)
+    input_data_products = graph.input_data_products(data_product)
 
     # add extra layers to the report if requested by the user
     while depth > 1:
         next_level_input_data_products = []
 
-        for data_product in input_data_products:
-            _generate_ro_crate_from_dp(data_product, crate, registry_url, False)
+        for data_product in graph.load_level(walk.unvisited(input_data_products)):
+            _generate_ro_crate_from_dp(
+                data_product, crate, graph, walk, registry_url, False
+            )
 
             next_level_input_data_products.extend(
-                _get_input_files_for_data_product(data_product)
+                graph.input_data_products(data_product)
             )
 
         # reset the input files for the next level
@@ -882,12 +871,211 @@ def generate_ro_crate_from_dp(data_product, depth, request):
     return crate
 
 
+class ROCrateTooLarge(Exception):
+    """
+    Raised when the files bundled in an RO Crate exceed the `RO_CRATE_MAX_BYTES`
+    setting.
+    """
+
+
+class _ZipStream:
+    """
+    A write only file like object that collects the output of a `zipfile.ZipFile` so
+    that it can be yielded in chunks.
+
+    As there is no `seek` the `ZipFile` writes a data descriptor after each member
+    rather than going back to update the local header.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _get_zip_members(crate):
+    """
+    Get the files that make up the zip file of the RO Crate.
+
+    This mirrors `ROCrate.write`, files that are referenced by a URL are only included
+    if they are to be fetched.
+
+    @param crate: the RO Crate object
+
+    @return a list of (arcname, source, size) tuples. The source is either a local
+        path, a URL or the bytes of the file. The size may be None if it is not known
+        until the file has been fetched.
+
+    """
+    members = []
+    seen = set()
+    for entity in crate.data_entities + crate.default_entities:
+        # an entity that has been replaced is still listed, only the last one is used
+        if entity is crate.metadata or crate.get(entity.id) is not entity:
+            continue
+        if entity.id in seen:
+            continue
+        seen.add(entity.id)
+        if entity is crate.preview and not entity.source:
+            content = entity.generate_html().encode("utf-8")
+            members.append((entity.id, content, len(content)))
+            continue
+        if not isinstance(entity, File):
+            continue
+        source = entity.source
+        if isinstance(source, (BytesIO, StringIO)):
+            content = source.getvalue()
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            members.append((entity.id, content, len(content)))
+        elif is_url(str(source)):
+            if entity.fetch_remote:
+                members.append((entity.id, str(source), None))
+        elif os.path.isfile(source):
+            members.append((entity.id, source, os.path.getsize(source)))
+
+    # the metadata is generated last, as in ROCrate.write
+    content = json.dumps(crate.metadata.generate(), indent=4, sort_keys=True).encode(
+        "utf-8"
+    )
+    members.append((crate.metadata.id, content, len(content)))
+    return members
+
+
+def _open_zip_member(source):
+    """
+    Open the source of a zip member for reading.
+
+    @param source: a local path, a URL or bytes
+
+    @return a binary file like object, which should be closed by the caller
+
+    """
+    if isinstance(source, bytes):
+        return BytesIO(source)
+    if is_url(source):
+        return urllib.request.urlopen(source, timeout=REMOTE_FETCH_TIMEOUT)
+    return open(source, "rb")
+
+
+def _get_remote_size(url):
+    """
+    Get the size of a remote file from the Content-Length of a HEAD request.
+
+    @param url: the URL of the file
+
+    @return the number of bytes, or None if the server did not give it
+
+    """
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=REMOTE_FETCH_TIMEOUT) as response:
+            length = response.headers.get("Content-Length")
+    except OSError:
+        # the file is fetched, and any error raised, when it is streamed
+        return None
+    try:
+        return int(length)
+    except (TypeError, ValueError):
+        return None
+
+
+def _check_zip_size(size, max_bytes):
+    if max_bytes is not None and size > max_bytes:
+        raise ROCrateTooLarge(
+            f"The files in the RO Crate exceed the limit of {max_bytes} bytes"
+        )
+
+
+def stream_ro_crate_zip(crate, max_bytes=None, block_size=None):
+    """
+    Stream the RO Crate as a zip file.
+
+    The zip file is produced in memory a block at a time, nothing is written to disk.
+    The combined size of the files is checked before anything is produced, taking the
+    size of a remote file from its Content-Length, so that a crate that is too large is
+    rejected before the response starts. The size of any remote file without a
+    Content-Length is checked as it is read.
+
+    @param crate: the RO Crate object
+    @param max_bytes: the maximum number of uncompressed bytes to bundle, or None for
+        no limit
+    @param block_size: the number of bytes to read from a member file at a time, the
+        default is ZIP_BLOCK_SIZE
+
+    @return an iterator of the bytes of the zip file
+
+    @raises ROCrateTooLarge: if the size of the files is known to exceed max_bytes
+
+    """
+    if block_size is None:
+        block_size = ZIP_BLOCK_SIZE
+    members = _get_zip_members(crate)
+    if max_bytes is not None:
+        members = [
+            (arcname, source, _get_remote_size(source) if size is None else size)
+            for arcname, source, size in members
+        ]
+    _check_zip_size(sum(size for _, _, size in members if size), max_bytes)
+    return _generate_zip(members, max_bytes, block_size)
+
+
+def _generate_zip(members, max_bytes, block_size):
+    stream = _ZipStream()
+    total = 0
+    # closing the generator, i.e. when the response is closed, closes the zip file and
+    # any open member through the context managers
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for arcname, source, size in members:
+            info = zipfile.ZipInfo(arcname, date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            with _open_zip_member(source) as member, zip_file.open(
+                info, "w", force_zip64=size is None or size > zipfile.ZIP64_LIMIT
+            ) as entry:
+                while True:
+                    block = member.read(block_size)
+                    if not block:
+                        break
+                    total += len(block)
+                    _check_zip_size(total, max_bytes)
+                    entry.write(block)
+                    data = stream.pop()
+                    if data:
+                        yield data
+            data = stream.pop()
+            if data:
+                yield data
+    yield stream.pop()
+
+
 def serialize_ro_crate(crate, format_):
-    if format_ == "zip":
-        tmp = tempfile.NamedTemporaryFile()
-        file_name = crate.write_zip(f"{tmp.name}.zip")
-        zip_file = open(file_name, "rb")
-        return zip_file
+    """
+    Serialize the RO Crate metadata.
+
+    Use `stream_ro_crate_zip` for the zip format.
+
+    @param crate: the RO Crate object
+    @param format_: a str containing the format, either 'json-ld' or 'json'
+
+    @return the metadata as a str for 'json-ld', otherwise as a dict
+
+    """
     if format_ == "json-ld":
         return json.dumps(crate.metadata.generate())
     return crate.metadata.generate()
@@ -1,8 +1,51 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+import zipfile
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from prov.model import ProvDerivation
+import prov.serializers
+from rdflib import Graph
+from rdflib.compare import isomorphic
 from rest_framework.test import APIClient
 
+from data_management.models import (
+    Author,
+    CodeRun,
+    DataProduct,
+    FileType,
+    Issue,
+    Licence,
+    Namespace,
+    Object,
+    ObjectComponent,
+    ReportJob,
+    StorageLocation,
+    StorageRoot,
+)
+from data_management import report_jobs
+from data_management.graph import LineageWalk
+from data_management.prov import (
+    _make_fragment,
+    generate_prov_document,
+    serialize_prov_document,
+)
+from data_management.render_pool import RenderPoolBusy
+from data_management.rocrate import REMOTE_FETCH_TIMEOUT
+from data_management.rest.views import compile_glob
+
 from .initdb import init_db
 from .init_prov_db import init_db as init_prov_db
 
@@ -169,6 +212,95 @@ class StorageLocationAPITests(TestCase):
         results = response.json()["results"]
         self.assertEqual(len(results), 20)
 
+    def test_upsert(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("storagelocation-list") + "?upsert=true"
+        location = StorageLocation.objects.get(
+            hash="eaa3833986a51b2f079dda9b702b0a3d510f2255"
+        )
+        count = StorageLocation.objects.count()
+
+        # public is part of the natural key, and is true by default
+        data = {
+            "storage_root": reverse(
+                "storageroot-detail", kwargs={"pk": location.storage_root_id}
+            ),
+            "hash": location.hash,
+            "path": "moved/symptom-probability.toml",
+        }
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["path"], "moved/symptom-probability.toml")
+        self.assertEqual(StorageLocation.objects.count(), count)
+        location.refresh_from_db()
+        self.assertEqual(location.path, "moved/symptom-probability.toml")
+
+        data["public"] = False
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(StorageLocation.objects.count(), count + 1)
+
+    def test_get_list_without_count(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("storagelocation-list")
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url, data={"count": "none"}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()["count"])
+        self.assertEqual(len(response.json()["results"]), 20)
+        self.assertFalse(
+            any("COUNT(" in query["sql"] for query in context.captured_queries)
+        )
+
+    def test_get_list_estimated_count(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("storagelocation-list")
+
+        with self.settings(PAGINATION_COUNT_LIMIT=5):
+            response = client.get(
+                url, data={"count": "estimate", "page_size": 2}, format="json"
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["count"], 5)
+            self.assertTrue(response.json()["count_estimated"])
+            self.assertEqual(len(response.json()["results"]), 2)
+            first_page = response.json()["results"]
+
+            # the cursor is unaffected by the count
+            response = client.get(response.json()["next"], format="json")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["count"], 5)
+            self.assertEqual(len(response.json()["results"]), 2)
+            self.assertNotEqual(response.json()["results"], first_page)
+
+        response = client.get(
+            url,
+            data={
+                "count": "estimate",
+                "path": "master/SCRC/human/infection/SARS-CoV-2/latent-period/0.1.0.toml",
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 1)
+        self.assertFalse(response.json()["count_estimated"])
+
+    def test_get_list_count_from_setting(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("storagelocation-list")
+        with self.settings(PAGINATION_COUNT="none"):
+            response = client.get(url, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()["count"])
+
+        response = client.get(url, data={"count": "all"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
     def test_get_detail(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -327,6 +459,57 @@ class ObjectAPITests(TestCase):
             results[0]["storage_location"], "http://localhost/api/storage_location/3/"
         )
 
+    def test_bulk_create(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("object-bulk")
+        author_url = "http://testserver" + reverse("author-detail", kwargs={"pk": 1})
+        data = [
+            {
+                "description": "bulk object 1",
+                "storage_location": "http://testserver"
+                + reverse("storagelocation-detail", kwargs={"pk": 1}),
+                "authors": [author_url],
+            },
+            {"description": "bulk object 2"},
+        ]
+        response = client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()
+        self.assertEqual(
+            [result["description"] for result in results],
+            ["bulk object 1", "bulk object 2"],
+        )
+        self.assertEqual(results[0]["authors"], [author_url])
+        for result in results:
+            obj = Object.objects.get(uuid=result["uuid"])
+            self.assertEqual(obj.updated_by, self.user)
+            self.assertEqual(
+                list(obj.components.values_list("name", "whole_object")),
+                [("whole_object", True)],
+            )
+
+    def test_bulk_create_repeated_author(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("object-bulk")
+        author_url = "http://testserver" + reverse("author-detail", kwargs={"pk": 1})
+        data = [{"description": "bulk object", "authors": [author_url, author_url]}]
+        response = client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()[0]["authors"], [author_url])
+
+    def test_bulk_create_not_allowed(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(
+            reverse("namespace-bulk"), [{"name": "bulk"}], format="json"
+        )
+
+        self.assertEqual(response.status_code, 405)
+
 
 class ObjectComponentAPITests(TestCase):
 
@@ -381,6 +564,76 @@ class ObjectComponentAPITests(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]["name"], "nhs_health_board/per_location/all_deaths")
 
+    def _component(self, object_pk, name):
+        return {
+            "object": "http://testserver"
+            + reverse("object-detail", kwargs={"pk": object_pk}),
+            "name": name,
+        }
+
+    def test_bulk_create(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("objectcomponent-bulk")
+        data = [self._component(1, f"bulk/component/{i}") for i in range(50)]
+        data[0]["issues"] = [
+            "http://testserver" + reverse("issue-detail", kwargs={"pk": 1})
+        ]
+        response = client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()
+        self.assertEqual(
+            [result["name"] for result in results], [item["name"] for item in data]
+        )
+        self.assertEqual(results[0]["issues"], data[0]["issues"])
+        self.assertEqual(
+            ObjectComponent.objects.filter(name__startswith="bulk/").count(), 50
+        )
+        self.assertEqual(
+            list(
+                ObjectComponent.objects.get(name="bulk/component/0").issues.values_list(
+                    "id", flat=True
+                )
+            ),
+            [1],
+        )
+
+    def test_bulk_create_invalid(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("objectcomponent-bulk")
+        data = [self._component(1, "bulk/valid"), {"name": "bulk/no_object"}]
+        response = client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertIn("object", errors[1])
+        self.assertFalse(ObjectComponent.objects.filter(name="bulk/valid").exists())
+
+        response = client.post(url, {"name": "bulk/not_a_list"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create_conflict(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("objectcomponent-bulk")
+
+        # conflicts with an existing component
+        data = [self._component(1, "bulk/valid"), self._component(1, "whole_object")]
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 409)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertIn("non_field_errors", errors[1])
+
+        # conflicts within the list
+        data = [self._component(1, "bulk/valid"), self._component(1, "bulk/valid")]
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(ObjectComponent.objects.filter(name="bulk/valid").exists())
+
 
 class IssueAPITests(TestCase):
 
@@ -428,6 +681,292 @@ class CodeRunAPITests(TestCase):
         self.user = get_user_model().objects.create(username="Test User")
         init_db()
 
+    def _code_run(self, inputs):
+        return {
+            "run_date": "2021-07-17T18:21:11Z",
+            "description": "Test run with inputs",
+            "submission_script": "http://testserver"
+            + reverse("object-detail", kwargs={"pk": 1}),
+            "inputs": inputs,
+            "outputs": [],
+        }
+
+    def _component_url(self, pk):
+        return "http://testserver" + reverse(
+            "objectcomponent-detail", kwargs={"pk": pk}
+        )
+
+    def test_create_query_count_independent_of_inputs(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("coderun-list")
+        component_ids = list(ObjectComponent.objects.values_list("id", flat=True))
+        self.assertGreater(len(component_ids), 10)
+
+        def count_queries(inputs):
+            with CaptureQueriesContext(connection) as context:
+                response = client.post(url, self._code_run(inputs), format="json")
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.json()["inputs"]), len(inputs))
+            return len(context.captured_queries)
+
+        initial_count = count_queries([self._component_url(component_ids[0])])
+        # inputs may be given as hyperlinks or ids
+        inputs = [self._component_url(pk) for pk in component_ids[1:]]
+        inputs[0] = component_ids[1]
+        self.assertEqual(count_queries(inputs), initial_count)
+
+    def test_add_and_remove_components(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        code_run = CodeRun.objects.get(pk=1)
+        inputs = set(code_run.inputs.values_list("id", flat=True))
+        new_ids = list(
+            ObjectComponent.objects.exclude(id__in=inputs).values_list("id", flat=True)
+        )[:3]
+        url = reverse("coderun-add-inputs", kwargs={"pk": 1})
+
+        data = [self._component_url(pk) for pk in new_ids[:2]] + list(inputs)[:1]
+        saved = mock.Mock()
+        post_save.connect(saved, sender=CodeRun)
+        self.addCleanup(post_save.disconnect, saved, sender=CodeRun)
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"added": 2, "count": len(inputs) + 2})
+        # the code run is marked as updated without being saved again
+        saved.assert_not_called()
+        updated = CodeRun.objects.get(pk=1)
+        self.assertEqual(updated.updated_by, self.user)
+        self.assertGreater(updated.last_updated, code_run.last_updated)
+
+        # the components that are already inputs are not added again
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(url, new_ids, format="json")
+        self.assertEqual(response.json(), {"added": 1, "count": len(inputs) + 3})
+        self.assertEqual(
+            set(code_run.inputs.values_list("id", flat=True)), inputs | set(new_ids)
+        )
+        inserts = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith("INSERT")
+            and '"data_management_coderun_inputs"' in query["sql"]
+        ]
+        self.assertEqual(len(inserts), 1)
+
+        url = reverse("coderun-remove-inputs", kwargs={"pk": 1})
+        response = client.post(url, new_ids + [new_ids[0]], format="json")
+        self.assertEqual(response.json(), {"removed": 3, "count": len(inputs)})
+        self.assertEqual(set(code_run.inputs.values_list("id", flat=True)), inputs)
+
+        url = reverse("coderun-add-outputs", kwargs={"pk": 1})
+        response = client.post(url, new_ids[:1], format="json")
+        self.assertEqual(response.json()["added"], 1)
+        self.assertTrue(code_run.outputs.filter(id=new_ids[0]).exists())
+
+        url = reverse("coderun-remove-outputs", kwargs={"pk": 1})
+        response = client.post(url, [9999], format="json")
+        self.assertEqual(response.status_code, 400)
+        response = client.post(url, {"components": new_ids}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_with_missing_inputs(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("coderun-list")
+        inputs = [
+            self._component_url(1),
+            self._component_url(9998),
+            9999,
+            "http://testserver" + reverse("object-detail", kwargs={"pk": 1}),
+        ]
+        response = client.post(url, self._code_run(inputs), format="json")
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()["inputs"]
+        self.assertEqual(len(errors), 3)
+        self.assertIn(self._component_url(9998), errors[0])
+        self.assertIn("9999", errors[1])
+        self.assertIn("Invalid hyperlink - Incorrect URL match.", errors[2])
+        self.assertEqual(CodeRun.objects.count(), 1)
+
+    def _manifest(self, outputs):
+        author_url = "http://testserver" + reverse(
+            "author-detail", kwargs={"pk": Author.objects.first().pk}
+        )
+        return {
+            "run_date": "2021-07-17T18:21:11Z",
+            "description": "Registered run",
+            "code_repo": {
+                "storage_location": {
+                    "storage_root": "https://github.com/",
+                    "path": "org/model",
+                    "hash": "repo-hash",
+                },
+                "release": {"name": "model", "version": "1.0.0"},
+            },
+            "model_config": {
+                "storage_location": {
+                    "storage_root": "file:///runs/",
+                    "path": "config.yaml",
+                    "hash": "config-hash",
+                }
+            },
+            "submission_script": {
+                "storage_location": {
+                    "storage_root": "file:///runs/",
+                    "path": "script.sh",
+                    "hash": "script-hash",
+                }
+            },
+            "inputs": [
+                {"data_product": "FAIR:this/is/a/test/1@0.1.0"},
+                {
+                    "data_product": "FAIR:human/infection/SARS-CoV-2/"
+                    "symptom-probability@0.1.0",
+                    "component": "symptom-probability",
+                },
+            ],
+            "outputs": [
+                {
+                    "namespace": "registered",
+                    "name": "output/%d" % index,
+                    "version": "0.1.0",
+                    "storage_location": {
+                        "storage_root": "file:///runs/",
+                        "path": "output_%d.h5" % index,
+                        "hash": "output-hash-%d" % index,
+                    },
+                    "authors": [author_url],
+                    "components": (
+                        [{"name": "table"}, {"name": "array"}] if index % 2 else []
+                    ),
+                }
+                for index in range(outputs)
+            ],
+        }
+
+    def test_register(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("coderun-register")
+
+        response = client.post(url, self._manifest(2), format="json")
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        code_run = CodeRun.objects.get(pk=data["code_run"].rstrip("/").split("/")[-1])
+        self.assertEqual(code_run.description, "Registered run")
+        self.assertEqual(code_run.code_repo.code_repo_release.name, "model")
+        self.assertEqual(code_run.model_config.storage_location.path, "config.yaml")
+        self.assertEqual(
+            str(code_run.submission_script.storage_location), "file:///runs/script.sh"
+        )
+        self.assertEqual(
+            set(code_run.inputs.values_list("name", flat=True)),
+            {"whole_object", "symptom-probability"},
+        )
+        self.assertEqual(len(data["inputs"]), 2)
+
+        self.assertEqual(len(data["outputs"]), 2)
+        self.assertEqual(list(data["outputs"][0]["components"]), ["whole_object"])
+        self.assertEqual(list(data["outputs"][1]["components"]), ["table", "array"])
+        self.assertEqual(
+            set(code_run.outputs.values_list("name", flat=True)),
+            {"whole_object", "table", "array"},
+        )
+        for output in data["outputs"]:
+            response = client.get(output["data_product"], format="json")
+            self.assertEqual(response.json()["object"], output["object"])
+        data_product = DataProduct.objects.get(
+            namespace__name="registered", name="output/1"
+        )
+        self.assertEqual(data_product.object.authors.count(), 1)
+        self.assertEqual(data_product.object.storage_location.hash, "output-hash-1")
+        # the lineage of the outputs is up to date
+        self.assertLessEqual(
+            {"this/is/a/test/1", "human/infection/SARS-CoV-2/symptom-probability"},
+            set(data_product.ancestor_links.values_list("ancestor__name", flat=True)),
+        )
+        self.assertIsNotNone(data_product.provenance_fingerprint)
+
+        # the storage locations, namespace and release are reused by the next run
+        manifest = self._manifest(3)
+        del manifest["outputs"][:2]
+        counts = [
+            model.objects.count()
+            for model in (StorageRoot, StorageLocation, Namespace, Object)
+        ]
+        response = client.post(url, manifest, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["code_repo"], data["code_repo"])
+        self.assertEqual(
+            [
+                model.objects.count()
+                for model in (StorageRoot, StorageLocation, Namespace, Object)
+            ],
+            [counts[0], counts[1] + 1, counts[2], counts[3] + 3],
+        )
+
+    def test_register_query_count_independent_of_size(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("coderun-register")
+
+        def count_queries(manifest):
+            with CaptureQueriesContext(connection) as context:
+                response = client.post(url, manifest, format="json")
+            self.assertEqual(response.status_code, 201)
+            return len(context.captured_queries)
+
+        initial_count = count_queries(self._manifest(2))
+        manifest = self._manifest(10)
+        del manifest["outputs"][:2]
+        for output in manifest["outputs"]:
+            output["namespace"] = "other"
+            output["storage_location"]["storage_root"] = "file:///other/"
+        manifest["model_config"]["storage_location"]["hash"] = "other-config-hash"
+        manifest["code_repo"]["release"]["version"] = "2.0.0"
+        manifest["code_repo"]["storage_location"]["hash"] = "other-repo-hash"
+        self.assertEqual(count_queries(manifest), initial_count)
+
+    def test_register_invalid(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("coderun-register")
+        counts = [model.objects.count() for model in (CodeRun, Object, StorageRoot)]
+
+        manifest = self._manifest(2)
+        manifest["inputs"][0]["data_product"] = "FAIR:this/is/a/test/1@9.9.9"
+        manifest["inputs"][1]["data_product"] = "FAIR:missing-version"
+        manifest["outputs"][1]["authors"] = [99999]
+        response = client.post(url, manifest, format="json")
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors["inputs"][0], {})
+        self.assertIn("namespace:name@version", errors["inputs"][1]["data_product"][0])
+
+        manifest = self._manifest(2)
+        manifest["inputs"] = [{"data_product": "FAIR:this/is/a/test/1@9.9.9"}]
+        manifest["outputs"][1]["authors"] = [99999]
+        response = client.post(url, manifest, format="json")
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertIn("does not exist", errors["inputs"][0]["data_product"][0])
+        self.assertEqual(errors["outputs"][0], {})
+        self.assertIn("99999", errors["outputs"][1]["authors"][0])
+
+        # an output that already exists is a conflict
+        manifest = self._manifest(2)
+        manifest["outputs"][1].update(
+            namespace="FAIR", name="this/is/a/test/2", version="0.1.0"
+        )
+        response = client.post(url, manifest, format="json")
+        self.assertEqual(response.status_code, 409)
+
+        self.assertEqual(
+            [model.objects.count() for model in (CodeRun, Object, StorageRoot)], counts
+        )
+
     def test_get_list(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -762,6 +1301,61 @@ class NamespaceAPITests(TestCase):
         self.assertEqual(response["Content-Type"], "application/json")
         self.assertEqual(response.json()["name"], "FAIR")
 
+    def test_upsert(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("namespace-list") + "?upsert=true"
+        count = Namespace.objects.count()
+
+        response = client.post(url, {"name": "upserted"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        created_url = response.json()["url"]
+
+        # an unchanged object is not written again
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(url, {"name": "upserted"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["url"], created_url)
+        self.assertFalse(
+            any(
+                query["sql"].startswith(("INSERT", "UPDATE"))
+                for query in context.captured_queries
+            )
+        )
+
+        data = {"name": "upserted", "full_name": "Upserted namespace"}
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["url"], created_url)
+        self.assertEqual(response.json()["full_name"], "Upserted namespace")
+
+        # without INSERT ... ON CONFLICT the object is updated with update_or_create
+        data["website"] = "https://example.org/"
+        with mock.patch.object(
+            connection.features, "supports_update_conflicts_with_target", False
+        ):
+            response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["website"], "https://example.org/")
+        self.assertEqual(Namespace.objects.count(), count + 1)
+
+        # other uniqueness conflicts are reported by the database
+        data = {"name": "other", "full_name": "Upserted namespace"}
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 409)
+
+        # without upsert an existing object is still a conflict
+        data["name"] = "upserted"
+        response = client.post(reverse("namespace-list"), data, format="json")
+        self.assertEqual(response.status_code, 409)
+
+    def test_upsert_without_natural_key(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("author-list") + "?upsert=true"
+        response = client.post(url, {"name": "An Author"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
     def test_filter_by_name(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -792,6 +1386,123 @@ class DataProductAPITests(TestCase):
         self.user = get_user_model().objects.create(username="Test User")
         init_db()
 
+    def test_resolve(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("dataproduct-resolve")
+        data_product = DataProduct.objects.get(name="this/is/a/test/1")
+        newer = DataProduct.objects.create(
+            updated_by=self.user,
+            object=Object.objects.create(updated_by=self.user),
+            namespace=data_product.namespace,
+            name=data_product.name,
+            version="0.10.0",
+        )
+        DataProduct.objects.create(
+            updated_by=self.user,
+            object=Object.objects.create(updated_by=self.user),
+            namespace=data_product.namespace,
+            name=data_product.name,
+            version="0.9.0",
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(
+                url,
+                [
+                    "FAIR:this/is/a/test/1@0.1.0",
+                    "FAIR:this/is/a/test/1@latest",
+                    "FAIR:this/is/a/test/missing@latest",
+                    "FAIR:this/is/a/test/2@0.2.0",
+                ],
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(context.captured_queries), 1)
+        results = response.json()
+
+        self.assertEqual(results[0]["data_product"], "FAIR:this/is/a/test/1@0.1.0")
+        self.assertEqual(
+            results[0]["url"],
+            "http://testserver"
+            + reverse("dataproduct-detail", kwargs={"pk": data_product.pk}),
+        )
+        self.assertEqual(
+            results[0]["object"],
+            "http://testserver"
+            + reverse("object-detail", kwargs={"pk": data_product.object_id}),
+        )
+        location = data_product.object.storage_location
+        self.assertEqual(results[0]["location"], location.full_uri())
+        self.assertEqual(results[0]["hash"], location.hash)
+        self.assertEqual(results[0]["storage_root"], location.storage_root.root)
+
+        # the latest version is the highest semantic version
+        self.assertEqual(results[1]["version"], "0.10.0")
+        self.assertEqual(
+            results[1]["url"],
+            "http://testserver"
+            + reverse("dataproduct-detail", kwargs={"pk": newer.pk}),
+        )
+        self.assertIsNone(results[1]["storage_location"])
+        self.assertIsNone(results[2]["url"])
+        self.assertIsNone(results[3]["url"])
+        self.assertEqual(results[3]["data_product"], "FAIR:this/is/a/test/2@0.2.0")
+
+        response = APIClient().post(url, ["FAIR:this/is/a/test/1@0.1.0"], format="json")
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_resolve_invalid(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("dataproduct-resolve")
+        response = client.post(
+            url, ["FAIR:this/is/a/test/1@0.1.0", "FAIR:no-version"], format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("namespace:name@version", str(response.json()))
+        response = client.post(url, ["FAIR:this/is/a/test/1@newest"], format="json")
+        self.assertEqual(response.status_code, 400)
+        response = client.post(url, {"data_product": "FAIR:a@latest"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        with self.settings(RESOLVE_MAX_ITEMS=1):
+            response = client.post(
+                url, ["FAIR:a@latest", "FAIR:b@latest"], format="json"
+            )
+        self.assertEqual(response.status_code, 400)
+
+    def test_upsert(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("dataproduct-list") + "?upsert=true"
+        data_product = DataProduct.objects.get(name="this/is/a/test/1")
+        new_object = Object.objects.create(updated_by=self.user)
+        count = DataProduct.objects.count()
+
+        data = {
+            "namespace": reverse(
+                "namespace-detail", kwargs={"pk": data_product.namespace_id}
+            ),
+            "name": data_product.name,
+            "version": data_product.version,
+            "object": reverse("object-detail", kwargs={"pk": new_object.pk}),
+        }
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        data_product.refresh_from_db()
+        self.assertEqual(data_product.object_id, new_object.pk)
+        self.assertEqual(DataProduct.objects.count(), count)
+
+        data["version"] = "0.2.0"
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["version"], "0.2.0")
+        self.assertIsNotNone(
+            DataProduct.objects.get(
+                name=data_product.name, version="0.2.0"
+            ).provenance_fingerprint
+        )
+
     def test_get_list(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -842,6 +1553,23 @@ class DataProductAPITests(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]["name"], "human/infection/SARS-CoV-2/latent-period")
 
+    def test_filter_by_provenance_fingerprint(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        fingerprint = DataProduct.objects.get(pk=3).provenance_fingerprint
+        url = reverse("dataproduct-list")
+        response = client.get(
+            url, data={"provenance_fingerprint": fingerprint}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["provenance_fingerprint"], fingerprint)
+        self.assertEqual(
+            results[0]["name"], "human/infection/SARS-CoV-2/symptom-probability"
+        )
+
     def test_filter_by_name_glob(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -855,6 +1583,78 @@ class DataProductAPITests(TestCase):
         results = response.json()["results"]
         self.assertEqual(len(results), 7)
 
+    def test_filter_by_name_glob_is_case_sensitive(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("dataproduct-list")
+        response = client.get(
+            url, data={"name": "HUMAN/infection/SARS-CoV-2/*"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 0)
+
+    def test_filter_by_name_glob_single_character(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("dataproduct-list")
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(
+                url,
+                data={"name": "human/infection/SARS-CoV-?/latent-perio?"},
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["name"], "human/infection/SARS-CoV-2/latent-period")
+        self.assertFalse(
+            any("REGEXP" in query["sql"] for query in context.captured_queries)
+        )
+
+    def test_compile_glob(self):
+        self.assertEqual(compile_glob("SCRC/cases"), ("exact", "SCRC/cases"))
+        self.assertEqual(compile_glob("SCRC/*"), ("glob", "SCRC/*"))
+        self.assertEqual(compile_glob("SCRC/?/cases*"), ("glob", "SCRC/?/cases*"))
+        self.assertEqual(compile_glob("SCRC/[a"), ("exact", "SCRC/[a"))
+        self.assertEqual(compile_glob("SCRC/[a*"), ("glob", "SCRC/[a*"))
+        lookup_type, regex = compile_glob("SCRC/[0-9]*")
+        self.assertEqual(lookup_type, "regex")
+        self.assertRegex("SCRC/1.0", regex)
+        self.assertNotRegex("SCRC/a", regex)
+
+    def test_internal_format(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.get(reverse("dataproduct-list"), format="json")
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        expected = {
+            data_product.name: data_product.object.components.filter(
+                whole_object=False
+            ).exists()
+            for data_product in DataProduct.objects.all()
+        }
+        self.assertIn(True, expected.values())
+        self.assertIn(False, expected.values())
+        self.assertEqual(
+            {result["name"]: result["internal_format"] for result in results},
+            expected,
+        )
+
+        data_product = DataProduct.objects.get(
+            name="human/infection/SARS-CoV-2/latent-period"
+        )
+        response = client.get(
+            reverse("dataproduct-detail", kwargs={"pk": data_product.id}),
+            format="json",
+        )
+        self.assertEqual(
+            response.json()["internal_format"], expected[data_product.name]
+        )
+
     def test_filter_by_version(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -961,6 +1761,36 @@ class KeyvalueAPITests(TestCase):
         self.assertEqual(results[0]["key"], "TestKey2")
 
 
+class ListQueryCountAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="Test User")
+        init_db()
+
+    def _count_queries(self, url_name, page_size):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse(url_name)
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url, data={"page_size": page_size}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), page_size)
+        return len(context.captured_queries)
+
+    def test_query_count_independent_of_page_size(self):
+        for url_name in (
+            "dataproduct-list",
+            "object-list",
+            "objectcomponent-list",
+            "storageroot-list",
+            "storagelocation-list",
+        ):
+            with self.subTest(url_name=url_name):
+                self.assertEqual(
+                    self._count_queries(url_name, 2), self._count_queries(url_name, 8)
+                )
+
+
 class ProvAPITests(TestCase):
 
     APPLICATION_JSON = "application/json"
@@ -1004,6 +1834,8 @@ class ProvAPITests(TestCase):
     def setUp(self):
         self.user = get_user_model().objects.create(username="Test User")
         init_prov_db()
+        caches[settings.PROV_REPORT_CACHE].clear()
+        caches[settings.PROV_FRAGMENT_CACHE].clear()
 
     def test_get_json(self):
         client = APIClient()
@@ -1354,6 +2186,23 @@ endDocument"""
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response["Content-Type"], "application/ld+json; charset=utf8")
 
+    def test_json_ld_matches_rdf_serialization(self):
+        registry_url = "http://testserver/"
+        doc = generate_prov_document(DataProduct.objects.get(id=9), 3, registry_url)
+        result = serialize_prov_document(doc, "json-ld", 0.71)
+
+        # the JSON-LD used to be generated from the TriG serialisation
+        with io.StringIO() as buf:
+            prov.serializers.get("rdf")(doc).serialize(buf)
+            graph = Graph().parse(data=buf.getvalue(), format="trig")
+        expected = graph.serialize(format="json-ld")
+        self.assertTrue(
+            isomorphic(
+                Graph().parse(data=result, format="json-ld"),
+                Graph().parse(data=expected, format="json-ld"),
+            )
+        )
+
     def test_get_xml(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -1468,6 +2317,191 @@ endDocument"""
 
         self._check_code_runs_present(results)
 
+    def test_query_count_independent_of_graph_size(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("prov_report", kwargs={"pk": 9})
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = client.get(
+                    url,
+                    data={"depth": 5},
+                    format="json",
+                    HTTP_ACCEPT=self.APPLICATION_JSON,
+                )
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        initial_count = count_queries()
+
+        # widen the graph, adding more input data products to the code runs
+        code_run = CodeRun.objects.get(pk=4)
+        namespace = Namespace.objects.get(name="prov")
+        for i in range(20):
+            obj = Object.objects.create(updated_by=self.user)
+            obj.authors.add(Author.objects.create(updated_by=self.user, name=f"A{i}"))
+            DataProduct.objects.create(
+                updated_by=self.user,
+                object=obj,
+                namespace=namespace,
+                name=f"extra/input/{i}",
+                version="0.1.0",
+            )
+            code_run.inputs.add(obj.components.first())
+
+        self.assertEqual(count_queries(), initial_count)
+
+    def test_shared_inputs_expanded_once(self):
+        # data product 8 is generated from data products 6 and 7, which were both
+        # generated from data product 1
+        registry_url = "http://testserver/"
+        data_product = DataProduct.objects.get(pk=8)
+
+        walk = LineageWalk()
+        doc = generate_prov_document(data_product, 3, registry_url, walk=walk)
+
+        self.assertEqual(walk.data_products, {1, 6, 7, 8})
+        self.assertEqual(walk.skipped_data_products, 1)
+        self.assertEqual(walk.skipped_code_runs, 0)
+        self.assertEqual(walk.skipped, 1)
+        derivations = [
+            (str(record.args[0]), str(record.args[1]))
+            for record in doc.get_records(ProvDerivation)
+        ]
+        self.assertEqual(
+            sorted(set(derivations)),
+            [
+                ("lreg:api/data_product/6", "lreg:api/data_product/1"),
+                ("lreg:api/data_product/7", "lreg:api/data_product/1"),
+                ("lreg:api/data_product/8", "lreg:api/data_product/6"),
+                ("lreg:api/data_product/8", "lreg:api/data_product/7"),
+            ],
+        )
+        self.assertEqual(len(derivations), len(set(derivations)))
+
+    def test_render_pool_busy(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("prov_report", kwargs={"pk": 1})
+        with mock.patch(
+            "data_management.render_pool.graphviz_available", return_value=True
+        ), mock.patch(
+            "data_management.render_pool.render",
+            side_effect=RenderPoolBusy("All renderers are busy", 60),
+        ):
+            response = client.get(url, format="svg", HTTP_ACCEPT="image/svg+xml")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "60")
+
+    def test_render_stats(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.get(reverse("prov_render_stats"), format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["workers"], settings.PROV_RENDER_WORKERS)
+        self.assertIn("max_queue_wait_seconds", response.json())
+
+        # the metrics are internal, so are only shown to authenticated users
+        response = APIClient().get(reverse("prov_render_stats"), format="json")
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_report_cache(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("prov_report", kwargs={"pk": 9})
+
+        def get_report():
+            response = client.get(
+                url, data={"depth": 5}, format="xml", HTTP_ACCEPT="text/xml"
+            )
+            self.assertEqual(response.status_code, 200)
+            return response.content.decode()
+
+        with mock.patch(
+            "data_management.prov.serialize_prov_document",
+            wraps=serialize_prov_document,
+        ) as serialize:
+            first = get_report()
+            self.assertEqual(get_report(), first)
+            self.assertEqual(serialize.call_count, 1)
+
+            # a different rendering of the same report is cached separately
+            client.get(url, data={"depth": 4}, format="xml", HTTP_ACCEPT="text/xml")
+            self.assertEqual(serialize.call_count, 2)
+
+            # updating a node in the provenance graph invalidates the report
+            data_product = DataProduct.objects.get(pk=1)
+            data_product.name = "this/is/cr/test/updated/input/1"
+            data_product.save()
+            updated = get_report()
+            self.assertEqual(serialize.call_count, 3)
+            self.assertNotEqual(updated, first)
+            self.assertIn("this/is/cr/test/updated/input/1", updated)
+
+            # as does linking another record into the graph
+            Issue.objects.create(
+                updated_by=self.user, description="new issue"
+            ).component_issues.add(data_product.object.components.first())
+            self.assertIn("new issue", get_report())
+            self.assertEqual(serialize.call_count, 4)
+
+    def test_fragments_match_generated_document(self):
+        registry_url = "http://testserver/"
+
+        def generate(data_product_id, depth):
+            doc = generate_prov_document(
+                DataProduct.objects.get(pk=data_product_id), depth, registry_url
+            )
+            return doc.serialize(format="provn"), doc.serialize(format="json")
+
+        # the reports are assembled from fragments cached by the ones before them
+        assembled = {
+            (data_product_id, depth): generate(data_product_id, depth)
+            for data_product_id in range(1, 14)
+            for depth in (1, 2, 4)
+        }
+        with override_settings(PROV_FRAGMENT_CACHE=None):
+            for (data_product_id, depth), report in assembled.items():
+                self.assertEqual(report, generate(data_product_id, depth))
+
+    def test_fragment_cache(self):
+        registry_url = "http://testserver/"
+
+        def generate(data_product_id, depth):
+            with mock.patch(
+                "data_management.prov._make_fragment", wraps=_make_fragment
+            ) as make_fragment:
+                generate_prov_document(
+                    DataProduct.objects.get(pk=data_product_id), depth, registry_url
+                )
+            return {call.args[1].id for call in make_fragment.call_args_list}
+
+        # data product 9 was generated from 8, which was generated from 6 and 7, which
+        # were both generated from 1
+        self.assertEqual(generate(9, 2), {9, 8})
+        self.assertEqual(generate(9, 4), {6, 7, 1})
+        self.assertEqual(generate(8, 3), set())
+
+        # a change elsewhere in the registry does not invalidate the fragments
+        data_product = DataProduct.objects.get(pk=10)
+        data_product.name = "this/is/cr/test/updated/output/7"
+        data_product.save()
+        self.assertEqual(generate(9, 4), set())
+
+        # an issue invalidates the fragment of the data product, and those of the data
+        # products it is an input to
+        Issue.objects.create(
+            updated_by=self.user, description="new issue"
+        ).component_issues.add(DataProduct.objects.get(pk=7).object.components.first())
+        self.assertEqual(generate(9, 4), {7, 8})
+
+        # as does a change to one of its authors
+        author = DataProduct.objects.get(pk=1).object.authors.first()
+        author.name = "Updated Author"
+        author.save()
+        self.assertIn(1, generate(9, 4))
+
     def _check_code_runs_present(self, results):
         self.assertIn(
             results["used"][self.ID9][self.PROV_ACTIVITY], f"{self.LREG_CODE_RUN}4"
@@ -1546,6 +2580,74 @@ class RoCrateAPITest(TestCase):
         response = client.get(url, format="zip", HTTP_ACCEPT="application/zip")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertTrue(response.streaming)
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zf:
+            self.assertEqual(zf.namelist(), ["ro-crate-metadata.json"])
+            metadata = json.loads(zf.read("ro-crate-metadata.json"))
+        self.assertIn("@graph", metadata)
+
+    def _use_local_file(self, data_product_id, content):
+        """
+        Point the storage location of the data product at a local file.
+        """
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        file_path = os.path.join(tmp_dir.name, "input.txt")
+        with open(file_path, "wb") as local_file:
+            local_file.write(content)
+        location = DataProduct.objects.get(pk=data_product_id).object.storage_location
+        location.storage_root = StorageRoot.objects.get(root="file:/")
+        location.path = file_path.lstrip("/")
+        location.public = True
+        location.save()
+
+    def test_get_zip_cr_with_local_file(self):
+        content = os.urandom(200000)
+        self._use_local_file(4, content)
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("code_run_ro_crate", kwargs={"pk": 1})
+        with mock.patch("data_management.rocrate.ZIP_BLOCK_SIZE", 1024):
+            response = client.get(url, format="zip", HTTP_ACCEPT="application/zip")
+        self.assertEqual(response.status_code, 200)
+        chunks = list(response.streaming_content)
+        # the file has been read a block at a time
+        self.assertGreater(len(chunks), 5)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("inputs/data/input.txt"), content)
+            self.assertIn("ro-crate-metadata.json", zf.namelist())
+
+    def test_get_zip_cr_too_large(self):
+        self._use_local_file(4, b"0123456789" * 100)
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("code_run_ro_crate", kwargs={"pk": 1})
+        with self.settings(RO_CRATE_MAX_BYTES=100):
+            response = client.get(url, format="zip", HTTP_ACCEPT="application/zip")
+        self.assertEqual(response.status_code, 413)
+
+    def test_get_zip_cr_remote_too_large(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("code_run_ro_crate", kwargs={"pk": 1})
+        remote_url = "https://example.org/remote.csv"
+        with mock.patch(
+            "data_management.rocrate._get_zip_members",
+            return_value=[("remote.csv", remote_url, None)],
+        ), mock.patch("urllib.request.urlopen") as urlopen, self.settings(
+            RO_CRATE_MAX_BYTES=100
+        ):
+            urlopen.return_value.__enter__.return_value.headers = {
+                "Content-Length": "1000"
+            }
+            response = client.get(url, format="zip", HTTP_ACCEPT="application/zip")
+        # the size is found from the Content-Length before the response starts
+        self.assertEqual(response.status_code, 413)
+        (request,), kwargs = urlopen.call_args
+        self.assertEqual(request.full_url, remote_url)
+        self.assertEqual(request.get_method(), "HEAD")
+        self.assertEqual(kwargs["timeout"], REMOTE_FETCH_TIMEOUT)
 
     def test_get_json_ld_dp(self):
         client = APIClient()
@@ -1559,6 +2661,56 @@ class RoCrateAPITest(TestCase):
             response["Content-Type"], f"{self.APPLICATION_JSON_LD}; {self.CHARSET_UTF8}"
         )
 
+    def test_query_count_independent_of_graph_size(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("code_run_ro_crate", kwargs={"pk": 1})
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = client.get(
+                    url,
+                    data={"depth": 3},
+                    format="json-ld",
+                    HTTP_ACCEPT=self.APPLICATION_JSON_LD,
+                )
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        initial_count = count_queries()
+
+        # widen the graph, adding more input data products to the code run
+        code_run = CodeRun.objects.get(pk=1)
+        namespace = Namespace.objects.get(name="prov")
+        storage_root = StorageRoot.objects.get(root="https://example.org/")
+        file_type = FileType.objects.get(extension="txt")
+        for i in range(20):
+            storage_location = StorageLocation.objects.create(
+                updated_by=self.user,
+                path=f"extra/input/{i}",
+                hash=f"extra{i}",
+                storage_root=storage_root,
+            )
+            obj = Object.objects.create(
+                updated_by=self.user,
+                storage_location=storage_location,
+                file_type=file_type,
+            )
+            obj.authors.add(Author.objects.create(updated_by=self.user, name=f"A{i}"))
+            Licence.objects.create(
+                updated_by=self.user, object=obj, licence_info=f"licence {i}"
+            )
+            DataProduct.objects.create(
+                updated_by=self.user,
+                object=obj,
+                namespace=namespace,
+                name=f"extra/input/{i}",
+                version="0.1.0",
+            )
+            code_run.inputs.add(obj.components.first())
+
+        self.assertEqual(count_queries(), initial_count)
+
     def test_get_json_ld_dp_with_depth(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -1573,3 +2725,273 @@ class RoCrateAPITest(TestCase):
         self.assertEqual(
             response["Content-Type"], f"{self.APPLICATION_JSON_LD}; {self.CHARSET_UTF8}"
         )
+
+
+class LineageAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="Test User")
+        init_prov_db()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _get(self, url_name, pk, **params):
+        url = reverse(url_name, kwargs={"pk": pk})
+        return self.client.get(url, data=params, format="json")
+
+    def _results(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [
+            (int(result["url"].rstrip("/").split("/")[-1]), result["depth"])
+            for result in response.json()["results"]
+        ]
+
+    def test_descendants(self):
+        response = self._get("lineage_descendants", 1)
+        self.assertEqual(response.json()["count"], 6)
+        self.assertEqual(
+            self._results(response), [(2, 1), (3, 1), (6, 1), (7, 1), (8, 2), (9, 3)]
+        )
+
+    def test_ancestors(self):
+        response = self._get("lineage_ancestors", 9)
+        self.assertEqual(self._results(response), [(8, 1), (6, 2), (7, 2), (1, 3)])
+
+    def test_depth(self):
+        response = self._get("lineage_descendants", 1, depth=2)
+        self.assertEqual(
+            self._results(response), [(2, 1), (3, 1), (6, 1), (7, 1), (8, 2)]
+        )
+
+    def test_code_runs(self):
+        response = self._get("lineage_ancestors", 9, type="code_run")
+
+        def generated(data_product_id):
+            return CodeRun.objects.get(outputs__object__data_products=data_product_id)
+
+        expected = [(generated(9).id, 1), (generated(8).id, 2)] + sorted(
+            [(generated(6).id, 3), (generated(7).id, 3)]
+        )
+        self.assertEqual(self._results(response), expected)
+
+    def test_count_only(self):
+        response = self._get("lineage_descendants", 1, count_only="true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"count": 6})
+
+    def test_pagination(self):
+        response = self._get("lineage_descendants", 1, page_size=4)
+        self.assertEqual(self._results(response), [(2, 1), (3, 1), (6, 1), (7, 1)])
+        self.assertIsNone(response.json()["previous"])
+
+        response = self.client.get(response.json()["next"], format="json")
+        self.assertEqual(self._results(response), [(8, 2), (9, 3)])
+        self.assertIsNone(response.json()["next"])
+
+        response = self.client.get(response.json()["previous"], format="json")
+        self.assertEqual(self._results(response), [(2, 1), (3, 1), (6, 1), (7, 1)])
+
+    def test_cycle(self):
+        # make data product 1 an output of the code run that used data product 8
+        code_run = CodeRun.objects.get(inputs__object__data_products=8)
+        code_run.outputs.add(ObjectComponent.objects.get(object__data_products=1))
+
+        response = self._get("lineage_descendants", 1)
+        self.assertEqual(
+            self._results(response), [(2, 1), (3, 1), (6, 1), (7, 1), (8, 2), (9, 3)]
+        )
+
+    def test_bad_query(self):
+        for params in ({"depth": "x"}, {"depth": 0}, {"type": "x"}, {"name": "x"}):
+            with self.subTest(params=params):
+                response = self._get("lineage_descendants", 1, **params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_not_found(self):
+        response = self._get("lineage_descendants", 999)
+        self.assertEqual(response.status_code, 404)
+
+    def _add_issue(self, data_product_id):
+        issue = Issue.objects.create(updated_by=self.user, description="Bad data")
+        issue.component_issues.add(
+            ObjectComponent.objects.get(object__data_products=data_product_id)
+        )
+        return issue
+
+    def test_issue_affected_data_products(self):
+        issue = self._add_issue(6)
+        url = reverse("issue-detail", kwargs={"pk": issue.id})
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["affected_data_products"],
+            [
+                f"http://testserver/api/data_product/{data_product_id}/"
+                for data_product_id in (6, 8, 9)
+            ],
+        )
+
+        response = self.client.get(reverse("issue-list"), format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.json()["results"][0]["affected_data_products"]), 3
+        )
+
+    def test_filter_affected_by_issue(self):
+        issue = self._add_issue(7)
+        self._add_issue(12)
+        url = reverse("dataproduct-list")
+        response = self.client.get(
+            url, data={"affected_by_issue": issue.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(
+                int(result["url"].rstrip("/").split("/")[-1])
+                for result in response.json()["results"]
+            ),
+            [7, 8, 9],
+        )
+
+
+@override_settings(REPORT_JOB_WORKERS=0)
+class ReportJobAPITests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="Test User")
+        init_prov_db()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        job_dir = self.settings(REPORT_JOB_DIR=tmp_dir.name)
+        job_dir.enable()
+        self.addCleanup(job_dir.disable)
+
+    def _post(self, url, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, data=data, format="json")
+
+    def test_prov_report_job(self):
+        url = reverse("prov_report", kwargs={"pk": 9})
+        response = self._post(url, format="xml", depth=2)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Location"], response.json()["url"])
+        self.assertEqual(response.json()["status"], "queued")
+        self.assertEqual(response.json()["report_url"], "http://testserver" + url)
+
+        response = self.client.get(response["Location"], format="json")
+        self.assertEqual(response.status_code, 200)
+        job = response.json()
+        self.assertEqual(job["status"], "finished")
+        self.assertEqual(job["format"], "xml")
+
+        response = self.client.get(job["file"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/xml")
+        self.assertIn("prov_report_9.xml", response["Content-Disposition"])
+        report = self.client.get(
+            url, data={"depth": 2}, format="xml", HTTP_ACCEPT="text/xml"
+        )
+        self.assertEqual(b"".join(response.streaming_content), report.content)
+
+    def test_ro_crate_job(self):
+        url = reverse("code_run_ro_crate", kwargs={"pk": 1})
+        response = self._post(url, format="zip")
+        self.assertEqual(response.status_code, 202)
+
+        job = self.client.get(response["Location"], format="json").json()
+        response = self.client.get(job["file"])
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zf:
+            self.assertIn("ro-crate-metadata.json", zf.namelist())
+
+    def test_identical_requests_share_a_job(self):
+        url = reverse("prov_report", kwargs={"pk": 9})
+        with mock.patch(
+            "data_management.prov.serialize_prov_document",
+            wraps=serialize_prov_document,
+        ) as serialize:
+            first = self._post(url, format="json-ld", depth=3).json()
+            second = self._post(url, format="json-ld", depth="3").json()
+            other = self._post(url, format="json-ld", depth=2).json()
+        self.assertEqual(first["id"], second["id"])
+        self.assertEqual(second["status"], "finished")
+        self.assertNotEqual(first["id"], other["id"])
+        self.assertEqual(serialize.call_count, 2)
+
+    def test_failed_job(self):
+        url = reverse("code_run_ro_crate", kwargs={"pk": 1})
+        with self.settings(RO_CRATE_MAX_BYTES=1), self.assertLogs(
+            "data_management.report_jobs", "ERROR"
+        ):
+            first = self._post(url, format="zip").json()
+        job = self.client.get(first["url"], format="json").json()
+        self.assertEqual(job["status"], "failed")
+        self.assertIn("exceed", job["error"])
+        self.assertIsNone(job["file"])
+
+        # a failed job is not shared, the report is generated again
+        second = self._post(url, format="zip").json()
+        self.assertNotEqual(first["id"], second["id"])
+        job = self.client.get(second["url"], format="json").json()
+        self.assertEqual(job["status"], "finished")
+        self.assertEqual(self.client.get(first["url"], format="json").status_code, 404)
+
+    def test_expired_job(self):
+        url = reverse("prov_report", kwargs={"pk": 1})
+        first = self._post(url, format="provn").json()
+        path = report_jobs.get_path(first["id"])
+        self.assertTrue(os.path.exists(path))
+
+        ReportJob.objects.update(expires=timezone.now())
+        second = self._post(url, format="provn").json()
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertFalse(os.path.exists(path))
+        file_url = reverse("report_job_file", kwargs={"pk": first["id"]})
+        self.assertEqual(self.client.get(file_url).status_code, 404)
+
+    def test_purge_interval(self):
+        url = reverse("prov_report", kwargs={"pk": 1})
+        with mock.patch.object(report_jobs, "_last_purge", None):
+            first = self._post(url, format="provn").json()
+            ReportJob.objects.update(expires=timezone.now())
+
+            # the expired job is not purged again until the interval has passed
+            self._post(url, format="xml")
+            self.assertTrue(ReportJob.objects.filter(id=first["id"]).exists())
+
+        out = io.StringIO()
+        call_command("purge_report_jobs", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Removed 1 expired report jobs")
+        self.assertFalse(ReportJob.objects.filter(id=first["id"]).exists())
+        self.assertFalse(os.path.exists(report_jobs.get_path(first["id"])))
+
+    @override_settings(REPORT_JOB_WORKERS=1, REPORT_JOB_QUEUE_DEPTH=1)
+    def test_queue_full(self):
+        url = reverse("prov_report", kwargs={"pk": 1})
+        with mock.patch.object(report_jobs, "_pending", 0), mock.patch.object(
+            report_jobs, "_get_executor"
+        ):
+            # the jobs are never run so stay queued
+            for format_ in ("provn", "xml"):
+                self.assertEqual(self._post(url, format=format_).status_code, 202)
+            response = self._post(url, format="json")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], str(report_jobs.RETRY_AFTER))
+
+            # an identical request still shares its job
+            self.assertEqual(self._post(url, format="xml").status_code, 202)
+        self.assertEqual(ReportJob.objects.count(), 2)
+
+    def test_bad_format(self):
+        url = reverse("prov_report", kwargs={"pk": 1})
+        for data in ({}, {"format": "api"}, {"format": "zip"}):
+            with self.subTest(data=data):
+                response = self._post(url, **data)
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReportJob.objects.exists())
+
+    def test_not_found(self):
+        response = self._post(reverse("prov_report", kwargs={"pk": 999}), format="json")
+        self.assertEqual(response.status_code, 404)
@@ -4,7 +4,14 @@ import sys
 from django.contrib.auth import get_user_model
 from django.core.management import call_command
 from django.test import TestCase
-from data_management.models import Object, StorageLocation, StorageRoot
+from data_management.models import (
+    DataProductLineage,
+    Object,
+    StorageLocation,
+    StorageRoot,
+)
+
+from .init_prov_db import init_db as init_prov_db
 
 
 class AddExampleDataTests(TestCase):
@@ -98,3 +105,18 @@ def _add_object_to_db():
     )
 
     Object.objects.create(updated_by=user, storage_location=sl_code)
+
+
+class RebuildLineageTests(TestCase):
+    def test_command_output(self):
+        """
+        Test `rebuild_lineage` recreates the lineage closure table.
+
+        """
+        get_user_model().objects.create(username="Test User")
+        init_prov_db()
+        DataProductLineage.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_lineage", stdout=out)
+        self.assertIn("Created 19 lineage records", out.getvalue())
+        self.assertEqual(DataProductLineage.objects.count(), 19)
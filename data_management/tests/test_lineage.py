@@ -0,0 +1,365 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+import prov.dot
+
+from data_management import fingerprint, lineage
+from data_management.models import (
+    CodeRun,
+    DataProduct,
+    DataProductLineage,
+    Issue,
+    Namespace,
+    Object,
+    ObjectComponent,
+)
+from data_management.prov import (
+    generate_prov_document,
+    get_data_product_uris,
+    highlight_issues,
+    load_prov_graph,
+)
+
+from .init_prov_db import init_db as init_prov_db
+
+INITIAL_CLOSURE = [
+    (1, 2, 1),
+    (1, 3, 1),
+    (1, 6, 1),
+    (1, 7, 1),
+    (1, 8, 2),
+    (1, 9, 3),
+    (4, 2, 1),
+    (4, 3, 1),
+    (5, 2, 1),
+    (5, 3, 1),
+    (6, 8, 1),
+    (6, 9, 2),
+    (7, 8, 1),
+    (7, 9, 2),
+    (8, 9, 1),
+    (12, 10, 1),
+    (12, 11, 1),
+    (13, 10, 1),
+    (13, 11, 1),
+]
+
+
+class LineageTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="Test User")
+        init_prov_db()
+
+    def _closure(self):
+        return sorted(
+            DataProductLineage.objects.values_list(
+                "ancestor_id", "descendant_id", "distance"
+            )
+        )
+
+    def _component(self, data_product_id):
+        return DataProduct.objects.get(id=data_product_id).object.components.get()
+
+    def _code_run_using(self, data_product_id):
+        return CodeRun.objects.get(inputs=self._component(data_product_id))
+
+    def assertMatchesRebuild(self):
+        closure = self._closure()
+        lineage.rebuild()
+        self.assertEqual(closure, self._closure())
+        # the fingerprints are already up to date
+        self.assertEqual(fingerprint.rebuild(), 0)
+
+    def test_closure_maintained_on_create(self):
+        self.assertEqual(self._closure(), INITIAL_CLOSURE)
+        self.assertMatchesRebuild()
+
+    def test_remove_input(self):
+        code_run = self._code_run_using(6)
+        code_run.inputs.remove(self._component(7))
+
+        closure = self._closure()
+        self.assertNotIn((7, 8, 1), closure)
+        self.assertNotIn((7, 9, 2), closure)
+        # still reachable through data product 6
+        self.assertIn((1, 8, 2), closure)
+        self.assertMatchesRebuild()
+
+        code_run.inputs.remove(self._component(6))
+        closure = self._closure()
+        self.assertNotIn((1, 8, 2), closure)
+        self.assertNotIn((1, 9, 3), closure)
+        self.assertIn((8, 9, 1), closure)
+        self.assertMatchesRebuild()
+
+    def test_add_input(self):
+        code_run = self._code_run_using(6)
+        code_run.inputs.add(self._component(12))
+
+        closure = self._closure()
+        self.assertIn((12, 8, 1), closure)
+        self.assertIn((12, 9, 2), closure)
+        self.assertMatchesRebuild()
+
+    def test_reverse_add_and_clear(self):
+        component = self._component(12)
+        component.inputs_of.add(self._code_run_using(8))
+        self.assertIn((12, 9, 1), self._closure())
+        self.assertMatchesRebuild()
+
+        component.inputs_of.clear()
+        closure = self._closure()
+        self.assertNotIn((12, 9, 1), closure)
+        self.assertNotIn((12, 10, 1), closure)
+        self.assertMatchesRebuild()
+
+    def test_clear_outputs(self):
+        code_run = self._code_run_using(8)
+        code_run.outputs.clear()
+
+        closure = self._closure()
+        self.assertFalse([row for row in closure if row[1] == 9])
+        self.assertMatchesRebuild()
+
+    def test_delete_code_run(self):
+        self._code_run_using(6).delete()
+
+        closure = self._closure()
+        self.assertFalse([row for row in closure if row[1] == 8])
+        self.assertEqual([row for row in closure if row[1] == 9], [(8, 9, 1)])
+        self.assertMatchesRebuild()
+
+    def test_create_data_product_for_used_object(self):
+        # an object that is already an input of the code run for data product 9
+        obj = self._component(8).object
+        namespace = Namespace.objects.first()
+        data_product = DataProduct.objects.create(
+            updated_by=self.user,
+            object=obj,
+            namespace=namespace,
+            name="another/name",
+            version="1.0.0",
+        )
+
+        closure = self._closure()
+        self.assertIn((data_product.id, 9, 1), closure)
+        self.assertIn((1, data_product.id, 2), closure)
+        self.assertMatchesRebuild()
+
+    def test_bulk_create_data_products(self):
+        obj = self._component(8).object
+        namespace = Namespace.objects.first()
+        DataProduct.objects.bulk_create(
+            [
+                DataProduct(
+                    updated_by=self.user,
+                    object=obj,
+                    namespace=namespace,
+                    name="bulk/%d" % i,
+                    version="1.0.0",
+                )
+                for i in range(3)
+            ]
+        )
+
+        self.assertEqual(DataProductLineage.objects.filter(descendant=9).count(), 7)
+        self.assertMatchesRebuild()
+
+    def test_delete_data_product(self):
+        DataProduct.objects.filter(id=9).delete()
+        self.assertFalse([row for row in self._closure() if 9 in row[:2]])
+        self.assertMatchesRebuild()
+
+    def test_move_input_component(self):
+        component = self._component(7)
+        component.object = DataProduct.objects.get(id=12).object
+        # the names of the components of an object are unique
+        component.name = "moved"
+        component.save()
+
+        closure = self._closure()
+        self.assertNotIn((7, 8, 1), closure)
+        self.assertNotIn((7, 9, 2), closure)
+        self.assertIn((12, 8, 1), closure)
+        self.assertIn((12, 9, 2), closure)
+        self.assertEqual(
+            list(
+                DataProductLineage.objects.filter(descendant=8)
+                .order_by("ancestor")
+                .values_list("ancestor", flat=True)
+            ),
+            [1, 6, 12],
+        )
+        self.assertMatchesRebuild()
+
+    def test_move_output_component(self):
+        component = self._component(8)
+        component.object = DataProduct.objects.get(id=13).object
+        # the names of the components of an object are unique
+        component.name = "moved"
+        component.save()
+
+        closure = self._closure()
+        self.assertFalse([row for row in closure if row[1] == 8])
+        self.assertIn((6, 13, 1), closure)
+        self.assertIn((1, 13, 2), closure)
+        self.assertMatchesRebuild()
+
+    def test_save_component_without_moving(self):
+        component = self._component(7)
+        component.description = "A new description"
+        component.save()
+        self.assertEqual(self._closure(), INITIAL_CLOSURE)
+
+    def test_create_object_does_not_change_closure(self):
+        Object.objects.create(updated_by=self.user)
+        self.assertEqual(self._closure(), INITIAL_CLOSURE)
+
+
+class FingerprintTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="Test User")
+        init_prov_db()
+
+    def _fingerprints(self):
+        return dict(DataProduct.objects.values_list("id", "provenance_fingerprint"))
+
+    def _changed(self, before):
+        after = self._fingerprints()
+        self.assertEqual(fingerprint.rebuild(), 0)
+        return {dp_id for dp_id in before if before[dp_id] != after[dp_id]}
+
+    def _code_run_of(self, data_product_id):
+        return CodeRun.objects.get(outputs__object__data_products=data_product_id)
+
+    def test_fingerprints_maintained_on_create(self):
+        fingerprints = self._fingerprints()
+        self.assertTrue(all(fingerprints.values()))
+        self.assertEqual(len(set(fingerprints.values())), len(fingerprints))
+        self.assertEqual(fingerprint.rebuild(), 0)
+
+    def test_storage_change(self):
+        before = self._fingerprints()
+        location = DataProduct.objects.get(id=1).object.storage_location
+        location.hash = "a different hash"
+        location.save()
+        self.assertEqual(self._changed(before), {1, 2, 3, 6, 7, 8, 9})
+
+    def test_code_change(self):
+        before = self._fingerprints()
+        code_run = self._code_run_of(6)
+        code_run.model_config = self._code_run_of(2).model_config
+        code_run.save()
+        self.assertEqual(self._changed(before), {6, 8, 9})
+
+        # the code repo of the other run is stored in the same file
+        code_run.code_repo = self._code_run_of(2).code_repo
+        code_run.save()
+        self.assertEqual(self._changed(before), {6, 8, 9})
+
+    def test_input_change(self):
+        before = self._fingerprints()
+        self._code_run_of(9).inputs.add(
+            ObjectComponent.objects.get(object__data_products=12)
+        )
+        self.assertEqual(self._changed(before), {9})
+
+    def test_identical_recomputation(self):
+        original = DataProduct.objects.get(id=6)
+        location = DataProduct.objects.get(id=2).object.storage_location
+        original.object.storage_location = location
+        original.object.save()
+        original.refresh_from_db()
+
+        code_run = self._code_run_of(6)
+        rerun = CodeRun.objects.create(
+            updated_by=self.user,
+            run_date="2021-07-18T19:21:11Z",
+            description="Rerun",
+            code_repo=code_run.code_repo,
+            model_config=code_run.model_config,
+            submission_script=code_run.submission_script,
+        )
+        rerun.inputs.set(code_run.inputs.all())
+        obj = Object.objects.create(updated_by=self.user, storage_location=location)
+        data_product = DataProduct.objects.create(
+            updated_by=self.user,
+            object=obj,
+            namespace=original.namespace,
+            name="rerun/output",
+            version="1.0.0",
+        )
+        data_product.refresh_from_db()
+        self.assertNotEqual(
+            data_product.provenance_fingerprint, original.provenance_fingerprint
+        )
+
+        rerun.outputs.set([obj.components.first()])
+        data_product.refresh_from_db()
+        self.assertEqual(
+            data_product.provenance_fingerprint, original.provenance_fingerprint
+        )
+        self.assertEqual(
+            set(
+                DataProduct.objects.filter(
+                    provenance_fingerprint=original.provenance_fingerprint
+                ).values_list("id", flat=True)
+            ),
+            {original.id, data_product.id},
+        )
+
+
+class IssueImpactTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="Test User")
+        init_prov_db()
+
+    def _add_issue(self, data_product_id):
+        issue = Issue.objects.create(updated_by=self.user, description="Bad data")
+        issue.component_issues.add(
+            ObjectComponent.objects.get(object__data_products=data_product_id)
+        )
+        return issue
+
+    def test_affected_data_products(self):
+        issue_1 = self._add_issue(1)
+        issue_2 = self._add_issue(8)
+        issue_3 = Issue.objects.create(updated_by=self.user, description="Unused")
+
+        affected = lineage.affected_data_products([issue_1.id, issue_2.id, issue_3.id])
+        self.assertEqual(affected[issue_1.id], {1, 2, 3, 6, 7, 8, 9})
+        self.assertEqual(affected[issue_2.id], {8, 9})
+        self.assertEqual(affected[issue_3.id], set())
+        self.assertEqual(
+            set(lineage.issue_impact([issue_2.id]).values_list("id", flat=True)),
+            {8, 9},
+        )
+
+    def test_affected_data_products_follow_lineage(self):
+        issue = self._add_issue(12)
+        code_run = CodeRun.objects.get(inputs__object__data_products=8)
+        code_run.inputs.add(ObjectComponent.objects.get(object__data_products=10))
+
+        affected = lineage.affected_data_products([issue.id])
+        self.assertEqual(affected[issue.id], {9, 10, 11, 12})
+
+    def test_tainted_data_products(self):
+        self._add_issue(6)
+        self.assertEqual(lineage.tainted_data_products(range(1, 14)), {8, 9})
+
+    def test_highlight_tainted_data_products(self):
+        self._add_issue(6)
+        registry_url = "http://testserver/"
+        data_product = DataProduct.objects.get(id=9)
+        graph = load_prov_graph(data_product, 3)
+        doc = generate_prov_document(data_product, 3, registry_url, graph)
+        tainted = lineage.tainted_data_products(graph.data_products)
+
+        dot = prov.dot.prov_to_dot(doc)
+        highlight_issues(dot, get_data_product_uris(doc, tainted))
+
+        highlighted = sorted(
+            node.get("URL").strip('"').rstrip("/").split("/")[-1]
+            for node in dot.get_node_list()
+            if node.get("color") == "red"
+        )
+        self.assertEqual(highlighted, ["8", "9"])
@@ -0,0 +1,55 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+
+from data_management.models import Object, ObjectComponent
+
+
+class ObjectTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="Test User")
+
+    def _whole_object_components(self, obj):
+        return list(
+            ObjectComponent.objects.filter(object=obj).values_list(
+                "name", "whole_object", "updated_by"
+            )
+        )
+
+    def test_create_adds_whole_object_component(self):
+        # insert the object and its whole object component, with no re-fetch
+        with self.assertNumQueries(2):
+            obj = Object.objects.create(updated_by=self.user)
+
+        self.assertEqual(
+            self._whole_object_components(obj),
+            [("whole_object", True, self.user.id)],
+        )
+
+    def test_update_does_not_add_component(self):
+        obj = Object.objects.create(updated_by=self.user)
+        obj.description = "updated"
+        obj.save()
+
+        self.assertEqual(
+            self._whole_object_components(obj),
+            [("whole_object", True, self.user.id)],
+        )
+
+    def test_bulk_create_adds_whole_object_components(self):
+        objs = Object.objects.bulk_create(
+            [Object(updated_by=self.user, description=str(i)) for i in range(20)]
+        )
+
+        self.assertEqual(len(objs), 20)
+        for obj in objs:
+            self.assertEqual(
+                self._whole_object_components(obj),
+                [("whole_object", True, self.user.id)],
+            )
+
+    def test_bulk_create_with_conflict_handling_is_not_supported(self):
+        with self.assertRaises(ValueError):
+            Object.objects.bulk_create(
+                [Object(updated_by=self.user)], ignore_conflicts=True
+            )
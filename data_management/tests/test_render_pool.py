@@ -0,0 +1,91 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from django.test import SimpleTestCase
+import pydot
+
+from data_management.render_pool import (
+    RenderPool,
+    RenderPoolBusy,
+    RenderTimeout,
+    graphviz_available,
+)
+
+
+class RenderPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _dot(self, script):
+        """
+        Make a graph rendered by a stand in for GraphViz that runs `script`.
+
+        """
+        prog = os.path.join(self.tmp_dir.name, "dot")
+        with open(prog, "w") as f:
+            f.write("#!/bin/sh\n" + script + "\n")
+        os.chmod(prog, stat.S_IRWXU)
+        dot = pydot.Dot()
+        dot.set_prog(prog)
+        dot.add_node(pydot.Node("a"))
+        return dot
+
+    def test_render(self):
+        pool = RenderPool(workers=1, queue_depth=1, timeout=10)
+        dot = self._dot('echo "$1"; cat')
+
+        output = pool.render(dot, "svg")
+        self.assertTrue(output.startswith(b"-Tsvg\n"))
+        self.assertIn(b"a;", output)
+
+        stats = pool.get_stats()
+        self.assertEqual(stats["rendered"], 1)
+        self.assertEqual(stats["pending"], 0)
+        self.assertGreater(stats["render_seconds"], 0)
+
+    def test_failure(self):
+        pool = RenderPool(workers=1, queue_depth=1, timeout=10)
+        with self.assertRaises(RuntimeError):
+            pool.render(self._dot("echo broken >&2; exit 1"), "svg")
+        self.assertEqual(pool.get_stats()["failed"], 1)
+        self.assertEqual(pool.get_stats()["pending"], 0)
+
+    def test_timeout(self):
+        pool = RenderPool(workers=1, queue_depth=1, timeout=0.2)
+        with self.assertRaises(RenderTimeout):
+            pool.render(self._dot("exec sleep 10"), "svg")
+        stats = pool.get_stats()
+        self.assertEqual(stats["timed_out"], 1)
+        self.assertEqual(stats["pending"], 0)
+        self.assertLess(stats["max_render_seconds"], 5)
+
+    def test_busy(self):
+        pool = RenderPool(workers=1, queue_depth=1, timeout=10)
+        slow = self._dot("exec sleep 0.5")
+        threads = [
+            threading.Thread(target=pool.render, args=(slow, "svg")) for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        while pool.get_stats()["pending"] < 2:
+            time.sleep(0.01)
+
+        # one render is running and one is waiting, so the queue is full
+        with self.assertRaises(RenderPoolBusy) as cm:
+            pool.render(slow, "svg")
+        self.assertEqual(cm.exception.retry_after, 10)
+
+        for thread in threads:
+            thread.join()
+        stats = pool.get_stats()
+        self.assertEqual(stats["rendered"], 2)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertGreater(stats["max_queue_wait_seconds"], 0.2)
+
+    def test_graphviz_available(self):
+        self.assertTrue(graphviz_available(self._dot("exit 0").prog))
+        self.assertFalse(graphviz_available(os.path.join(self.tmp_dir.name, "none")))
@@ -3,7 +3,7 @@ from django.utils.text import camel_case_to_spaces
 from django.views.decorators.cache import cache_page
 from rest_framework import routers
 
-from . import views, models, tables
+from . import views, models, tables, lineage
 from .rest import views as api_views
 from . import settings
 from django.conf import settings as conf_settings
@@ -30,6 +30,21 @@ urlpatterns = [
         cache_page(cache_duration)(api_views.ProvReportView.as_view()),
         name="prov_report",
     ),
+    path(
+        "api/prov-report/render-stats/",
+        api_views.ProvRenderStatsView.as_view(),
+        name="prov_render_stats",
+    ),
+    path(
+        "api/report-job/<uuid:pk>/",
+        api_views.ReportJobView.as_view(),
+        name="report_job",
+    ),
+    path(
+        "api/report-job/<uuid:pk>/file/",
+        api_views.ReportJobFileView.as_view(),
+        name="report_job_file",
+    ),
     path(
         "api/ro-crate/data-product/<int:pk>/",
         cache_page(cache_duration)(api_views.DataProductROCrateView.as_view()),
@@ -45,6 +60,16 @@ urlpatterns = [
         cache_page(cache_duration)(api_views.DataExtractionView.as_view()),
         name="data_extraction",
     ),
+    path(
+        "api/lineage/<int:pk>/descendants/",
+        api_views.LineageView.as_view(direction=lineage.DESCENDANTS),
+        name="lineage_descendants",
+    ),
+    path(
+        "api/lineage/<int:pk>/ancestors/",
+        api_views.LineageView.as_view(direction=lineage.ANCESTORS),
+        name="lineage_ancestors",
+    ),
     path("get-token", views.get_token, name="get_token"),
     path("revoke-token", views.revoke_token, name="revoke_token"),
     path("docs/", cache_page(cache_duration)(views.doc_index), name="docs_index"),
@@ -268,9 +268,12 @@ def data_product(request, namespace, data_product_name, version):
     Redirect to the URL of a file given the namespace, data product name and version
     """
     try:
-        namespace = models.Namespace.objects.get(Q(name=namespace))
-        data_product = models.DataProduct.objects.get(
-            Q(name=data_product_name) & Q(namespace=namespace) & Q(version=version)
+        data_product = models.DataProduct.objects.select_related(
+            "object__storage_location__storage_root"
+        ).get(
+            Q(name=data_product_name)
+            & Q(namespace__name=namespace)
+            & Q(version=version)
         )
     except:
         return HttpResponseNotFound()
@@ -95,6 +95,17 @@ REST_FRAMEWORK = {
     "ALLOWED_VERSIONS": ["1.0.0"],
 }
 
+# How list pages count their results, one of "exact", "estimate" or "none", this can
+# be overridden per request with the count query parameter, see
+# data_management/rest/pagination.py
+PAGINATION_COUNT = "exact"
+# The most rows counted when estimating the count of a filtered list
+PAGINATION_COUNT_LIMIT = 10000
+# The most objects that can be created by one request to a bulk endpoint
+BULK_CREATE_MAX_ITEMS = 10000
+# The most data products that can be resolved by one request
+RESOLVE_MAX_ITEMS = 1000
+
 TEST_RUNNER = "django.test.runner.DiscoverRunner"
 
 DATABASES = {
@@ -167,5 +178,58 @@ CRISPY_TEMPLATE_PACK = "bootstrap3"
 CONFIG_LOCATION = ""
 CACHE_DURATION = 0
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Rendered provenance reports, see data_management/report_cache.py. The local
+    # memory cache evicts the least recently used entries once MAX_ENTRIES is reached.
+    "prov_reports": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "prov_reports",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 200},
+    },
+    "prov_fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "prov_fragments",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+# The cache used for rendered provenance reports, set to None to disable caching
+PROV_REPORT_CACHE = "prov_reports"
+
+# The cache used for the provenance of single data products that reports are assembled
+# from, set to None to disable caching
+PROV_FRAGMENT_CACHE = "prov_fragments"
+
+# The number of GraphViz processes each server process runs at once to render provenance
+# report images, the number of further renders that may wait for one before the API
+# responds with 503, and the number of seconds a render may take
+PROV_RENDER_WORKERS = 2
+PROV_RENDER_QUEUE_DEPTH = 8
+PROV_RENDER_TIMEOUT = 60
+
+# Provenance reports and RO Crates can be generated in the background by POSTing to their
+# endpoints. The number of threads in each server process that run the jobs, set to 0 to
+# run a job in the request that created it, the number of further jobs that may wait for
+# one before the API responds with 503, the directory the generated files are kept in,
+# the number of seconds they are kept for and the minimum number of seconds between
+# purges of the expired jobs by the requests creating jobs
+REPORT_JOB_WORKERS = 2
+REPORT_JOB_QUEUE_DEPTH = 8
+REPORT_JOB_DIR = os.path.join(BASE_DIR, "report_jobs")
+REPORT_JOB_TTL = 3600
+REPORT_JOB_PURGE_INTERVAL = 60
+
+# The maximum number of bytes of files bundled into an RO Crate zip file, set to None
+# for no limit
+RO_CRATE_MAX_BYTES = 2 * 1024**3
+
+# The maximum number of code runs followed by the lineage API
+LINEAGE_MAX_DEPTH = 100
+
 AUTHORISED_USER_FILE = ""
 AUTH_METHOD = ""